@@ -0,0 +1,37 @@
+"""
+Servidor de produção: gunicorn gerenciando workers uvicorn.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Cada worker é um processo com seus próprios pools de banco; WEB_CONCURRENCY
+é repassado para a API dividir DB_MAX_CONNECTIONS entre os workers
+(pool_sizing) e PWD_WORKERS é dividido pelo mesmo número para os pools de
+hash de senha não somarem mais processos que CPUs. A migração roda uma vez
+só (GET_LOCK no MySQL) e cada worker só responde 200 em /ready depois de
+aquecer o pool.
+"""
+import os
+
+_cpus = os.cpu_count() or 2
+
+bind = os.getenv("BIND", "0.0.0.0:8001")
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cpus)))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# sem preload: engines, pools e threads (prober, revogação) são criados em
+# cada worker depois do fork
+preload_app = False
+
+# o startup da API faz uma tentativa só e segue em background, então o boot
+# do worker é rápido; timeout alto só para o primeiro create_all/migração
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# recicla workers aos poucos (0 desliga); o jitter evita reinícios simultâneos
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+
+os.environ["WEB_CONCURRENCY"] = str(workers)
+os.environ.setdefault("PWD_WORKERS", str(max(1, _cpus // workers)))
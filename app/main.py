@@ -1,20 +1,217 @@
 # /srv/app/main.py
-import os, re, time
-from datetime import datetime, timedelta
-from typing import Optional, List
+import os, re, io, csv, hmac, json, math, uuid, zlib, time, heapq, base64, calendar, hashlib, threading, asyncio, unicodedata
+import ipaddress
+import multiprocessing
+import anyio.to_thread
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from itertools import islice
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional, List, NamedTuple
 
-from fastapi import FastAPI, HTTPException, Depends, Header
-from pydantic import BaseModel, field_validator
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, field_validator, ValidationError
 from jose import jwt, JWTError
 
 from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, Enum, ForeignKey, Text, inspect, text
+    create_engine, Column, Integer, String, Boolean, Date, DateTime, Enum, ForeignKey, Text, Index,
+    inspect, text, func, and_, or_, case, select, insert, update, delete, bindparam, event, literal, union_all
 )
 from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship
-from sqlalchemy.exc import OperationalError, IntegrityError, ProgrammingError
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import OperationalError, IntegrityError, ProgrammingError, DisconnectionError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 from passlib.context import CryptContext
-PWD_CTX = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
+
+try:
+    import orjson
+except ImportError:  # opcional: sem ele as listagens usam o json da stdlib
+    orjson = None
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # opcional: só para o rate limit compartilhado entre workers
+    redis = None
+
+# Custo do hash configurável. Hashes com menos rounds que o mínimo (ou de
+# esquemas obsoletos) são refeitos no próximo login (needs_update).
+PWD_ROUNDS = int(os.getenv("PWD_ROUNDS", "29000"))
+PWD_BCRYPT_ROUNDS = int(os.getenv("PWD_BCRYPT_ROUNDS", "12"))
+PWD_CTX = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto",
+                       pbkdf2_sha256__default_rounds=PWD_ROUNDS,
+                       pbkdf2_sha256__min_rounds=PWD_ROUNDS,
+                       bcrypt__default_rounds=PWD_BCRYPT_ROUNDS)
+
+# ---------------- Métricas ----------------
+# Histogramas e contadores em memória, expostos em /metrics no formato texto
+# do Prometheus (sem serviço externo). Cada observação é um bisect e um
+# incremento sob lock, barato o bastante para ficar ligado em produção.
+# Os valores são por processo: com vários workers, cada um expõe os seus.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _fmt_labels(names, values) -> str:
+    if not names:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        out += [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in items]
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [contagem por bucket (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            st = self._values.get(labels)
+            if st is None:
+                st = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            st[0][i] += 1
+            st[1] += value
+
+    def count(self, *labels) -> int:
+        st = self._values.get(labels)
+        return sum(st[0]) if st else 0
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+        for k, counts, total in items:
+            acc = 0
+            for le, c in zip(self.buckets + ("+Inf",), counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels + ('le',), k + (le,))} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {acc}")
+        return out
+
+class Gauge:
+    """Gauge calculado na hora da coleta: fn() devolve [(labels, valor)]."""
+    def __init__(self, name: str, help: str, labels, fn):
+        self.name, self.help, self.labels, self.fn = name, help, tuple(labels), fn
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        out += [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in self.fn()]
+        return out
+
+METRICS: list = []
+
+def _metric(m):
+    METRICS.append(m)
+    return m
+
+HTTP_LATENCY = _metric(Histogram("http_request_duration_seconds", "Latência por rota e status",
+                                 ("method", "route", "status")))
+STAGE_LATENCY = _metric(Histogram("app_stage_duration_seconds", "Latência por etapa do request",
+                                  ("stage",)))
+POOL_CHECKOUT = _metric(Histogram("db_pool_checkout_seconds",
+                                  "Tempo para obter conexão do pool (espera + conexão nova)", ("host",)))
+POOL_TIMEOUTS = _metric(Counter("db_pool_timeouts_total", "Checkouts que estouraram pool_timeout", ("host",)))
+POOL_PINGS = _metric(Counter("db_pool_idle_pings_total", "Testes de conexão parada no checkout",
+                             ("host", "result")))
+HOST_DOWN = _metric(Counter("db_host_down_total", "Vezes que o host saiu de rotação", ("host", "role")))
+HOST_RECOVERED = _metric(Counter("db_host_recovered_total", "Vezes que o prober trouxe o host de volta",
+                                 ("host", "role")))
+ENGINE_DISPOSE = _metric(Counter("db_engine_dispose_total", "Chamadas a _dispose_engine após erro de banco",
+                                 ("host",)))
+
+@contextmanager
+def stage(name: str):
+    """Mede uma etapa do request (jwt, user_lookup, query, ...) em STAGE_LATENCY."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - t0, name)
+
+def render_metrics() -> str:
+    return "\n".join(line for m in METRICS for line in m.render()) + "\n"
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sem BaseHTTPMiddleware, que copia o corpo): mede do
+    início do request ao último byte, rotulado pelo template da rota
+    ('/api/tasks/{task_id}', não o path real) para a cardinalidade não explodir.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        status = 500
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_LATENCY.observe(time.perf_counter() - t0, scope["method"], route, str(status))
+
+class _TimedPoolMixin:
+    """Mede o checkout de conexões do pool; metrics_host vem de _create_engine_for."""
+    metrics_host = "?"
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc(self.metrics_host)
+            raise
+        finally:
+            POOL_CHECKOUT.observe(time.perf_counter() - t0, self.metrics_host)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_host = self.metrics_host
+        return pool
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
 
 # ---------------- Config do DB ----------------
 DB_USER = os.getenv("DB_USER", "app_user")
@@ -24,81 +221,381 @@ DB_PORT = int(os.getenv("DB_PORT", "3306"))
 
 DB_HOSTS = [h.strip() for h in os.getenv("DB_HOSTS", os.getenv("DB_HOST", "database")).split(",") if h.strip()]
 
+# Opcional: URL completa com '{host}' (ex.: sqlite:////tmp/tuesday-{host}.db)
+# para rodar testes/benchmarks locais sem MySQL. Cada host de DB_HOSTS vira um banco.
+DB_URL_TEMPLATE = os.getenv("DB_URL_TEMPLATE")
+
 def make_db_url(host: str) -> str:
+    if DB_URL_TEMPLATE:
+        return DB_URL_TEMPLATE.format(host=host)
     return (f"mysql+pymysql://{DB_USER}:{DB_PASS}@{host}:{DB_PORT}/{DB_NAME}"
             f"?charset=utf8mb4&connect_timeout=5")
 
-_engine = None
-_engine_host = None
+# ---------------- Pool de conexões ----------------
+# Tamanho padrão calculado a partir de workers e threads: cada request sync
+# ocupa uma thread e até duas conexões (sessão de leitura + de escrita),
+# então pool_size cobre as threads e o overflow cobre a segunda conexão,
+# tudo dentro de 90% do max_connections do servidor dividido pelos workers.
+# Em vez de pre_ping a cada checkout, só conexões paradas há mais de
+# DB_PING_IDLE segundos são testadas. Checkout que espera mais que
+# DB_POOL_TIMEOUT vira 503 + Retry-After (handler de PoolTimeoutError).
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "151"))
+
+def pool_sizing(workers: int, threads: int, max_connections: int):
+    """(pool_size, max_overflow) por host em cada worker."""
+    budget = max(2, int(max_connections * 0.9) // max(1, workers))
+    size = max(1, min(threads, budget))
+    return size, max(0, min(threads, budget - size))
+
+_POOL_SIZE, _MAX_OVERFLOW = pool_sizing(WEB_CONCURRENCY, THREADPOOL_SIZE, DB_MAX_CONNECTIONS)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(_POOL_SIZE)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(_MAX_OVERFLOW)))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# < 0 desliga; 0 testa em todo checkout (equivale ao pre_ping)
+DB_PING_IDLE = float(os.getenv("DB_PING_IDLE", "30"))
+DB_BUSY_RETRY_AFTER = os.getenv("DB_BUSY_RETRY_AFTER", "1")
+# conexões abertas no startup antes de o worker se declarar pronto (/ready)
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", str(min(4, DB_POOL_SIZE))))
+
+def pool_options() -> dict:
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT, "pool_recycle": DB_POOL_RECYCLE}
+
+def _idle_ping_listeners(host: str):
+    """(checkout, checkin) que testam a conexão só se ficou parada mais que DB_PING_IDLE."""
+    def on_checkin(dbapi_conn, record):
+        record.info["last_used"] = time.monotonic()
+
+    def on_checkout(dbapi_conn, record, proxy):
+        last = record.info.get("last_used")
+        if DB_PING_IDLE < 0 or last is None or time.monotonic() - last < DB_PING_IDLE:
+            return  # conexão nova ou usada há pouco
+        try:
+            cur = dbapi_conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+        except Exception:
+            POOL_PINGS.inc(host, "dead")
+            # o pool descarta esta conexão e tenta outra
+            raise DisconnectionError()
+        POOL_PINGS.inc(host, "ok")
+    return on_checkout, on_checkin
+
+def _install_idle_ping(engine, host: str) -> None:
+    on_checkout, on_checkin = _idle_ping_listeners(host)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
 
 def _create_engine_for(host: str):
-    return create_engine(
+    engine = create_engine(
         make_db_url(host),
-        pool_pre_ping=True,
-        pool_recycle=1800,
-        pool_size=5,
-        max_overflow=10,
+        poolclass=TimedQueuePool,
         future=True,
+        **pool_options(),
     )
+    engine.pool.metrics_host = host
+    _install_idle_ping(engine, host)
+    return engine
+
+# ---------------- Roteamento entre hosts ----------------
+# DB_HOSTS são os candidatos a primário, em ordem de preferência (escritas).
+# DB_REPLICAS são réplicas de leitura (listagem de tarefas e lookup do usuário);
+# sem réplica saudável a leitura vai para o primário. Um prober em background
+# marca hosts up/down com backoff, então o request nunca fica preso no loop
+# de retry: ou há host saudável, ou a resposta é 503 na hora.
+DB_REPLICAS = [h.strip() for h in os.getenv("DB_REPLICAS", "").split(",") if h.strip()]
+DB_PROBE_INTERVAL = float(os.getenv("DB_PROBE_INTERVAL", "2"))
+DB_PROBE_MAX_BACKOFF = float(os.getenv("DB_PROBE_MAX_BACKOFF", "30"))
+
+class NoHealthyHost(Exception):
+    pass
+
+class HostState:
+    def __init__(self, host: str, role: str):
+        self.host, self.role = host, role
+        self.up = None  # None = ainda não testado; conta como candidato
+        self.fails = 0
+        self.next_probe = 0.0
+        self.engine = None
+        self.aengine = None
+
+    def get_engine(self):
+        if self.engine is None:
+            self.engine = _create_engine_for(self.host)
+        return self.engine
 
-def _dispose_engine():
-    global _engine
-    if _engine is not None:
+    def status(self) -> dict:
+        return {"host": self.host, "role": self.role, "up": self.up, "fails": self.fails}
+
+class HostRouter:
+    def __init__(self, primaries: List[str], replicas: List[str]):
+        self.primaries = [HostState(h, "primary") for h in primaries]
+        self.replicas = [HostState(h, "replica") for h in replicas]
+        self._rr = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def state(self, host: str) -> Optional[HostState]:
+        return next((st for st in self.primaries + self.replicas if st.host == host), None)
+
+    def current_primary(self) -> Optional[HostState]:
+        return next((st for st in self.primaries if st.up is not False), None)
+
+    def primary(self) -> HostState:
+        st = self.current_primary()
+        if st is None:
+            # todos fora: testa agora só os que já cumpriram o backoff
+            self.probe_due()
+            st = self.current_primary()
+        if st is None:
+            raise NoHealthyHost("no healthy primary")
+        return st
+
+    def reader(self) -> HostState:
+        healthy = [st for st in self.replicas if st.up is not False]
+        if not healthy:
+            return self.primary()
+        with self._lock:
+            self._rr += 1
+            return healthy[self._rr % len(healthy)]
+
+    def mark_down(self, st: HostState) -> None:
+        with self._lock:
+            st.up = False
+            st.fails += 1
+            HOST_DOWN.inc(st.host, st.role)
+            # 1ª falha: pode testar de novo já no próximo request; depois, backoff exponencial
+            delay = 0 if st.fails == 1 else min(DB_PROBE_MAX_BACKOFF, DB_PROBE_INTERVAL * 2 ** (st.fails - 2))
+            st.next_probe = time.monotonic() + delay
+            eng, st.engine = st.engine, None
+        if eng is not None:
+            try:
+                eng.dispose()
+            except Exception:
+                pass
+
+    def probe(self, st: HostState) -> bool:
         try:
-            _engine.dispose()
+            with st.get_engine().connect() as conn:
+                conn.execute(text("SELECT 1"))
         except Exception:
-            pass
-    _engine = None
+            self.mark_down(st)
+            return False
+        with self._lock:
+            if st.up is False:
+                HOST_RECOVERED.inc(st.host, st.role)
+            st.up, st.fails = True, 0
+            st.next_probe = time.monotonic() + DB_PROBE_INTERVAL
+        return True
+
+    def probe_due(self) -> None:
+        now = time.monotonic()
+        for st in self.primaries + self.replicas:
+            if st.next_probe <= now:
+                self.probe(st)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(DB_PROBE_INTERVAL):
+            self.probe_due()
+            # primário de volta depois de um _dispose_engine: o schema é
+            # reconferido aqui, sem esperar um request (o balanceador só vê /ready)
+            if not _schema_ready and self.current_primary() is not None:
+                recheck_schema()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="db-prober", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> List[dict]:
+        return [st.status() for st in self.primaries + self.replicas]
 
-def pick_engine_with_retry(max_attempts: int = 90):
+ROUTER = HostRouter(DB_HOSTS, DB_REPLICAS)
+
+def _pool_gauge(read):
+    def collect():
+        out = []
+        for st in ROUTER.primaries + ROUTER.replicas:
+            for eng, mode in ((st.engine, "sync"), (st.aengine, "async")):
+                pool = getattr(eng, "pool", None)
+                if pool is not None and hasattr(pool, "checkedout"):
+                    out.append(((st.host, mode), read(pool)))
+        return out
+    return collect
+
+_metric(Gauge("db_pool_checked_out", "Conexões em uso", ("host", "mode"), _pool_gauge(lambda p: p.checkedout())))
+_metric(Gauge("db_pool_overflow", "Conexões além de pool_size (negativo = vagas no pool)", ("host", "mode"),
+              _pool_gauge(lambda p: p.overflow())))
+_metric(Gauge("db_pool_size", "pool_size configurado", ("host", "mode"), _pool_gauge(lambda p: p.size())))
+_metric(Gauge("db_pool_max_overflow", "max_overflow configurado", ("host", "mode"),
+              _pool_gauge(lambda p: p._max_overflow)))
+_metric(Gauge("db_host_up", "1 se o host está em rotação", ("host", "role"),
+              lambda: [((st.host, st.role), 0 if st.up is False else 1)
+                       for st in ROUTER.primaries + ROUTER.replicas]))
+
+def _dispose_engine(host: Optional[str] = None):
     """
-    Escolhe um host válido com retry (até ~90s).
+    Tira o host (padrão: primário atual) de rotação depois de um erro de
+    banco. O próximo request usa o próximo host saudável e o prober traz
+    este de volta quando responder.
     """
-    global _engine, _engine_host
-    wait = 1
-    for _ in range(max_attempts):
-        for host in DB_HOSTS:
-            try:
-                eng = _create_engine_for(host)
-                with eng.connect() as conn:
-                    conn.execute(text("SELECT 1"))
-                _engine, _engine_host = eng, host
-                return
-            except Exception:
-                continue
-        time.sleep(wait)
-        wait = min(5, wait + 1)
-    raise RuntimeError("Could not connect to any DB host")
+    global _schema_ready
+    st = ROUTER.state(host) if host else ROUTER.current_primary()
+    ENGINE_DISPOSE.inc(st.host if st is not None else "none")
+    if st is not None:
+        ROUTER.mark_down(st)
+    if st is None or st.role == "primary":
+        # o próximo host pode não ter o schema: confere de novo na reconexão
+        _schema_ready = False
 
 def get_engine():
-    global _engine
-    if _engine is None:
-        pick_engine_with_retry()
-    return _engine
+    return ROUTER.primary().get_engine()
 
 SessionLocal = sessionmaker(autoflush=False, autocommit=False, future=True)
 
+def _session_for(st: HostState) -> Session:
+    return SessionLocal(bind=st.get_engine(), info={"db_host": st.host})
+
 def db_session() -> Session:
     """
-    Dependência de sessão. Se o pool cair, transforma em 503 e
-    força recriação do engine no próximo request.
+    Dependência de sessão no primário. Se o pool cair, transforma em 503
+    e tira o host de rotação até o prober confirmar que voltou.
     """
     try:
-        db = SessionLocal(bind=get_engine())
+        st = ROUTER.primary()
+    except NoHealthyHost:
+        raise HTTPException(status_code=503, detail="database unavailable")
+    try:
+        db = _session_for(st)
         try:
             yield db
         finally:
             db.close()
     except OperationalError:
-        _dispose_engine()
+        _dispose_engine(st.host)
+        raise HTTPException(status_code=503, detail="database unavailable")
+
+def db_read_session() -> Session:
+    """Como db_session, mas em uma réplica saudável (ou no primário)."""
+    try:
+        st = ROUTER.reader()
+    except NoHealthyHost:
+        raise HTTPException(status_code=503, detail="database unavailable")
+    try:
+        db = _session_for(st)
+        try:
+            yield db
+        finally:
+            db.close()
+    except OperationalError:
+        _dispose_engine(st.host)
+        raise HTTPException(status_code=503, detail="database unavailable")
+
+# ---------------- Modo assíncrono (opcional) ----------------
+# DB_ASYNC=1 troca os handlers principais por versões 'async def' sobre
+# AsyncSession (aiomysql ou asyncmy via DB_ASYNC_DRIVER), mantendo a mesma
+# ordem de failover de DB_HOSTS. O engine sync continua existindo para as
+# migrações e para as rotas que só têm versão sync.
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+DB_ASYNC_DRIVER = os.getenv("DB_ASYNC_DRIVER", "aiomysql")
+
+def make_async_db_url(host: str) -> str:
+    url = make_db_url(host)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url.replace("mysql+pymysql://", f"mysql+{DB_ASYNC_DRIVER}://", 1)
+
+def _create_async_engine_for(host: str):
+    engine = create_async_engine(
+        make_async_db_url(host),
+        poolclass=TimedAsyncQueuePool,
+        **pool_options(),
+    )
+    engine.pool.metrics_host = host
+    _install_idle_ping(engine.sync_engine, host)
+    return engine
+
+def _async_engine(st: HostState):
+    if st.aengine is None:
+        st.aengine = _create_async_engine_for(st.host)
+    return st.aengine
+
+async def _adispose_engine(host: Optional[str] = None):
+    st = ROUTER.state(host) if host else ROUTER.current_primary()
+    if st is not None and st.aengine is not None:
+        eng, st.aengine = st.aengine, None
+        try:
+            await eng.dispose()
+        except Exception:
+            pass
+    _dispose_engine(st.host if st is not None else None)
+
+async def apick_engine():
+    """Engine async do primeiro primário que responder, com o pool já aquecido (ou None)."""
+    for st in ROUTER.primaries:
+        try:
+            engine = _async_engine(st)
+            conns = []
+            try:
+                for _ in range(max(1, DB_POOL_WARM)):
+                    conns.append(await engine.connect())
+                await conns[0].execute(text("SELECT 1"))
+            finally:
+                for c in conns:
+                    await c.close()
+            return engine
+        except Exception:
+            await _adispose_engine(st.host)
+    return None
+
+async def aget_engine():
+    return _async_engine(ROUTER.primary())
+
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+async def _asession(pick) -> AsyncSession:
+    try:
+        st = pick()
+    except NoHealthyHost:
         raise HTTPException(status_code=503, detail="database unavailable")
+    try:
+        db = AsyncSessionLocal(bind=_async_engine(st), info={"db_host": st.host})
+        try:
+            yield db
+        finally:
+            await db.close()
+    except OperationalError:
+        await _adispose_engine(st.host)
+        raise HTTPException(status_code=503, detail="database unavailable")
+
+async def adb_session() -> AsyncSession:
+    """Equivalente async de db_session."""
+    async for db in _asession(ROUTER.primary):
+        yield db
+
+async def adb_read_session() -> AsyncSession:
+    """Equivalente async de db_read_session."""
+    async for db in _asession(ROUTER.reader):
+        yield db
 
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
 JWT_ALG = "HS256"
 JWT_EXPIRES_MIN = int(os.getenv("JWT_EXPIRES_MIN", "120"))
+# jose (padrão), native (HS256 só com hmac/hashlib da stdlib) ou pyjwt (se instalado)
+JWT_BACKEND = os.getenv("JWT_BACKEND", "jose")
 
 Base = declarative_base()
 
+TASK_STATUSES = ("todo", "doing", "done")
+TASK_PRIORITIES = ("low", "medium", "high")
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
@@ -106,6 +603,14 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     name = Column(String(100), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # incrementado a cada troca de credencial; tokens com 'tv' menor são rejeitados
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # quando token_version mudou; o refresh da revogação propaga a troca aos outros workers
+    token_changed_at = Column(DateTime, index=True)
+    # contador de mudanças nas tarefas do usuário (ETag e cursor do feed de mudanças)
+    tasks_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # maior duração (s) já gravada numa tarefa do usuário; limita o scan de /api/tasks/range
+    max_task_span = Column(Integer, nullable=False, default=0, server_default="0")
     tasks = relationship("Task", back_populates="owner", cascade="all,delete")
 
 class Task(Base):
@@ -116,12 +621,128 @@ class Task(Base):
     description = Column(Text)
     start_at = Column(DateTime, nullable=False)
     end_at = Column(DateTime, nullable=False)
-    status = Column(Enum("todo","doing","done", name="task_status"), default="todo")
-    priority = Column(Enum("low","medium","high", name="task_priority"), default="medium")
+    status = Column(Enum(*TASK_STATUSES, name="task_status"), default="todo")
+    priority = Column(Enum(*TASK_PRIORITIES, name="task_priority"), default="medium")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # users.tasks_version da última escrita nesta tarefa
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     owner = relationship("User", back_populates="tasks")
 
+    # mesmo formato da consulta paginada: WHERE owner_id=? ORDER BY start_at, id
+    # (owner_id, status, end_at): contagem de atrasadas em /api/tasks/stats
+    __table_args__ = (Index("idx_tasks_owner_start", "owner_id", "start_at", "id"),
+                      Index("idx_tasks_owner_version", "owner_id", "version"),
+                      Index("idx_tasks_owner_status_end", "owner_id", "status", "end_at"),
+                      # (status, end_at): o arquivamento procura as 'done' antigas de todos os donos
+                      Index("idx_tasks_status_end", "status", "end_at", "id"),
+                      # busca (/api/tasks/search); fora do MySQL vale o índice em memória
+                      Index("ftx_tasks_title_description", "title", "description",
+                            mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"))
+
+class TaskArchive(Base):
+    """
+    Tarefas 'done' antigas, movidas de tasks pelo arquivamento (mesmo id e
+    colunas). Ficam fora da tabela quente; /api/tasks?include_archived=true
+    lê as duas.
+    """
+    __tablename__ = "tasks_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    title = Column(String(200), nullable=False)
+    description = Column(Text)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    status = Column(Enum(*TASK_STATUSES, name="task_status"), default="done")
+    priority = Column(Enum(*TASK_PRIORITIES, name="task_priority"), default="medium")
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    archived_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index("idx_tasks_archive_owner_start", "owner_id", "start_at", "id"),)
+
+class TaskTombstone(Base):
+    """Registro de tarefa apagada, para o feed de mudanças."""
+    __tablename__ = "task_tombstones"
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("idx_tombstones_owner_version", "owner_id", "version"),)
+
+class TaskRule(Base):
+    """
+    Tarefa recorrente: a 1ª ocorrência (start_at/end_at) e a regra RRULE.
+    As ocorrências não viram linhas em tasks; são geradas por janela.
+    """
+    __tablename__ = "task_rules"
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    title = Column(String(200), nullable=False)
+    description = Column(Text)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    rrule = Column(String(255), nullable=False)
+    # fim da última ocorrência (UNTIL/COUNT); NULL = sem fim
+    last_end = Column(DateTime)
+    status = Column(Enum(*TASK_STATUSES, name="task_status"), default="todo")
+    priority = Column(Enum(*TASK_PRIORITIES, name="task_priority"), default="medium")
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("idx_task_rules_owner_start", "owner_id", "start_at"),)
+
+class TaskRuleException(Base):
+    """Exceção de uma ocorrência (pelo início original): cancelada ou alterada."""
+    __tablename__ = "task_rule_exceptions"
+    rule_id = Column(Integer, ForeignKey("task_rules.id", ondelete="CASCADE"), primary_key=True)
+    occurrence_at = Column(DateTime, primary_key=True)
+    cancelled = Column(Boolean, nullable=False, default=False, server_default="0")
+    title = Column(String(200))
+    start_at = Column(DateTime)
+    end_at = Column(DateTime)
+    status = Column(Enum(*TASK_STATUSES, name="task_status"))
+
+class RevokedToken(Base):
+    """Token revogado (logout) até expirar, pela claim 'jti'."""
+    __tablename__ = "revoked_tokens"
+    jti = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+def _ascii_bin(n: int):
+    return String(n).with_variant(mysql.VARCHAR(n, charset="ascii", collation="ascii_bin"), "mysql")
+
+class IdempotencyKey(Base):
+    """Resposta de um POST com Idempotency-Key, devolvida de novo aos retries até expirar."""
+    __tablename__ = "idempotency_keys"
+    # ascii_bin no MySQL: chaves diferenciam maiúsculas e a PK fica compacta
+    scope = Column(_ascii_bin(32), primary_key=True)  # 'register' ou 'tasks:<owner_id>'
+    key = Column(_ascii_bin(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index("idx_idempotency_scope_expires", "scope", "expires_at"),)
+
+class TaskCount(Base):
+    """Quantas tarefas o dono tem por (status, prioridade); mantido junto com as escritas."""
+    __tablename__ = "task_counts"
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String(16), primary_key=True)
+    priority = Column(String(16), primary_key=True)
+    n = Column(Integer, nullable=False, default=0)
+
+class TaskDayCount(Base):
+    """Quantas tarefas do dono começam em cada dia (carga diária)."""
+    __tablename__ = "task_day_counts"
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    n = Column(Integer, nullable=False, default=0)
+
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
 class RegisterIn(BaseModel):
@@ -149,6 +770,10 @@ class LoginIn(BaseModel):
             raise ValueError("invalid email format")
         return v
 
+class PasswordChangeIn(BaseModel):
+    current_password: str
+    new_password: str
+
 class TaskIn(BaseModel):
     title: str
     description: Optional[str] = None
@@ -157,6 +782,23 @@ class TaskIn(BaseModel):
     status: Optional[str] = "todo"
     priority: Optional[str] = "medium"
 
+class RuleIn(TaskIn):
+    # start_at/end_at: a 1ª ocorrência; rrule: ex. "FREQ=WEEKLY;BYDAY=MO,WE;COUNT=20"
+    rrule: str
+
+class RuleExceptionIn(BaseModel):
+    occurrence_at: datetime  # início original da ocorrência
+    cancelled: bool = False
+    title: Optional[str] = None
+    start_at: Optional[datetime] = None
+    end_at: Optional[datetime] = None
+    status: Optional[str] = None
+
+class TaskBatchIn(BaseModel):
+    # cada item: {"op": "create"|"update"|"delete", "id": int?, "task": {...TaskIn}?}
+    # validado item a item em apply_task_batch para o erro sair por posição
+    ops: List[dict]
+
 class TaskOut(BaseModel):
     id: int
     title: str
@@ -168,167 +810,2758 @@ class TaskOut(BaseModel):
     class Config:
         from_attributes = True 
 
-def hash_pw(p: str) -> str:
-    return PWD_CTX.hash(p)
+# ---------------- JSON rápido ----------------
+# As listagens selecionam só as colunas de TaskOut (Core, tuplas, sem
+# entidades ORM) e codificam direto com orjson, sem montar um TaskOut por
+# linha. TaskOut continua sendo o contrato (response_model/OpenAPI); a
+# checagem abaixo, no import, garante que o atalho bate com ele.
+TASK_OUT_COLUMNS = tuple(TaskOut.model_fields)
 
-def check_pw(p: str, h: str) -> bool:
-    try:
-        return PWD_CTX.verify(p, h)
-    except Exception:
-        return False
+def _check_task_out_columns() -> None:
+    cols = Task.__table__.c
+    for name, field in TaskOut.model_fields.items():
+        if name not in cols:
+            raise RuntimeError(f"TaskOut.{name} has no column in tasks")
+        ann = field.annotation
+        py = next((a for a in getattr(ann, "__args__", (ann,)) if a is not type(None)), ann)
+        if not issubclass(cols[name].type.python_type, py):
+            raise RuntimeError(f"TaskOut.{name} is {py.__name__}, column is {cols[name].type.python_type.__name__}")
 
-def mk_token(user: User) -> str:
-    now = datetime.utcnow()
-    payload = {"sub": str(user.id), "email": user.email, "name": user.name,
-               "iat": now, "exp": now + timedelta(minutes=JWT_EXPIRES_MIN)}
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
+_check_task_out_columns()
+TASK_OUT_SELECT = tuple(Task.__table__.c[c] for c in TASK_OUT_COLUMNS)
 
-def get_current_user(authorization: Optional[str] = Header(default=None),
-                     db: Session = Depends(db_session)) -> User:
-    if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="missing token")
-    token = authorization[7:]
-    try:
-        data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        uid = int(data["sub"])
-    except JWTError:
-        raise HTTPException(status_code=401, detail="invalid token")
-    user = db.get(User, uid)
-    if not user:
-        raise HTTPException(status_code=401, detail="user not found")
-    return user
+def _json_default(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    raise TypeError(f"{type(v).__name__} is not JSON serializable")
 
-def ensure_schema(db: Session) -> None:
+def dumps_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+def task_dicts(rows) -> List[dict]:
+    """Tuplas na ordem de TASK_OUT_COLUMNS -> dicts no formato de TaskOut."""
+    return [dict(zip(TASK_OUT_COLUMNS, r)) for r in rows]
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+# ---------------- Paginação / filtros de tarefas ----------------
+TASKS_PAGE_DEFAULT = int(os.getenv("TASKS_PAGE_DEFAULT", "200"))
+TASKS_PAGE_MAX = int(os.getenv("TASKS_PAGE_MAX", "1000"))
+
+class TaskFilters(BaseModel):
+    status: Optional[List[str]] = None
+    priority: Optional[List[str]] = None
+    start_from: Optional[datetime] = None
+    start_to: Optional[datetime] = None
+    end_from: Optional[datetime] = None
+    end_to: Optional[datetime] = None
+
+def task_filters(status: Optional[List[str]] = Query(default=None),
+                 priority: Optional[List[str]] = Query(default=None),
+                 start_from: Optional[datetime] = None,
+                 start_to: Optional[datetime] = None,
+                 end_from: Optional[datetime] = None,
+                 end_to: Optional[datetime] = None) -> TaskFilters:
     """
-    Garante que 'users' e 'tasks' existam. Evita 500 se o primeiro request
-    chegar antes do create_all do startup.
+    Dependência com os filtros server-side de /api/tasks.
+    status/priority aceitam repetição (?status=todo&status=doing).
+    Janelas: *_from é inclusivo, *_to é exclusivo.
     """
-    try:
-        bind = db.get_bind()
-        insp = inspect(bind)
-        need = (not insp.has_table("users")) or (not insp.has_table("tasks"))
-    except Exception:
-        need = True
-    if need:
-        Base.metadata.create_all(bind=bind)
+    if status and any(v not in TASK_STATUSES for v in status):
+        raise HTTPException(status_code=400, detail="invalid status filter")
+    if priority and any(v not in TASK_PRIORITIES for v in priority):
+        raise HTTPException(status_code=400, detail="invalid priority filter")
+    return TaskFilters(status=status, priority=priority,
+                       start_from=start_from, start_to=start_to,
+                       end_from=end_from, end_to=end_to)
 
-app = FastAPI(title="Tuesday API")
+def task_order(order: str = "asc") -> bool:
+    """Dependência com a ordem de /api/tasks por (start_at, id): True para 'desc'."""
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="invalid order")
+    return order == "desc"
 
-@app.on_event("startup")
-def _startup_migrate():
-    pick_engine_with_retry()
-    for _ in range(60):
-        try:
-            Base.metadata.create_all(get_engine())
-            with get_engine().connect() as conn:
-                conn.execute(text("SELECT 1"))
-            return
-        except OperationalError:
-            time.sleep(1)
+def apply_task_filters(q, f: TaskFilters, T=Task):
+    """Aplica os filtros em uma Query ORM ou em um select() Core (T: Task ou TaskArchive)."""
+    if f.status:
+        q = q.where(T.status.in_(f.status))
+    if f.priority:
+        q = q.where(T.priority.in_(f.priority))
+    if f.start_from is not None:
+        q = q.where(T.start_at >= f.start_from)
+    if f.start_to is not None:
+        q = q.where(T.start_at < f.start_to)
+    if f.end_from is not None:
+        q = q.where(T.end_at >= f.end_from)
+    if f.end_to is not None:
+        q = q.where(T.end_at < f.end_to)
+    return q
 
-@app.get("/health")
-def health():
+def encode_cursor(start_at: datetime, task_id: int) -> str:
+    """Cursor opaco da paginação keyset: base64url de 'start_at|id'."""
+    raw = f"{start_at.isoformat()}|{task_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Inverso de encode_cursor. Levanta ValueError para cursores inválidos."""
     try:
-        with get_engine().connect() as conn:
-            ok = conn.execute(text("SELECT 1")).scalar() == 1
-        return {"status": "ok" if ok else "degraded", "service": "api", "db_host": _engine_host}
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        start_s, id_s = raw.split("|", 1)
+        return datetime.fromisoformat(start_s), int(id_s)
     except Exception:
-        return {"status": "degraded", "service": "api", "db_host": _engine_host}
+        raise ValueError("invalid cursor")
 
-
-@app.post("/auth/register")
-def register(payload: RegisterIn, db: Session = Depends(db_session)):
+def apply_keyset(q, cursor: Optional[str], desc: bool = False, T=Task):
+    """
+    Continua a leitura depois de (start_at, id) do cursor. A condição em OR
+    casa com o índice (owner_id, start_at, id), então cada página é um
+    range scan de tamanho 'limit', independente de quantas tarefas existem.
+    Com desc=True a leitura anda para trás no mesmo índice.
+    """
+    if not cursor:
+        return q
     try:
-        ensure_schema(db)
-        if db.query(User).filter(User.email == payload.email).first():
-            raise HTTPException(status_code=409, detail="email already in use")
+        c_start, c_id = decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if desc:
+        return q.where(or_(T.start_at < c_start,
+                           and_(T.start_at == c_start, T.id < c_id)))
+    return q.where(or_(T.start_at > c_start,
+                       and_(T.start_at == c_start, T.id > c_id)))
 
-        u = User(email=payload.email,
-                 name=payload.name.strip(),
-                 password_hash=hash_pw(payload.password))
-        db.add(u); db.commit(); db.refresh(u)
-        return {"accessToken": mk_token(u)}
+# ---------------- Hash de senha (pool de processos) ----------------
+# O hash é CPU puro: roda em um pool de processos limitado para não prender
+# o threadpool do Starlette. Com mais de PWD_MAX_PENDING hashes em andamento
+# o request falha na hora com 503 + Retry-After em vez de enfileirar.
+# PWD_WORKERS=0 faz o hash no próprio processo (sem pool).
+PWD_WORKERS = int(os.getenv("PWD_WORKERS", str(os.cpu_count() or 2)))
+PWD_MAX_PENDING = int(os.getenv("PWD_MAX_PENDING", str(max(1, PWD_WORKERS) * 4)))
 
-    except IntegrityError:
-        db.rollback()
-        raise HTTPException(status_code=409, detail="email already in use")
-    except (OperationalError, ProgrammingError):
-        db.rollback(); _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
-    except HTTPException:
-        raise
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"register failed: {type(e).__name__}")
+_pwd_pool = None
+_pwd_pool_lock = threading.Lock()
+_pwd_slots = threading.BoundedSemaphore(PWD_MAX_PENDING)
 
-@app.post("/auth/login")
-def login(payload: LoginIn, db: Session = Depends(db_session)):
-    try:
-        ensure_schema(db)
-        u = db.query(User).filter(User.email == payload.email).first()
-    except (OperationalError, ProgrammingError):
-        _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
-    if not u or not check_pw(payload.password, u.password_hash):
-        raise HTTPException(status_code=401, detail="invalid credentials")
-    return {"accessToken": mk_token(u)}
+def _hash_password(p: str) -> str:
+    return PWD_CTX.hash(p)
 
-@app.get("/api/tasks", response_model=List[TaskOut])
-def list_tasks(current: User = Depends(get_current_user), db: Session = Depends(db_session)):
+def _verify_password(p: str, h: str):
+    """(ok, novo_hash_ou_None) — novo hash quando needs_update."""
     try:
-        ensure_schema(db)
-        return (db.query(Task)
-                .filter_by(owner_id=current.id)
-                .order_by(Task.start_at).all())
-    except (OperationalError, ProgrammingError):
-        _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
+        return PWD_CTX.verify_and_update(p, h)
+    except Exception:
+        return False, None
 
-@app.post("/api/tasks", status_code=201)
-def create_task(payload: TaskIn, current: User = Depends(get_current_user), db: Session = Depends(db_session)):
-    if payload.end_at <= payload.start_at:
-        raise HTTPException(status_code=400, detail="end_at must be after start_at")
+def _pwd_executor() -> ProcessPoolExecutor:
+    global _pwd_pool
+    if _pwd_pool is None:
+        with _pwd_pool_lock:
+            if _pwd_pool is None:
+                # spawn: o app já tem threads (uvicorn/anyio), fork não é seguro
+                _pwd_pool = ProcessPoolExecutor(max_workers=PWD_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _pwd_pool
+
+def _pwd_busy() -> HTTPException:
+    return HTTPException(status_code=503, detail="password hashing busy",
+                         headers={"Retry-After": "1"})
+
+def _run_pw(fn, *args):
+    if PWD_WORKERS <= 0:
+        return fn(*args)
+    if not _pwd_slots.acquire(blocking=False):
+        raise _pwd_busy()
     try:
-        ensure_schema(db)
-        t = Task(owner_id=current.id, **payload.model_dump())
-        db.add(t); db.commit(); db.refresh(t)
-        return {"id": t.id}
-    except (OperationalError, ProgrammingError):
-        db.rollback(); _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
+        return _pwd_executor().submit(fn, *args).result()
+    finally:
+        _pwd_slots.release()
 
-@app.put("/api/tasks/{task_id}")
-def update_task(task_id: int, payload: TaskIn, current: User = Depends(get_current_user), db: Session = Depends(db_session)):
+async def _arun_pw(fn, *args):
+    """Versão async de _run_pw: espera o pool sem ocupar thread."""
+    if PWD_WORKERS <= 0:
+        return await run_in_threadpool(fn, *args)
+    if not _pwd_slots.acquire(blocking=False):
+        raise _pwd_busy()
     try:
-        ensure_schema(db)
-        t = db.query(Task).filter_by(id=task_id, owner_id=current.id).first()
-    except (OperationalError, ProgrammingError):
-        _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
-    if not t:
-        raise HTTPException(status_code=404, detail="not found")
-    for k, v in payload.model_dump(exclude_unset=True).items():
-        setattr(t, k, v)
+        return await asyncio.wrap_future(_pwd_executor().submit(fn, *args))
+    finally:
+        _pwd_slots.release()
+
+def hash_pw(p: str) -> str:
+    with stage("password_hash"):
+        return _run_pw(_hash_password, p)
+
+def verify_pw(p: str, h: str):
+    with stage("password_hash"):
+        return _run_pw(_verify_password, p, h)
+
+def check_pw(p: str, h: str) -> bool:
+    return verify_pw(p, h)[0]
+
+async def ahash_pw(p: str) -> str:
+    with stage("password_hash"):
+        return await _arun_pw(_hash_password, p)
+
+async def averify_pw(p: str, h: str):
+    with stage("password_hash"):
+        return await _arun_pw(_verify_password, p, h)
+
+# ---------------- JWT ----------------
+class InvalidToken(ValueError):
+    pass
+
+def _b64url(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _b64url_decode(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+_NATIVE_HEADER = _b64url(json.dumps({"alg": JWT_ALG, "typ": "JWT"}, separators=(",", ":")).encode())
+
+def _native_encode(payload: dict, secret: str) -> str:
+    body = _b64url(json.dumps(payload, separators=(",", ":")).encode())
+    signing = f"{_NATIVE_HEADER}.{body}".encode()
+    return f"{_NATIVE_HEADER}.{body}.{_b64url(hmac.new(secret.encode(), signing, hashlib.sha256).digest())}"
+
+def _native_decode(token: str, secret: str) -> dict:
+    """HS256 com hmac da stdlib: confere alg, assinatura (tempo constante), exp e nbf."""
     try:
-        db.commit()
-        return {"id": t.id}
-    except (OperationalError, ProgrammingError):
-        db.rollback(); _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
+        head, body, sig = token.split(".")
+        if json.loads(_b64url_decode(head)).get("alg") != JWT_ALG:
+            raise InvalidToken("unexpected alg")
+        expected = hmac.new(secret.encode(), f"{head}.{body}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64url_decode(sig)):
+            raise InvalidToken("bad signature")
+        claims = json.loads(_b64url_decode(body))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise InvalidToken(str(e))
+    now = time.time()
+    if "exp" in claims and now >= float(claims["exp"]):
+        raise InvalidToken("expired")
+    if "nbf" in claims and now < float(claims["nbf"]):
+        raise InvalidToken("not yet valid")
+    return claims
 
-@app.delete("/api/tasks/{task_id}", status_code=204)
-def delete_task(task_id: int, current: User = Depends(get_current_user), db: Session = Depends(db_session)):
+def _jose_decode(token: str, secret: str) -> dict:
     try:
-        ensure_schema(db)
-        t = db.query(Task).filter_by(id=task_id, owner_id=current.id).first()
-    except (OperationalError, ProgrammingError):
-        _dispose_engine()
-        raise HTTPException(status_code=503, detail="database unavailable")
-    if not t:
+        return jwt.decode(token, secret, algorithms=[JWT_ALG])
+    except JWTError as e:
+        raise InvalidToken(str(e))
+
+def _jwt_backend(name: str):
+    """(encode, decode) do backend escolhido em JWT_BACKEND."""
+    if name == "jose":
+        return (lambda payload, secret: jwt.encode(payload, secret, algorithm=JWT_ALG)), _jose_decode
+    if name == "native":
+        return _native_encode, _native_decode
+    if name == "pyjwt":
+        try:
+            import jwt as pyjwt  # PyJWT; opcional
+        except ImportError:
+            raise RuntimeError("JWT_BACKEND=pyjwt requires the PyJWT package")
+
+        def decode(token: str, secret: str) -> dict:
+            try:
+                return pyjwt.decode(token, secret, algorithms=[JWT_ALG])
+            except pyjwt.PyJWTError as e:
+                raise InvalidToken(str(e))
+        return (lambda payload, secret: pyjwt.encode(payload, secret, algorithm=JWT_ALG)), decode
+    raise RuntimeError(f"unknown JWT_BACKEND {name!r}")
+
+jwt_encode, jwt_decode = _jwt_backend(JWT_BACKEND)
+
+def mk_token(user: User) -> str:
+    now = int(time.time())
+    payload = {"sub": str(user.id), "email": user.email, "name": user.name,
+               "tv": user.token_version or 0, "jti": uuid.uuid4().hex,
+               "iat": now, "exp": now + JWT_EXPIRES_MIN * 60}
+    return jwt_encode(payload, JWT_SECRET)
+
+# Tokens já verificados, pela sha256 do token: o Streamlit manda o mesmo
+# bearer a cada rerun, então a maioria dos requests pula base64 + HMAC +
+# validação de claims. Cada entrada expira junto com o 'exp' do token.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL", "300"))
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def verified_claims(token: str) -> dict:
+    """Claims de um JWT válido, pelo cache de tokens verificados. Levanta InvalidToken."""
+    key = token_digest(token)
+    data = TOKEN_CACHE.get(key)
+    if data is None:
+        try:
+            data = jwt_decode(token, JWT_SECRET)
+            int(data["sub"])
+        except (KeyError, ValueError, TypeError):
+            raise InvalidToken("invalid claims")
+        ttl = min(TOKEN_CACHE_MAX_TTL, float(data.get("exp", 0)) - time.time())
+        if ttl > 0:
+            TOKEN_CACHE.set(key, data, ttl)
+    return data
+
+def token_claims(authorization: Optional[str]) -> dict:
+    """Valida o header Authorization e devolve as claims do JWT."""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="missing token")
+    with stage("jwt"):
+        try:
+            data = verified_claims(authorization[7:])
+        except InvalidToken:
+            raise HTTPException(status_code=401, detail="invalid token")
+        if data.get("jti") in REVOKED:
+            raise HTTPException(status_code=401, detail="token revoked")
+    return data
+
+# ---------------- Revogação (logout) ----------------
+REVOKED_REFRESH = float(os.getenv("REVOKED_REFRESH", "5"))
+TOKEN_CHANGE_SLACK = float(os.getenv("TOKEN_CHANGE_SLACK", "60"))
+
+class RevocationList:
+    """
+    Cópia em memória dos jti revogados e ainda não expirados. O logout
+    grava em revoked_tokens e atualiza o processo local na hora; os demais
+    workers recarregam a tabela a cada REVOKED_REFRESH segundos. No mesmo
+    ciclo, quem trocou token_version (troca de senha em outro worker) sai do
+    USER_CACHE local.
+    """
+    def __init__(self):
+        self._jtis = {}  # jti -> exp (epoch)
+        self._tv_checked = None  # utcnow da última varredura de users.token_changed_at
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __contains__(self, jti) -> bool:
+        exp = self._jtis.get(jti) if jti else None
+        return exp is not None and exp > time.time()
+
+    def add(self, jti: str, exp: float) -> None:
+        with self._lock:
+            self._jtis[jti] = exp
+
+    def refresh(self, conn) -> None:
+        t = RevokedToken.__table__
+        rows = conn.execute(select(t.c.jti, t.c.expires_at).where(t.c.expires_at > datetime.utcnow())).all()
+        fresh = {jti: calendar.timegm(exp.utctimetuple()) for jti, exp in rows}
+        with self._lock:
+            # mantém os adicionados localmente que a réplica ainda não mostra
+            now = time.time()
+            fresh.update({j: e for j, e in self._jtis.items() if e > now and j not in fresh})
+            self._jtis = fresh
+        self.refresh_token_versions(conn)
+
+    def refresh_token_versions(self, conn) -> None:
+        """
+        Tira do USER_CACHE os usuários cujo token_version mudou desde a última
+        varredura. A janela recua TOKEN_CHANGE_SLACK segundos para cobrir atraso
+        da réplica e relógios diferentes; revisitar uma troca só custa um reload.
+        """
+        now = datetime.utcnow()
+        since = (self._tv_checked or now) - timedelta(seconds=TOKEN_CHANGE_SLACK)
+        u = User.__table__
+        for uid, in conn.execute(select(u.c.id).where(u.c.token_changed_at > since)):
+            USER_CACHE.pop(uid)
+        self._tv_checked = now
+
+    def _loop(self) -> None:
+        while not self._stop.wait(REVOKED_REFRESH):
+            try:
+                with ROUTER.reader().get_engine().connect() as conn:
+                    self.refresh(conn)
+            except Exception:
+                pass  # banco fora: fica com a última cópia; o prober cuida do host
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="revocation-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def __len__(self) -> int:
+        return len(self._jtis)
+
+REVOKED = RevocationList()
+
+def revoke_token(db: Session, claims: dict) -> None:
+    """Grava o jti como revogado até o exp do token e limpa os já expirados do usuário."""
+    t = RevokedToken.__table__
+    exp = datetime.utcfromtimestamp(float(claims["exp"]))
+    db.execute(delete(t).where(t.c.user_id == int(claims["sub"]), t.c.expires_at < datetime.utcnow()))
+    db.merge(RevokedToken(jti=claims["jti"], user_id=int(claims["sub"]), expires_at=exp))
+    db.commit()
+
+# ---------------- Idempotência ----------------
+# POST /api/tasks e /auth/register aceitam Idempotency-Key. A resposta é
+# gravada na mesma transação da escrita; um retry com a mesma chave recebe a
+# resposta gravada sem novo INSERT. Dois requests simultâneos com a mesma
+# chave são resolvidos pela PK (scope, key): o segundo falha no commit, faz
+# rollback e devolve a resposta do primeiro. Nenhum lock dura além da transação.
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_KEY_MAX = 64
+
+class Idempotency:
+    """Chave de um request e o hash do corpo (HMAC: o corpo do register tem a senha)."""
+    def __init__(self, scope: str, key: str, payload: BaseModel):
+        self.scope, self.key = scope, key
+        body = json.dumps(payload.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+        self.request_hash = hmac.new(JWT_SECRET.encode(), body.encode(), hashlib.sha256).hexdigest()
+
+def idempotency(scope: str, key: Optional[str], payload: BaseModel) -> Optional[Idempotency]:
+    """Idempotency a partir do header (None sem header). Chave inválida → 400."""
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX or not key.isascii() or not key.isprintable():
+        raise HTTPException(status_code=400, detail="invalid Idempotency-Key")
+    return Idempotency(scope, key, payload)
+
+def idempotent_replay(db: Session, idem: Optional[Idempotency]) -> Optional[dict]:
+    """Corpo gravado para a chave (ou None). Mesma chave com outro corpo → 422."""
+    if idem is None:
+        return None
+    t = IdempotencyKey.__table__
+    row = db.execute(select(t.c.request_hash, t.c.response)
+                     .where(t.c.scope == idem.scope, t.c.key == idem.key,
+                            t.c.expires_at > datetime.utcnow())).first()
+    if row is None:
+        return None
+    if not hmac.compare_digest(row.request_hash, idem.request_hash):
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+    return json.loads(row.response)
+
+def store_idempotent(db: Session, idem: Optional[Idempotency], status_code: int, body: dict) -> None:
+    """Grava a resposta antes do commit da escrita; chave concorrente → IntegrityError no commit."""
+    if idem is None:
+        return
+    t = IdempotencyKey.__table__
+    now = datetime.utcnow()
+    # limpa as expiradas do escopo (inclusive esta chave, se for reuso depois do TTL)
+    db.execute(delete(t).where(t.c.scope == idem.scope, t.c.expires_at <= now))
+    db.execute(insert(t).values(scope=idem.scope, key=idem.key, request_hash=idem.request_hash,
+                                status_code=status_code, response=json.dumps(body),
+                                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL)))
+
+def _replayed(response: Response) -> None:
+    response.headers["Idempotent-Replayed"] = "true"
+
+# ---------------- Cache de identidade ----------------
+class TTLCache:
+    """
+    LRU limitado em tamanho com expiração por entrada. Thread-safe, pensado
+    para dados pequenos e muito lidos (identidade do usuário, tokens).
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize, self.ttl = maxsize, ttl
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._data), "maxsize": self.maxsize}
+
+class Identity(NamedTuple):
+    """O que os handlers precisam do usuário autenticado (sem ORM)."""
+    id: int
+    email: str
+    name: str
+    token_version: int
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Confia nas claims do JWT e não consulta o banco. Revogação por token_version
+# deixa de valer: o token continua aceito até expirar.
+AUTH_TRUST_CLAIMS = os.getenv("AUTH_TRUST_CLAIMS", "0") == "1"
+
+USER_CACHE = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+TOKEN_CACHE = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_MAX_TTL)
+
+def identity_of(user: User) -> Identity:
+    return Identity(user.id, user.email, user.name, user.token_version or 0)
+
+def cached_identity(claims: dict) -> Optional[Identity]:
+    """
+    Identidade sem ir ao banco, ou None se precisar carregar o usuário.
+    Um 'tv' maior no token que no cache significa cache antigo (a troca de
+    credencial aconteceu em outro worker): recarrega.
+    """
+    uid = int(claims["sub"])
+    if AUTH_TRUST_CLAIMS:
+        return Identity(uid, claims.get("email", ""), claims.get("name", ""), claims.get("tv", 0))
+    ident = USER_CACHE.get(uid)
+    if ident is not None and claims.get("tv", 0) > ident.token_version:
+        return None
+    return ident
+
+def remember_identity(ident: Identity) -> Identity:
+    USER_CACHE.set(ident.id, ident)
+    return ident
+
+def check_token_version(ident: Identity, claims: dict) -> Identity:
+    if claims.get("tv", 0) != ident.token_version:
+        raise HTTPException(status_code=401, detail="token revoked")
+    return ident
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _forget_user(mapper, connection, target):
+    USER_CACHE.pop(target.id)
+
+def load_user(db: Session, uid: int) -> User:
+    user = db.get(User, uid)
+    if not user:
+        raise HTTPException(status_code=401, detail="user not found")
+    return user
+
+def _on_replica(db: Session) -> bool:
+    st = ROUTER.state(db.info.get("db_host"))
+    return st is not None and st.role == "replica"
+
+def find_identity(db: Session, claims: dict) -> Optional[Identity]:
+    """
+    Identidade do dono do token lida nesta sessão. Numa réplica devolve None
+    quando ela pode estar atrasada para este token (usuário que acabou de se
+    registrar ou token_version abaixo do 'tv'): quem responde é o primário.
+    """
+    user = db.get(User, int(claims["sub"]))
+    if _on_replica(db) and (user is None or claims.get("tv", 0) > (user.token_version or 0)):
+        return None
+    if not user:
+        raise HTTPException(status_code=401, detail="user not found")
+    return identity_of(user)
+
+def get_current_user(authorization: Optional[str] = Header(default=None),
+                     db: Session = Depends(db_read_session)) -> Identity:
+    claims = token_claims(authorization)
+    with stage("user_lookup"):
+        ident = cached_identity(claims)
+        if ident is None:
+            ident = find_identity(db, claims)
+            if ident is None:
+                with contextmanager(db_session)() as primary:
+                    ident = find_identity(primary, claims)
+            remember_identity(ident)
+    return check_token_version(ident, claims)
+
+# ---------------- Schema / migrações ----------------
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+def _add_index_if_missing(conn, table, name: str) -> None:
+    if name not in {ix["name"] for ix in inspect(conn).get_indexes(table.name)}:
+        next(ix for ix in table.indexes if ix.name == name).create(conn)
+
+def _drop_index_if_exists(conn, table, name: str) -> None:
+    if name in {ix["name"] for ix in inspect(conn).get_indexes(table.name)}:
+        on = f" ON {table.name}" if conn.dialect.name == "mysql" else ""
+        conn.execute(text(f"DROP INDEX {name}{on}"))
+
+def _add_column_if_missing(conn, column) -> None:
+    table = column.table
+    if column.name not in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        spec = conn.dialect.ddl_compiler(conn.dialect, None).get_column_specification(column)
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {spec}"))
+
+def _m001_owner_start_index(conn) -> None:
+    _add_index_if_missing(conn, Task.__table__, "idx_tasks_owner_start")
+
+def _m002_user_token_version(conn) -> None:
+    _add_column_if_missing(conn, User.__table__.c.token_version)
+
+def _m003_change_versions(conn) -> None:
+    _add_column_if_missing(conn, User.__table__.c.tasks_version)
+    _add_column_if_missing(conn, Task.__table__.c.version)
+    _add_index_if_missing(conn, Task.__table__, "idx_tasks_owner_version")
+
+def _m004_max_task_span(conn) -> None:
+    _add_column_if_missing(conn, User.__table__.c.max_task_span)
+    if conn.dialect.name == "mysql":
+        conn.execute(text(
+            "UPDATE users u JOIN (SELECT owner_id, MAX(TIMESTAMPDIFF(SECOND, start_at, end_at)) + 1 AS s"
+            " FROM tasks GROUP BY owner_id) m ON m.owner_id = u.id SET u.max_task_span = m.s"))
+    else:
+        conn.execute(text(
+            "UPDATE users SET max_task_span = COALESCE((SELECT MAX(CAST((julianday(end_at)"
+            " - julianday(start_at)) * 86400 AS INTEGER) + 1) FROM tasks WHERE owner_id = users.id), 0)"))
+
+def _m005_task_counters(conn) -> None:
+    # as tabelas de contadores vêm do create_all; aqui só o backfill
+    conn.execute(delete(TaskCount.__table__))
+    conn.execute(delete(TaskDayCount.__table__))
+    conn.execute(text(
+        "INSERT INTO task_counts (owner_id, status, priority, n)"
+        " SELECT owner_id, status, priority, COUNT(*) FROM tasks GROUP BY owner_id, status, priority"))
+    conn.execute(text(
+        "INSERT INTO task_day_counts (owner_id, day, n)"
+        " SELECT owner_id, DATE(start_at), COUNT(*) FROM tasks GROUP BY owner_id, DATE(start_at)"))
+    _add_index_if_missing(conn, Task.__table__, "idx_tasks_owner_status_end")
+    # índices de coluna única do init.sql que nenhuma consulta usa
+    _drop_index_if_exists(conn, Task.__table__, "idx_tasks_status")
+    _drop_index_if_exists(conn, Task.__table__, "idx_tasks_priority")
+
+def _m006_task_fulltext(conn) -> None:
+    if conn.dialect.name == "mysql":
+        _add_index_if_missing(conn, Task.__table__, "ftx_tasks_title_description")
+
+# (versão, passo). Os passos são idempotentes: o create_all de um banco novo
+# já cria tudo, então cada passo confere antes de alterar.
+def _m007_status_end_index(conn) -> None:
+    _add_index_if_missing(conn, Task.__table__, "idx_tasks_status_end")
+
+def _m008_user_token_changed_at(conn) -> None:
+    _add_column_if_missing(conn, User.__table__.c.token_changed_at)
+    _add_index_if_missing(conn, User.__table__, "ix_users_token_changed_at")
+
+MIGRATIONS = [
+    (1, _m001_owner_start_index),
+    (2, _m002_user_token_version),
+    (3, _m003_change_versions),
+    (4, _m004_max_task_span),
+    (5, _m005_task_counters),
+    (6, _m006_task_fulltext),
+    (7, _m007_status_end_index),
+    (8, _m008_user_token_changed_at),
+]
+
+# Com vários workers (gunicorn/uvicorn --workers) todos sobem ao mesmo tempo:
+# a migração roda sob um lock nomeado do MySQL (GET_LOCK), então só um worker
+# aplica os passos e os outros esperam e encontram tudo já registrado.
+MIGRATE_LOCK_TIMEOUT = int(os.getenv("MIGRATE_LOCK_TIMEOUT", "60"))
+
+class MigrationLockTimeout(RuntimeError):
+    pass
+
+@contextmanager
+def migration_lock(conn):
+    """Lock de migração entre processos (MySQL). Em outros bancos não faz nada."""
+    if conn.dialect.name != "mysql":
+        yield
+        return
+    name = f"{DB_NAME}.migrate"
+    got = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                       {"name": name, "timeout": MIGRATE_LOCK_TIMEOUT}).scalar()
+    conn.commit()
+    if got != 1:
+        raise MigrationLockTimeout(f"migration lock busy for {MIGRATE_LOCK_TIMEOUT}s")
+    try:
+        yield
+    finally:
+        conn.rollback()
+        conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+        conn.commit()
+
+def migrate(bind) -> None:
+    """Cria as tabelas que faltam e aplica as migrações ainda não registradas."""
+    with bind.connect() as conn, migration_lock(conn):
+        with conn.begin():
+            Base.metadata.create_all(conn)
+            done = set(conn.execute(select(SchemaMigration.version)).scalars())
+            for version, step in MIGRATIONS:
+                if version in done:
+                    continue
+                step(conn)
+                conn.execute(insert(SchemaMigration).values(version=version,
+                                                            applied_at=datetime.utcnow()))
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def ensure_schema(db: Session) -> None:
+    """
+    Garante que o schema esteja migrado. Depois da primeira confirmação
+    (normalmente no startup) é só a checagem de uma flag em memória, sem
+    nenhuma consulta extra ao banco no caminho do request.
+    """
+    global _schema_ready
+    with stage("ensure_schema"):
+        if _schema_ready:
+            return
+        with _schema_lock:
+            if not _schema_ready:
+                # migração sempre no primário, mesmo vindo de uma sessão de réplica
+                migrate(get_engine())
+                _schema_ready = True
+
+def recheck_schema() -> bool:
+    """ensure_schema fora do caminho do request (loop do prober). False se o banco falhar de novo."""
+    global _schema_ready
+    try:
+        with _schema_lock:
+            if not _schema_ready:
+                migrate(get_engine())
+                _schema_ready = True
+    except (OperationalError, ProgrammingError, IntegrityError, MigrationLockTimeout, NoHealthyHost):
+        return False
+    return True
+
+# ---------------- Rate limit ----------------
+# Token bucket por regra: cada regra casa método + prefixo do path e limita
+# por usuário ('sub' do JWT), por IP ou global. Custo por request: achar a
+# regra (lista curta, na ordem da config) e um acesso ao bucket, sem varrer
+# nada. Em memória os limites valem por processo; com RATE_LIMIT_REDIS_URL o
+# bucket fica no Redis (script Lua atômico) e vale para todos os workers.
+# Formato de RATE_LIMITS: "[MÉTODO ]PREFIXO=N/SEGUNDOS:por" separados por
+# ';' — N requests por SEGUNDOS (N também é o burst), 'por' = user|ip|global.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "POST /auth/login=10/60:ip;POST /auth/register=5/60:ip;"
+                                       "POST /api/tasks:batch=10/1:user;/api/=100/1:user")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+# O frontend é cliente da API, não proxy: todo request chega do IP dele. Ele
+# manda o IP do usuário final em RATE_LIMIT_CLIENT_HEADER, e a API só usa esse
+# header quando o request vem de um endereço de RATE_LIMIT_TRUSTED_CLIENTS
+# (IPs/redes separados por vírgula; vazio = header ignorado).
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER", "X-Client-IP").lower().encode("latin-1")
+RATE_LIMIT_TRUSTED_CLIENTS = os.getenv("RATE_LIMIT_TRUSTED_CLIENTS", "")
+
+class RateRule(NamedTuple):
+    name: str
+    method: Optional[str]
+    prefix: str
+    rate: float   # tokens por segundo
+    burst: float
+    by: str
+
+def parse_rate_limits(spec: str) -> List[RateRule]:
+    rules = []
+    for item in filter(None, (i.strip() for i in spec.split(";"))):
+        target, limit = item.rsplit("=", 1)
+        amount, by = limit.split(":") if ":" in limit else (limit, "user")
+        n, secs = amount.split("/")
+        method, _, prefix = target.strip().rpartition(" ")
+        if by not in ("user", "ip", "global"):
+            raise ValueError(f"invalid rate limit key: {by}")
+        rules.append(RateRule(target.strip(), method.upper() or None, prefix,
+                              float(n) / float(secs), float(n), by))
+    return rules
+
+class MemoryBuckets:
+    """Buckets em memória, LRU limitado a max_keys (bucket esquecido = bucket cheio)."""
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # chave -> [tokens, instante da última recarga]
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Consome um token; 0 se liberado, senão segundos até haver um."""
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                b[0] = min(burst, b[0] + (now - b[1]) * rate)
+                b[1] = now
+            if b[0] >= 1:
+                b[0] -= 1
+                return 0.0
+            return (1 - b[0]) / rate
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+class RedisBuckets:
+    """Mesmo algoritmo num script Lua: uma ida ao Redis por request, atômica entre workers."""
+    SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1e6
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = math.min(burst, (tonumber(b[1]) or burst) + math.max(0, now - (tonumber(b[2]) or now)) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL requires the redis package")
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        return float(await self._script(keys=[f"rl:{key}"], args=[rate, burst]))
+
+    def clear(self) -> None:
+        pass
+
+RATE_RULES = parse_rate_limits(RATE_LIMITS)
+RATE_BUCKETS = RedisBuckets(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBuckets(RATE_LIMIT_MAX_KEYS)
+
+RATE_LIMITED = _metric(Counter("rate_limited_total", "Requests recusados com 429", ("rule",)))
+RATE_LIMIT_ERRORS = _metric(Counter("rate_limit_backend_errors_total",
+                                    "Falhas do backend de rate limit (request liberado)"))
+
+def parse_trusted_clients(spec: str) -> list:
+    """Redes (ip_network) ou nomes exatos, como o 'testclient' do TestClient."""
+    out = []
+    for item in filter(None, (i.strip() for i in spec.split(","))):
+        try:
+            out.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            out.append(item)
+    return out
+
+TRUSTED_CLIENTS = parse_trusted_clients(RATE_LIMIT_TRUSTED_CLIENTS)
+
+def trusted_client(host: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        addr = None
+    return any(t == host if isinstance(t, str) else addr is not None and addr in t for t in TRUSTED_CLIENTS)
+
+def client_ip(scope) -> str:
+    """IP do usuário final: o header do frontend confiável, senão o peer da conexão."""
+    client = scope.get("client")
+    host = client[0] if client else "?"
+    if TRUSTED_CLIENTS and trusted_client(host):
+        for name, value in scope.get("headers", ()):
+            if name == RATE_LIMIT_CLIENT_HEADER:
+                forwarded = value.decode("latin-1").strip()
+                return forwarded or host
+    return host
+
+def match_rate_rule(method: str, path: str) -> Optional[RateRule]:
+    for rule in RATE_RULES:
+        if (rule.method is None or rule.method == method) and path.startswith(rule.prefix):
+            return rule
+    return None
+
+def rate_limit_key(rule: RateRule, scope) -> str:
+    if rule.by == "global":
+        return rule.name
+    if rule.by == "user":
+        for name, value in scope.get("headers", ()):
+            if name == b"authorization":
+                auth = value.decode("latin-1")
+                if auth.lower().startswith("bearer "):
+                    try:
+                        return f"{rule.name}|u{verified_claims(auth[7:])['sub']}"
+                    except InvalidToken:
+                        pass  # token inválido: a rota responde 401; limita pelo IP
+                break
+    return f"{rule.name}|{client_ip(scope)}"
+
+class RateLimitMiddleware:
+    """ASGI puro: recusa com 429 + Retry-After antes de chegar na rota (e no banco)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        rule = match_rate_rule(scope["method"], scope["path"])
+        if rule is not None:
+            try:
+                wait = await RATE_BUCKETS.take(rate_limit_key(rule, scope), rule.rate, rule.burst)
+            except Exception:
+                RATE_LIMIT_ERRORS.inc()
+                wait = 0.0  # backend fora: não derruba a API
+            if wait > 0:
+                RATE_LIMITED.inc(rule.name)
+                resp = JSONResponse({"detail": "rate limit exceeded"}, status_code=429,
+                                    headers={"Retry-After": str(max(1, math.ceil(wait)))})
+                return await resp(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+app = FastAPI(title="Tuesday API")
+# a última adicionada é a mais externa: as métricas também contam os 429
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(PoolTimeoutError)
+async def _pool_busy(request: Request, exc: PoolTimeoutError):
+    """Pool esgotado por mais de DB_POOL_TIMEOUT: falha rápido em vez de enfileirar."""
+    return JSONResponse({"detail": "database busy"}, status_code=503,
+                        headers={"Retry-After": DB_BUSY_RETRY_AFTER})
+
+# ---------------- Startup e prontidão ----------------
+# O startup faz uma única tentativa de aquecer o worker (primário, schema,
+# lista de revogação, pool); se o banco não responder, a tentativa continua
+# numa thread em background em vez de travar o boot do worker. /live diz só
+# que o processo responde; /ready só fica 200 depois do aquecimento, então o
+# balanceador não manda tráfego para um worker com pool frio ou sem banco.
+_ready = threading.Event()
+_warmup_stop = threading.Event()
+
+def warm_pool(engine, n: int) -> None:
+    """Abre n conexões de uma vez e devolve ao pool."""
+    conns = []
+    try:
+        for _ in range(n):
+            conns.append(engine.connect())
+    finally:
+        for c in conns:
+            c.close()
+
+def warm_up() -> bool:
+    """Uma tentativa de deixar o worker pronto. False se o banco ainda não está disponível."""
+    global _schema_ready
+    st = next((st for st in ROUTER.primaries if ROUTER.probe(st)), None)
+    if st is None:
+        return False
+    try:
+        with _schema_lock:
+            if not _schema_ready:
+                migrate(st.get_engine())
+                _schema_ready = True
+        with st.get_engine().connect() as conn:
+            REVOKED.refresh(conn)
+        warm_pool(st.get_engine(), DB_POOL_WARM)
+    except IntegrityError:
+        # sem GET_LOCK (SQLite) outro processo registrou a mesma migração; a
+        # próxima tentativa já encontra tudo aplicado
+        return False
+    except (OperationalError, ProgrammingError, MigrationLockTimeout):
+        _dispose_engine(st.host)
+        return False
+    _ready.set()
+    return True
+
+def _warmup_loop() -> None:
+    wait = 1
+    while not warm_up():
+        if _warmup_stop.wait(wait):
+            return
+        wait = min(5, wait + 1)
+
+@app.on_event("startup")
+def _startup_migrate():
+    # o pool foi dimensionado para THREADPOOL_SIZE threads: usa esse limite no anyio
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    ROUTER.start()
+    REVOKED.start()
+    ARCHIVER.start()
+    if not warm_up():
+        threading.Thread(target=_warmup_loop, name="db-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def _shutdown_pwd_pool():
+    if _pwd_pool is not None:
+        _pwd_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+def _shutdown_router():
+    # sai da rotação antes de fechar o resto
+    _ready.clear()
+    _warmup_stop.set()
+    ROUTER.stop()
+    REVOKED.stop()
+    ARCHIVER.stop()
+
+@app.get("/live")
+def live():
+    """Liveness: o processo responde. Não consulta o banco."""
+    return {"status": "alive"}
+
+@app.get("/ready")
+def ready():
+    """Readiness: worker aquecido, schema migrado e algum primário em rotação."""
+    checks = {"warm": _ready.is_set(), "schema": _schema_ready,
+              "primary": ROUTER.current_primary() is not None}
+    ok = all(checks.values())
+    return JSONResponse({"status": "ready" if ok else "not ready", **checks},
+                        status_code=200 if ok else 503)
+
+@app.get("/health")
+def health():
+    extra = {"db_hosts": ROUTER.status(), "user_cache": USER_CACHE.stats(),
+             "db_pool": {**pool_options(), "ping_idle": DB_PING_IDLE, "threads": THREADPOOL_SIZE}}
+    try:
+        st = ROUTER.primary()
+        with st.get_engine().connect() as conn:
+            ok = conn.execute(text("SELECT 1")).scalar() == 1
+        return {"status": "ok" if ok else "degraded", "service": "api", "db_host": st.host, **extra}
+    except Exception:
+        return {"status": "degraded", "service": "api", "db_host": None, **extra}
+
+@app.get("/metrics")
+def metrics():
+    """Métricas do processo no formato texto do Prometheus."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ---------------- Regras (compartilhadas pelos handlers sync e async) ----------------
+# Funções síncronas sobre Session: os handlers sync chamam direto e os async
+# via AsyncSession.run_sync, então a lógica de banco existe em um lugar só.
+def find_user_by_email(db: Session, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email == email).first()
+
+def create_user(db: Session, payload: RegisterIn, password_hash: str,
+                idem: Optional[Idempotency] = None) -> User:
+    u = User(email=payload.email,
+             name=payload.name.strip(),
+             password_hash=password_hash)
+    db.add(u); db.flush()
+    store_idempotent(db, idem, 200, {"user_id": u.id})
+    db.commit(); db.refresh(u)
+    return u
+
+def replay_register(db: Session, idem: Optional[Idempotency]) -> Optional[User]:
+    """Usuário criado por um register anterior com a mesma chave (o token é emitido de novo)."""
+    body = idempotent_replay(db, idem)
+    return db.get(User, body["user_id"]) if body else None
+
+def rehash_user(db: Session, user: User, new_hash: Optional[str]) -> None:
+    """Grava o hash refeito no login (needs_update). Falha aqui não derruba o login."""
+    if not new_hash:
+        return
+    try:
+        user.password_hash = new_hash
+        db.commit()
+    except Exception:
+        db.rollback()
+
+def check_task_window(payload: TaskIn) -> None:
+    if payload.end_at <= payload.start_at:
+        raise HTTPException(status_code=400, detail="end_at must be after start_at")
+
+def check_task_values(payload: TaskIn) -> None:
+    # antes de qualquer escrita: os contadores só podem receber chaves válidas
+    if payload.status not in TASK_STATUSES or payload.priority not in TASK_PRIORITIES:
+        raise HTTPException(status_code=400, detail="invalid status or priority")
+
+def _page_select(T, owner_id: int, cursor: Optional[str], limit: int, filters: TaskFilters, desc: bool):
+    q = select(*(T.__table__.c[c] for c in TASK_OUT_COLUMNS)).where(T.owner_id == owner_id)
+    q = apply_keyset(apply_task_filters(q, filters, T), cursor, desc, T)
+    order = (T.start_at.desc(), T.id.desc()) if desc else (T.start_at, T.id)
+    return q.order_by(*order).limit(limit + 1)
+
+def tasks_page(db: Session, owner_id: int, cursor: Optional[str], limit: int,
+               filters: TaskFilters, desc: bool = False, include_archived: bool = False):
+    """
+    Uma página da lista de tarefas e o cursor da próxima (ou None). Com
+    include_archived, a mesma página keyset é lida em tasks e em
+    tasks_archive (cada uma limitada a limit + 1) e juntada com UNION ALL.
+    """
+    q = _page_select(Task, owner_id, cursor, limit, filters, desc)
+    if include_archived:
+        parts = [q.subquery(), _page_select(TaskArchive, owner_id, cursor, limit, filters, desc).subquery()]
+        u = union_all(*(select(*p.c) for p in parts)).subquery()
+        order = (u.c.start_at.desc(), u.c.id.desc()) if desc else (u.c.start_at, u.c.id)
+        q = select(*u.c).order_by(*order).limit(limit + 1)
+    with stage("query"):
+        rows = db.execute(q).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].start_at, rows[-1].id)
+    return rows, None
+
+def task_span(start_at: datetime, end_at: datetime) -> int:
+    """Duração em segundos, arredondada para cima (nunca subestima)."""
+    return max(0, int((end_at - start_at).total_seconds()) + 1)
+
+def bump_tasks_version(db: Session, owner_id: int, span: int = 0) -> int:
+    """
+    Incrementa users.tasks_version e devolve o novo valor. O UPDATE trava a
+    linha do usuário até o commit, então as versões de um mesmo dono são
+    gravadas em ordem e o feed de mudanças nunca pula uma escrita.
+    'span' é a maior duração entre as tarefas gravadas e alarga
+    users.max_task_span no mesmo UPDATE.
+    """
+    users = User.__table__
+    values = {"tasks_version": users.c.tasks_version + 1}
+    if span > 0:
+        values["max_task_span"] = case((users.c.max_task_span < span, span),
+                                       else_=users.c.max_task_span)
+    db.execute(update(users).where(users.c.id == owner_id).values(values))
+    return db.execute(select(users.c.tasks_version).where(users.c.id == owner_id)).scalar_one()
+
+def tasks_version(db: Session, owner_id: int) -> int:
+    users = User.__table__
+    return db.execute(select(users.c.tasks_version).where(users.c.id == owner_id)).scalar() or 0
+
+class CountDeltas:
+    """
+    Variação dos contadores (task_counts / task_day_counts) numa escrita.
+    add/remove recebem (status, prioridade, start_at) de cada tarefa.
+    """
+    def __init__(self):
+        self.counts, self.days = {}, {}
+
+    def add(self, status, priority, start_at, n: int = 1) -> None:
+        key = (status, priority)
+        self.counts[key] = self.counts.get(key, 0) + n
+        day = start_at.date()
+        self.days[day] = self.days.get(day, 0) + n
+
+    def remove(self, status, priority, start_at) -> None:
+        self.add(status, priority, start_at, -1)
+
+def apply_count_deltas(db: Session, owner_id: int, deltas: CountDeltas) -> None:
+    """
+    Aplica os deltas na mesma transação da escrita. Roda depois de
+    bump_tasks_version, que já travou a linha do usuário: escritas do mesmo
+    dono ficam em série, então ler as chaves existentes e decidir entre
+    UPDATE e INSERT não tem corrida.
+    """
+    for table, keys, items in (
+        (TaskCount.__table__, ("status", "priority"), [(k, d) for k, d in deltas.counts.items() if d]),
+        (TaskDayCount.__table__, ("day",), [((k,), d) for k, d in deltas.days.items() if d]),
+    ):
+        if not items:
+            continue
+        cols = [table.c[k] for k in keys]
+        existing = set()
+        for k in range(0, len(items), TASKS_BATCH_CHUNK):
+            chunk = [key for key, _ in items[k:k + TASKS_BATCH_CHUNK]]
+            cond = cols[0].in_([key[0] for key in chunk])
+            existing.update(tuple(r) for r in db.execute(
+                select(*cols).where(table.c.owner_id == owner_id, cond)))
+        upd = [dict(zip(keys, key), _d=d) for key, d in items if key in existing]
+        new = [dict(zip(keys, key), owner_id=owner_id, n=d) for key, d in items if key not in existing]
+        if upd:
+            db.execute(update(table)
+                       .where(table.c.owner_id == owner_id,
+                              *[table.c[k] == bindparam("_" + k) for k in keys])
+                       .values(n=table.c.n + bindparam("_d")),
+                       [{**{"_" + k: p[k] for k in keys}, "_d": p["_d"]} for p in upd])
+        if new:
+            db.execute(insert(table), new)
+
+def create_task_row(db: Session, owner_id: int, payload: TaskIn,
+                    idem: Optional[Idempotency] = None) -> int:
+    version = bump_tasks_version(db, owner_id, task_span(payload.start_at, payload.end_at))
+    t = Task(owner_id=owner_id, version=version, **payload.model_dump())
+    db.add(t); db.flush()
+    deltas = CountDeltas()
+    deltas.add(t.status, t.priority, t.start_at)
+    apply_count_deltas(db, owner_id, deltas)
+    store_idempotent(db, idem, 201, {"id": t.id})
+    db.commit(); db.refresh(t)
+    return t.id
+
+def create_task_once(db: Session, owner_id: int, payload: TaskIn,
+                     idem: Optional[Idempotency]):
+    """Corpo de POST /api/tasks e se ele veio de um request anterior com a mesma chave."""
+    body = idempotent_replay(db, idem)
+    if body is not None:
+        return body, True
+    try:
+        return {"id": create_task_row(db, owner_id, payload, idem)}, False
+    except IntegrityError:
+        # outro request com a mesma chave gravou primeiro
+        db.rollback()
+        body = idempotent_replay(db, idem)
+        if body is None:
+            raise
+        return body, True
+
+def update_task_row(db: Session, owner_id: int, task_id: int, payload: TaskIn) -> Optional[int]:
+    """
+    Atualiza a tarefa do dono; None se ela não existir. A versão é
+    incrementada antes de ler a tarefa (como em apply_task_batch): o lock da
+    linha do dono serializa as escritas concorrentes, então os contadores
+    partem sempre do estado já gravado pela escrita anterior.
+    """
+    version = bump_tasks_version(db, owner_id, task_span(payload.start_at, payload.end_at))
+    t = db.query(Task).filter_by(id=task_id, owner_id=owner_id).first()
+    if not t:
+        archived = db.query(TaskArchive.id).filter_by(id=task_id, owner_id=owner_id).first()
+        db.rollback()
+        if archived:
+            raise HTTPException(status_code=409, detail="task is archived")
+        return None
+    deltas = CountDeltas()
+    deltas.remove(t.status, t.priority, t.start_at)
+    for k, v in payload.model_dump(exclude_unset=True).items():
+        setattr(t, k, v)
+    deltas.add(t.status, t.priority, t.start_at)
+    t.version = version
+    apply_count_deltas(db, owner_id, deltas)
+    db.commit()
+    return task_id
+
+def delete_task_row(db: Session, owner_id: int, task_id: int) -> bool:
+    """Apaga a tarefa do dono, esteja ela em tasks ou arquivada (lock do dono antes, como no update)."""
+    version = bump_tasks_version(db, owner_id)
+    t = (db.query(Task).filter_by(id=task_id, owner_id=owner_id).first()
+         or db.query(TaskArchive).filter_by(id=task_id, owner_id=owner_id).first())
+    if not t:
+        db.rollback()
+        return False
+    db.add(TaskTombstone(owner_id=owner_id, task_id=task_id, version=version))
+    deltas = CountDeltas()
+    deltas.remove(t.status, t.priority, t.start_at)
+    apply_count_deltas(db, owner_id, deltas)
+    db.delete(t); db.commit()
+    return True
+
+# ---------------- ETag / feed de mudanças ----------------
+CHANGES_MAX = int(os.getenv("CHANGES_MAX", "5000"))
+
+def tasks_etag(version: int, owner_id: int, request: Request) -> str:
+    """
+    ETag da listagem: versão das tarefas do dono + a query string (cada
+    página/filtro tem a sua). Custa uma leitura por PK em users.
+    """
+    q = hashlib.sha1(str(request.query_params).encode()).hexdigest()[:12]
+    return f'W/"{owner_id}-{version}-{q}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, "*") for tag in if_none_match.split(","))
+
+def task_changes(db: Session, owner_id: int, since: int):
+    """
+    Tarefas criadas/alteradas e ids apagados depois da versão 'since'.
+    Devolve (versão atual, tarefas, ids apagados) ou None se houver mais
+    de CHANGES_MAX mudanças (o cliente deve recarregar a lista inteira).
+    """
+    current = tasks_version(db, owner_id)
+    if since >= current:
+        return current, [], []
+    tomb = TaskTombstone.__table__
+    with stage("query"):
+        changed = db.execute(
+            select(*TASK_OUT_SELECT)
+            .where(Task.owner_id == owner_id, Task.version > since, Task.version <= current)
+            .order_by(Task.version, Task.id).limit(CHANGES_MAX + 1)).all()
+        deleted = list(db.execute(
+            select(tomb.c.task_id).where(tomb.c.owner_id == owner_id, tomb.c.version > since,
+                                         tomb.c.version <= current)
+            .order_by(tomb.c.version).limit(CHANGES_MAX + 1)).scalars())
+    if len(changed) + len(deleted) > CHANGES_MAX:
+        return None
+    return current, changed, deleted
+
+def tasks_page_if_changed(db: Session, owner_id: int, cursor: Optional[str], limit: int,
+                          filters: TaskFilters, request: Request, if_none_match: Optional[str],
+                          desc: bool = False, include_archived: bool = False):
+    """
+    (etag, versão, página) da listagem; página None se o cliente já tem
+    essa versão (If-None-Match bate), sem rodar a consulta das tarefas.
+    """
+    version = tasks_version(db, owner_id)
+    etag = tasks_etag(version, owner_id, request)
+    if etag_matches(if_none_match, etag):
+        return etag, version, None
+    return etag, version, tasks_page(db, owner_id, cursor, limit, filters, desc, include_archived)
+
+def render_tasks(rows, next_cursor: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+    """
+    Serializa as tuplas de TASK_OUT_SELECT aqui (medida no estágio
+    'serialize') em vez de deixar para o response_model, que fica só para a
+    documentação.
+    """
+    headers = dict(headers or {})
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    with stage("serialize"):
+        body = dumps_json(task_dicts(rows))
+    return Response(body, media_type="application/json", headers=headers)
+
+def _listing_response(etag: str, version: int, page) -> Response:
+    headers = {"ETag": etag, "X-Changes-Cursor": str(version)}
+    if page is None:
+        return Response(status_code=304, headers=headers)
+    rows, next_cursor = page
+    return render_tasks(rows, next_cursor, headers)
+
+def _changes_body(result):
+    if result is None:
+        raise HTTPException(status_code=410, detail="too many changes, reload the full list")
+    current, changed, deleted = result
+    with stage("serialize"):
+        return FastJSONResponse({"cursor": current, "changes": task_dicts(changed), "deleted": deleted})
+
+# ---------------- Janela de calendário / conflitos ----------------
+# Uma tarefa cruza [from, to) se start_at < to e end_at > from. Sozinha, a
+# condição em end_at não usa índice: o banco leria todas as tarefas do dono
+# que começam antes de 'to'. Como nenhuma tarefa do dono dura mais que
+# users.max_task_span, start_at >= from - span é um limite inferior seguro e
+# a consulta vira um range scan curto em (owner_id, start_at, id).
+RANGE_MAX_DAYS = int(os.getenv("RANGE_MAX_DAYS", "366"))
+CONFLICTS_SCAN_MAX = int(os.getenv("CONFLICTS_SCAN_MAX", "20000"))
+CONFLICTS_MAX = int(os.getenv("CONFLICTS_MAX", "1000"))
+
+def check_range(frm: datetime, to: datetime) -> None:
+    if to <= frm:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if to - frm > timedelta(days=RANGE_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"window longer than {RANGE_MAX_DAYS} days")
+
+def max_task_span(db: Session, owner_id: int) -> int:
+    users = User.__table__
+    return db.execute(select(users.c.max_task_span).where(users.c.id == owner_id)).scalar() or 0
+
+def range_condition(db: Session, owner_id: int, frm: datetime, to: datetime):
+    span = timedelta(seconds=max_task_span(db, owner_id))
+    # janela colada em datetime.min: o recuo pelo span não pode passar do mínimo
+    lower = frm - span if frm - datetime.min > span else datetime.min
+    return and_(Task.owner_id == owner_id,
+                Task.start_at >= lower, Task.start_at < to,
+                Task.end_at > frm)
+
+def tasks_in_range(db: Session, owner_id: int, frm: datetime, to: datetime,
+                   cursor: Optional[str], limit: int, filters: TaskFilters):
+    """Tarefas que cruzam [frm, to), na ordem (start_at, id), paginadas como tasks_page."""
+    with stage("query"):
+        q = select(*TASK_OUT_SELECT).where(range_condition(db, owner_id, frm, to))
+        q = apply_keyset(apply_task_filters(q, filters), cursor)
+        rows = db.execute(q.order_by(Task.start_at, Task.id).limit(limit + 1)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].start_at, rows[-1].id)
+    return rows, None
+
+def sweep_conflicts(rows, frm: datetime, to: datetime, max_pairs: int = CONFLICTS_MAX):
+    """
+    Varredura (sweep line) sobre (id, start_at, end_at) ordenados por
+    start_at. Mantém num heap as tarefas ainda abertas; cada tarefa nova
+    conflita com todas as abertas. Devolve (conflitos, blocos ocupados,
+    blocos livres, truncado), com os blocos recortados em [frm, to).
+    """
+    active: list = []
+    conflicts, busy = [], []
+    truncated = False
+    for task_id, start, end in rows:
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for other_end, other_id in active:
+            if len(conflicts) >= max_pairs:
+                truncated = True
+                break
+            conflicts.append({"a": other_id, "b": task_id,
+                              "start": start, "end": min(end, other_end)})
+        heapq.heappush(active, (end, task_id))
+        b_start, b_end = max(start, frm), min(end, to)
+        if busy and b_start <= busy[-1][1]:
+            busy[-1][1] = max(busy[-1][1], b_end)
+        else:
+            busy.append([b_start, b_end])
+    free, cur = [], frm
+    for b_start, b_end in busy:
+        if b_start > cur:
+            free.append({"start": cur, "end": b_start})
+        cur = max(cur, b_end)
+    if cur < to:
+        free.append({"start": cur, "end": to})
+    return (conflicts, [{"start": a, "end": b} for a, b in busy], free, truncated)
+
+def task_conflicts(db: Session, owner_id: int, frm: datetime, to: datetime, filters: TaskFilters):
+    """Conflitos e blocos livres/ocupados em [frm, to); None se a janela tiver tarefas demais."""
+    with stage("query"):
+        stmt = (select(Task.id, Task.start_at, Task.end_at)
+                .where(range_condition(db, owner_id, frm, to))
+                .order_by(Task.start_at, Task.id).limit(CONFLICTS_SCAN_MAX + 1))
+        rows = db.execute(apply_task_filters(stmt, filters)).all()
+    if len(rows) > CONFLICTS_SCAN_MAX:
+        return None
+    conflicts, busy, free, truncated = sweep_conflicts(rows, frm, to)
+    return {"conflicts": conflicts, "busy": busy, "free": free, "truncated": truncated}
+
+def _conflicts_body(result):
+    if result is None:
+        raise HTTPException(status_code=422, detail=f"more than {CONFLICTS_SCAN_MAX} tasks in window")
+    return result
+
+# ---------------- Recorrência ----------------
+# Uma tarefa recorrente é uma linha em task_rules (1ª ocorrência + RRULE),
+# não uma linha por ocorrência. rule_occurrences gera as ocorrências de uma
+# janela: pula direto para o período que contém o início da janela e para no
+# fim dela, então o custo depende do tamanho da janela, não de quantas
+# ocorrências a regra já teve. Exceções (cancelada/alterada) ficam em
+# task_rule_exceptions pelo início original da ocorrência.
+RULE_FREQS = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+RULE_WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+RULE_COUNT_MAX = int(os.getenv("RULE_COUNT_MAX", "10000"))
+RULES_MAX = int(os.getenv("RULES_MAX", "500"))  # regras por usuário
+RULE_OCCURRENCES_MAX = int(os.getenv("RULE_OCCURRENCES_MAX", "5000"))  # por janela
+
+class RRule(NamedTuple):
+    freq: str
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+    byday: tuple = ()  # dias da semana (0 = segunda), só com WEEKLY
+
+def _rrule_until(value: str) -> datetime:
+    """UNTIL como data (vale o dia inteiro) ou data-hora UTC (YYYYMMDD[THHMMSS[Z]])."""
+    try:
+        if "T" in value:
+            return datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+        return datetime.strptime(value, "%Y%m%d") + timedelta(days=1, microseconds=-1)
+    except ValueError:
+        raise ValueError("invalid UNTIL")
+
+def parse_rrule(text: str) -> RRule:
+    """
+    Subconjunto do RRULE da RFC 5545: FREQ, INTERVAL, COUNT, UNTIL e BYDAY
+    (só com FREQ=WEEKLY). Qualquer outra parte levanta ValueError.
+    """
+    parts = {}
+    for item in text.strip().upper().removeprefix("RRULE:").split(";"):
+        if not item:
+            continue
+        name, sep, value = item.partition("=")
+        if not sep or not value or name in parts:
+            raise ValueError(f"invalid rrule part '{item}'")
+        parts[name] = value
+    unknown = sorted(set(parts) - {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY"})
+    if unknown:
+        raise ValueError(f"unsupported rrule part '{unknown[0]}'")
+    freq = parts.get("FREQ")
+    if freq not in RULE_FREQS:
+        raise ValueError("FREQ must be one of " + ", ".join(RULE_FREQS))
+    try:
+        interval = int(parts.get("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except ValueError:
+        raise ValueError("INTERVAL and COUNT must be integers")
+    if interval < 1:
+        raise ValueError("INTERVAL must be positive")
+    if count is not None and not 1 <= count <= RULE_COUNT_MAX:
+        raise ValueError(f"COUNT must be between 1 and {RULE_COUNT_MAX}")
+    if count is not None and "UNTIL" in parts:
+        raise ValueError("COUNT and UNTIL are mutually exclusive")
+    until = _rrule_until(parts["UNTIL"]) if "UNTIL" in parts else None
+    byday = ()
+    if "BYDAY" in parts:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+        days = parts["BYDAY"].split(",")
+        if any(d not in RULE_WEEKDAYS for d in days):
+            raise ValueError("invalid BYDAY")
+        byday = tuple(sorted({RULE_WEEKDAYS.index(d) for d in days}))
+    return RRule(freq, interval, count, until, byday)
+
+def _rule_period(rule: RRule, dtstart: datetime, k: int):
+    """
+    (início do período k, inícios candidatos nele, em ordem). Datas que não
+    existem (31 em mês curto, 29/02 fora de ano bissexto) são puladas, como
+    na RFC 5545. None depois do último ano representável.
+    """
+    step = k * rule.interval
+    try:
+        if rule.freq == "DAILY":
+            first = dtstart + timedelta(days=step)
+            return first, [first]
+        if rule.freq == "WEEKLY":
+            week = dtstart - timedelta(days=dtstart.weekday()) + timedelta(weeks=step)
+            days = rule.byday or (dtstart.weekday(),)
+            return week.replace(hour=0, minute=0, second=0, microsecond=0), \
+                [week + timedelta(days=d) for d in days]
+    except OverflowError:
+        return None
+    months = dtstart.month - 1 + step * (12 if rule.freq == "YEARLY" else 1)
+    year, month = dtstart.year + months // 12, months % 12 + 1
+    if year > datetime.max.year:
+        return None
+    first = datetime(year, month, 1)
+    try:
+        return first, [dtstart.replace(year=year, month=month)]
+    except ValueError:
+        return first, []
+
+def _first_period(rule: RRule, dtstart: datetime, after: datetime) -> int:
+    """Último período que começa até 'after': os anteriores só têm ocorrências antes dele."""
+    if after <= dtstart:
+        return 0
+    if rule.freq == "DAILY":
+        return (after - dtstart).days // rule.interval
+    if rule.freq == "WEEKLY":
+        return (after.date() - dtstart.date()).days // 7 // rule.interval
+    months = (after.year - dtstart.year) * 12 + after.month - dtstart.month
+    return months // (12 if rule.freq == "YEARLY" else 1) // rule.interval
+
+def rule_occurrences(rule: RRule, dtstart: datetime, duration: timedelta,
+                     frm: datetime, to: datetime, last: Optional[datetime] = None):
+    """
+    Gera, em ordem, o início de cada ocorrência que cruza [frm, to) (start <
+    to e start + duration > frm). 'last' é o início da última ocorrência da
+    regra (UNTIL/COUNT, ver rule_last_start); None = sem fim.
+    """
+    k = _first_period(rule, dtstart, frm - duration)
+    while True:
+        period = _rule_period(rule, dtstart, k)
+        if period is None or period[0] >= to:
+            return
+        for start in period[1]:
+            if start >= to or (last is not None and start > last):
+                return
+            if start >= dtstart and start + duration > frm:
+                yield start
+        k += 1
+
+def rule_last_start(rule: RRule, dtstart: datetime, duration: timedelta) -> Optional[datetime]:
+    """Início da última ocorrência; expande só uma vez, na gravação, quando há COUNT."""
+    if rule.count is None:
+        return rule.until
+    last = None
+    for last in islice(rule_occurrences(rule, dtstart, duration, dtstart, datetime.max), rule.count):
+        pass
+    return last
+
+def check_rule(payload: RuleIn):
+    """(RRule, fim da última ocorrência ou None) ou 400."""
+    check_task_window(payload)
+    check_task_values(payload)
+    try:
+        rule = parse_rrule(payload.rrule)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    duration = payload.end_at - payload.start_at
+    last = rule_last_start(rule, payload.start_at, duration)
+    first = next(rule_occurrences(rule, payload.start_at, duration, payload.start_at, datetime.max, last), None)
+    if first is None:
+        raise HTTPException(status_code=400, detail="rule has no occurrences")
+    return rule, None if last is None else last + duration
+
+def rule_dict(r: TaskRule) -> dict:
+    return {"id": r.id, "title": r.title, "description": r.description, "start_at": r.start_at,
+            "end_at": r.end_at, "rrule": r.rrule, "status": r.status, "priority": r.priority}
+
+def create_rule_row(db: Session, owner_id: int, payload: RuleIn, last_end: Optional[datetime]) -> Optional[int]:
+    """Id da regra nova; None se o usuário já tem RULES_MAX regras."""
+    n = db.execute(select(func.count()).select_from(TaskRule).where(TaskRule.owner_id == owner_id)).scalar()
+    if n >= RULES_MAX:
+        return None
+    r = TaskRule(owner_id=owner_id, last_end=last_end, **payload.model_dump())
+    r.rrule = payload.rrule.strip().upper().removeprefix("RRULE:")
+    db.add(r); db.commit()
+    return r.id
+
+def list_rules(db: Session, owner_id: int) -> List[dict]:
+    with stage("query"):
+        rules = db.query(TaskRule).filter_by(owner_id=owner_id).order_by(TaskRule.id).all()
+    return [rule_dict(r) for r in rules]
+
+def delete_rule_row(db: Session, owner_id: int, rule_id: int) -> bool:
+    r = db.query(TaskRule).filter_by(id=rule_id, owner_id=owner_id).first()
+    if not r:
+        return False
+    db.execute(delete(TaskRuleException).where(TaskRuleException.rule_id == rule_id))
+    db.delete(r); db.commit()
+    return True
+
+def is_occurrence(r: TaskRule, at: datetime) -> bool:
+    rule, duration = parse_rrule(r.rrule), r.end_at - r.start_at
+    last = None if r.last_end is None else r.last_end - duration
+    return at in rule_occurrences(rule, r.start_at, duration, at, at + timedelta(seconds=1), last)
+
+def put_rule_exception(db: Session, owner_id: int, rule_id: int, payload: RuleExceptionIn) -> bool:
+    """Grava (ou troca) a exceção da ocorrência; False se a regra ou a ocorrência não existem."""
+    r = db.query(TaskRule).filter_by(id=rule_id, owner_id=owner_id).first()
+    if not r or not is_occurrence(r, payload.occurrence_at):
+        return False
+    db.merge(TaskRuleException(rule_id=rule_id, **payload.model_dump()))
+    db.commit()
+    return True
+
+def check_rule_exception(payload: RuleExceptionIn) -> None:
+    if payload.status is not None and payload.status not in TASK_STATUSES:
+        raise HTTPException(status_code=400, detail="invalid status")
+    if (payload.start_at is None) != (payload.end_at is None):
+        raise HTTPException(status_code=400, detail="start_at and end_at must be given together")
+    if payload.start_at is not None and payload.end_at <= payload.start_at:
+        raise HTTPException(status_code=400, detail="end_at must be after start_at")
+
+def occurrences_in_range(db: Session, owner_id: int, frm: datetime, to: datetime):
+    """
+    Ocorrências das regras do dono que cruzam [frm, to), com as exceções
+    aplicadas, ordenadas por início; None se passarem de RULE_OCCURRENCES_MAX.
+    """
+    with stage("query"):
+        rules = db.query(TaskRule).filter(
+            TaskRule.owner_id == owner_id, TaskRule.start_at < to,
+            or_(TaskRule.last_end.is_(None), TaskRule.last_end > frm)).all()
+        if not rules:
+            return []
+        span = max(r.end_at - r.start_at for r in rules)
+        X = TaskRuleException
+        exceptions = {(e.rule_id, e.occurrence_at): e for e in db.query(X).filter(
+            X.rule_id.in_([r.id for r in rules]),
+            or_(and_(X.occurrence_at > frm - span, X.occurrence_at < to),
+                and_(X.start_at < to, X.end_at > frm))).all()}
+    by_id = {r.id: r for r in rules}
+
+    def expand(r: TaskRule):
+        duration = r.end_at - r.start_at
+        last = None if r.last_end is None else r.last_end - duration
+        for start in rule_occurrences(parse_rrule(r.rrule), r.start_at, duration, frm, to, last):
+            yield start, r.id
+
+    out, seen = [], set()
+    for start, rule_id in islice(heapq.merge(*(expand(r) for r in rules)), RULE_OCCURRENCES_MAX + 1):
+        out.append(_occurrence(by_id[rule_id], start, exceptions.get((rule_id, start))))
+        seen.add((rule_id, start))
+    if len(out) > RULE_OCCURRENCES_MAX:
+        return None
+    # ocorrências movidas para dentro da janela a partir de fora dela
+    for key, e in exceptions.items():
+        if key not in seen and e.start_at is not None and is_occurrence(by_id[e.rule_id], e.occurrence_at):
+            out.append(_occurrence(by_id[e.rule_id], e.occurrence_at, e))
+    out = [o for o in out if o is not None and o["start_at"] < to and o["end_at"] > frm]
+    out.sort(key=lambda o: (o["start_at"], o["rule_id"]))
+    return out
+
+def _occurrence(r: TaskRule, start: datetime, e: Optional[TaskRuleException]) -> Optional[dict]:
+    if e is not None and e.cancelled:
+        return None
+    occ = {"rule_id": r.id, "occurrence_at": start, "title": r.title, "description": r.description,
+           "start_at": start, "end_at": start + (r.end_at - r.start_at), "status": r.status,
+           "priority": r.priority}
+    if e is not None:
+        if e.title is not None:
+            occ["title"] = e.title
+        if e.start_at is not None:
+            occ["start_at"], occ["end_at"] = e.start_at, e.end_at
+        if e.status is not None:
+            occ["status"] = e.status
+    return occ
+
+def _occurrences_body(result):
+    if result is None:
+        raise HTTPException(status_code=422, detail=f"more than {RULE_OCCURRENCES_MAX} occurrences in window")
+    with stage("serialize"):
+        return FastJSONResponse(result)
+
+# ---------------- Arquivamento ----------------
+# Tarefas 'done' que terminaram há mais de ARCHIVE_AFTER_DAYS dias saem de
+# tasks para tasks_archive em lotes de ARCHIVE_BATCH. Cada lote é uma
+# transação curta, com ARCHIVE_PAUSE s de pausa entre lotes, então o job não
+# segura locks por muito tempo. Não há estado: cada rodada continua do que
+# sobrou em tasks. Entre workers, GET_LOCK deixa uma rodada por vez (MySQL);
+# mesmo sem ele, as linhas são relidas com FOR UPDATE SKIP LOCKED e o lote
+# só move o que ainda está em tasks. No feed de mudanças a tarefa arquivada
+# sai da lista como apagada (tombstone); as contagens de stats não mudam.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))  # 0 (padrão) desliga o job
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE", "0.2"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "600"))
+
+TASKS_ARCHIVED = _metric(Counter("tasks_archived_total", "Tarefas movidas para tasks_archive"))
+
+@contextmanager
+def archive_lock(conn):
+    """GET_LOCK sem espera (MySQL): True se esta conexão ficou com a rodada. Em outros bancos, sempre True."""
+    if conn.dialect.name != "mysql":
+        yield True
+        return
+    name = f"{DB_NAME}.archive"
+    got = conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": name}).scalar() == 1
+    conn.commit()
+    try:
+        yield got
+    finally:
+        if got:
+            conn.rollback()
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+            conn.commit()
+
+def archive_batch(db: Session, cutoff: datetime, batch: int) -> int:
+    """Move até 'batch' tarefas 'done' com end_at < cutoff numa transação; devolve quantas."""
+    T = Task.__table__
+    old_done = and_(T.c.status == "done", T.c.end_at < cutoff)
+    candidates = db.execute(select(T.c.id, T.c.owner_id).where(old_done)
+                            .order_by(T.c.status, T.c.end_at, T.c.id).limit(batch)).all()
+    if not candidates:
+        db.rollback()
+        return 0
+    # mesma ordem de locks das escritas da API: a linha do dono em users, depois as tarefas
+    versions = {o: bump_tasks_version(db, o) for o in sorted({r.owner_id for r in candidates})}
+    rows = db.execute(select(T.c.id, T.c.owner_id)
+                      .where(T.c.id.in_([r.id for r in candidates]), old_done)
+                      .with_for_update(skip_locked=True)).all()
+    if rows:
+        now = datetime.utcnow()
+        ids = [r.id for r in rows]
+        cols = [c.name for c in T.c]
+        db.execute(insert(TaskArchive.__table__).from_select(
+            cols + ["archived_at"], select(*T.c, literal(now, DateTime())).where(T.c.id.in_(ids))))
+        db.execute(delete(T).where(T.c.id.in_(ids)))
+        db.execute(insert(TaskTombstone.__table__),
+                   [{"owner_id": r.owner_id, "task_id": r.id, "version": versions[r.owner_id],
+                     "deleted_at": now} for r in rows])
+    db.commit()
+    return len(rows)
+
+class TaskArchiver:
+    """Roda archive_batch em rodadas a cada ARCHIVE_INTERVAL s numa thread em background."""
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, engine, now: Optional[datetime] = None) -> int:
+        """Uma rodada até esvaziar; 0 se o job está desligado ou outro worker está com a rodada."""
+        if ARCHIVE_AFTER_DAYS <= 0:
+            return 0
+        cutoff = (now or datetime.utcnow()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+        moved = 0
+        with engine.connect() as conn, archive_lock(conn) as got:
+            if not got:
+                return 0
+            db = Session(bind=conn)
+            try:
+                while not self._stop.is_set():
+                    n = archive_batch(db, cutoff, ARCHIVE_BATCH)
+                    moved += n
+                    TASKS_ARCHIVED.inc(n=n)
+                    if n < ARCHIVE_BATCH or self._stop.wait(ARCHIVE_PAUSE):
+                        break
+            finally:
+                db.close()
+        return moved
+
+    def _loop(self) -> None:
+        while not self._stop.wait(ARCHIVE_INTERVAL):
+            try:
+                self.run_once(ROUTER.primary().get_engine())
+            except Exception:
+                pass  # banco fora: tenta de novo na próxima rodada
+
+    def start(self) -> None:
+        if ARCHIVE_AFTER_DAYS > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="task-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+ARCHIVER = TaskArchiver()
+
+# ---------------- Estatísticas ----------------
+# Contagens por status/prioridade e por dia vêm de task_counts e
+# task_day_counts (no máximo 9 linhas + uma por dia da janela), mantidas na
+# mesma transação das escritas. Atrasadas dependem do relógio e não dão para
+# pré-agregar: são contadas no índice (owner_id, status, end_at), que só
+# percorre as tarefas já atrasadas.
+STATS_DEFAULT_DAYS = int(os.getenv("STATS_DEFAULT_DAYS", "7"))
+
+def stats_window(frm: Optional[date], to: Optional[date]):
+    frm = frm or datetime.utcnow().date()
+    to = to or frm + timedelta(days=STATS_DEFAULT_DAYS)
+    if to <= frm:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if (to - frm).days > RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"window longer than {RANGE_MAX_DAYS} days")
+    return frm, to
+
+def task_stats(db: Session, owner_id: int, frm: date, to: date, now: datetime) -> dict:
+    tc, dc = TaskCount.__table__, TaskDayCount.__table__
+    with stage("query"):
+        counts = db.execute(select(tc.c.status, tc.c.priority, tc.c.n)
+                            .where(tc.c.owner_id == owner_id)).all()
+        days = dict(db.execute(select(dc.c.day, dc.c.n)
+                               .where(dc.c.owner_id == owner_id, dc.c.day >= frm, dc.c.day < to)).all())
+        overdue = db.execute(select(func.count())
+                             .where(Task.owner_id == owner_id, Task.status.in_(("todo", "doing")),
+                                    Task.end_at < now)).scalar_one()
+    by_status = dict.fromkeys(TASK_STATUSES, 0)
+    by_priority = dict.fromkeys(TASK_PRIORITIES, 0)
+    for status, priority, n in counts:
+        by_status[status] = by_status.get(status, 0) + n
+        by_priority[priority] = by_priority.get(priority, 0) + n
+    per_day = [{"day": d, "count": days.get(d, 0)}
+               for d in (frm + timedelta(days=k) for k in range((to - frm).days))]
+    return {"total": sum(by_status.values()), "by_status": by_status, "by_priority": by_priority,
+            "overdue": overdue, "per_day": per_day}
+
+# ---------------- Busca ----------------
+# No MySQL: índice FULLTEXT (title, description) em modo booleano, cada termo
+# obrigatório e por prefixo ('+termo*'), ordenado pela relevância do MATCH.
+# Nos outros bancos (SQLite dos testes): índice invertido em memória por
+# dono, refeito quando tasks_version muda, com a mesma semântica e ranking
+# tf-idf (título vale o dobro). Páginas por offset dentro de SEARCH_MAX_RESULTS.
+SEARCH_MIN_TERM = 3  # innodb_ft_min_token_size padrão: termos menores não entram no índice
+SEARCH_PAGE_DEFAULT = int(os.getenv("SEARCH_PAGE_DEFAULT", "50"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+SEARCH_INDEX_OWNERS = int(os.getenv("SEARCH_INDEX_OWNERS", "64"))
+_WORD = re.compile(r"\w+")
+
+def search_terms(text_: Optional[str]) -> List[str]:
+    """Palavras em minúsculas e sem acento."""
+    norm = unicodedata.normalize("NFKD", (text_ or "").lower())
+    return _WORD.findall("".join(c for c in norm if not unicodedata.combining(c)))
+
+def search_query_terms(q: str) -> List[str]:
+    terms = list(dict.fromkeys(t for t in search_terms(q) if len(t) >= SEARCH_MIN_TERM))
+    if not terms:
+        raise HTTPException(status_code=400, detail=f"q needs a word with at least {SEARCH_MIN_TERM} characters")
+    return terms
+
+def encode_search_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"search|{offset}".encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        kind, offset = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        if kind == "search" and int(offset) >= 0:
+            return int(offset)
+    except Exception:
+        pass
+    raise HTTPException(status_code=400, detail="invalid cursor")
+
+class _OwnerIndex:
+    """Índice invertido das tarefas de um dono na versão 'version' de tasks_version."""
+    def __init__(self, version: int, rows):
+        self.version = version
+        self.lock = threading.Lock()
+        self.postings = {}  # token -> {task_id: peso}
+        self.docs = {}      # task_id -> {token: peso}, para tirar a tarefa numa mudança
+        for task_id, title, description in rows:
+            self._add(task_id, title, description)
+        self.tokens = sorted(self.postings)
+
+    def _add(self, task_id: int, title: Optional[str], description: Optional[str], new_tokens=None) -> None:
+        weights = {}
+        for weight, field in ((2, title), (1, description)):
+            for tok in search_terms(field):
+                weights[tok] = weights.get(tok, 0) + weight
+        self.docs[task_id] = weights
+        for tok, w in weights.items():
+            docs = self.postings.get(tok)
+            if docs is None:
+                docs = self.postings[tok] = {}
+                if new_tokens is not None:
+                    new_tokens.append(tok)
+            docs[task_id] = w
+
+    def _remove(self, task_id: int) -> None:
+        for tok in self.docs.pop(task_id, ()):
+            docs = self.postings[tok]
+            del docs[task_id]
+            if not docs:
+                del self.postings[tok]
+                del self.tokens[bisect_left(self.tokens, tok)]
+
+    def apply(self, version: int, changed, deleted) -> None:
+        """Aplica o feed de mudanças (task_changes) desde self.version."""
+        new_tokens = []
+        for task_id in deleted:
+            self._remove(task_id)
+        for row in changed:
+            self._remove(row.id)
+            self._add(row.id, row.title, row.description, new_tokens)
+        for tok in new_tokens:
+            if tok in self.postings:
+                insort(self.tokens, tok)
+        self.version = max(self.version, version)
+
+    def _term_scores(self, term: str) -> dict:
+        """Score de cada tarefa para um termo, somando as palavras com esse prefixo."""
+        scores = {}
+        i = bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            docs = self.postings[self.tokens[i]]
+            idf = math.log(1 + len(self.docs) / len(docs))
+            for task_id, tf in docs.items():
+                scores[task_id] = scores.get(task_id, 0.0) + tf * idf
+            i += 1
+        return scores
+
+    def search(self, terms: List[str], n: int) -> List[int]:
+        """Os n primeiros ids com todos os termos, por relevância (e id no empate)."""
+        total = None
+        for scores in sorted((self._term_scores(t) for t in terms), key=len):
+            if total is None:
+                total = scores
+            else:
+                total = {k: v + scores[k] for k, v in total.items() if k in scores}
+            if not total:
+                return []
+        return heapq.nsmallest(n, total, key=lambda k: (-total[k], k))
+
+class SearchIndex:
+    """
+    Índices por dono (LRU de SEARCH_INDEX_OWNERS) para bancos sem FULLTEXT.
+    Depois de uma escrita o índice é atualizado pelo feed de mudanças; só é
+    reconstruído do zero na primeira busca ou com mais de CHANGES_MAX mudanças.
+    """
+    def __init__(self, max_owners: int):
+        self.max_owners = max_owners
+        self._owners = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(self, db: Session, owner_id: int, terms: List[str], n: int) -> List[int]:
+        with self._lock:
+            idx = self._owners.get(owner_id)
+            if idx is not None:
+                self._owners.move_to_end(owner_id)
+        if idx is not None:
+            with idx.lock:
+                changes = task_changes(db, owner_id, idx.version)
+                if changes is not None:
+                    idx.apply(*changes)
+                    return idx.search(terms, n)
+        # versão lida antes das linhas: uma escrita no meio só reaparece no feed
+        version = tasks_version(db, owner_id)
+        with stage("query"):
+            rows = db.execute(select(Task.id, Task.title, Task.description)
+                              .where(Task.owner_id == owner_id)).all()
+        idx = _OwnerIndex(version, rows)
+        with self._lock:
+            self._owners[owner_id] = idx
+            self._owners.move_to_end(owner_id)
+            while len(self._owners) > self.max_owners:
+                self._owners.popitem(last=False)
+        with idx.lock:
+            return idx.search(terms, n)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._owners.clear()
+
+SEARCH_INDEX = SearchIndex(SEARCH_INDEX_OWNERS)
+
+def search_tasks(db: Session, owner_id: int, terms: List[str], offset: int, limit: int):
+    """Página de tarefas por relevância e o cursor da próxima (ou None)."""
+    limit = min(limit, SEARCH_MAX_RESULTS - offset)
+    if limit <= 0:
+        return [], None
+    if db.get_bind().dialect.name == "mysql":
+        score = mysql.match(Task.title, Task.description,
+                            against=" ".join(f"+{t}*" for t in terms)).in_boolean_mode()
+        with stage("query"):
+            rows = db.execute(select(*TASK_OUT_SELECT).where(Task.owner_id == owner_id, score)
+                              .order_by(score.desc(), Task.id).offset(offset).limit(limit + 1)).all()
+    else:
+        ids = SEARCH_INDEX.search(db, owner_id, terms, offset + limit + 1)[offset:]
+        with stage("query"):
+            found = {r.id: r for r in db.execute(select(*TASK_OUT_SELECT)
+                                                 .where(Task.owner_id == owner_id, Task.id.in_(ids)))}
+        rows = [found[i] for i in ids if i in found]
+    if len(rows) > limit:
+        return rows[:limit], encode_search_cursor(offset + limit)
+    return rows, None
+
+# ---------------- Lote de tarefas ----------------
+TASKS_BATCH_MAX = int(os.getenv("TASKS_BATCH_MAX", "5000"))
+# linhas por INSERT multi-row (fica bem abaixo do max_allowed_packet)
+TASKS_BATCH_CHUNK = int(os.getenv("TASKS_BATCH_CHUNK", "500"))
+
+def _batch_item(op: dict):
+    """Valida um item do lote. Devolve (op, id, TaskIn | None, erro | None)."""
+    kind = op.get("op")
+    if kind not in ("create", "update", "delete"):
+        return kind, None, None, "op must be create, update or delete"
+    task_id = op.get("id")
+    if kind != "create" and not isinstance(task_id, int):
+        return kind, None, None, "id is required"
+    if kind == "delete":
+        return kind, task_id, None, None
+    try:
+        payload = TaskIn.model_validate(op.get("task") or {})
+    except ValidationError as e:
+        return kind, task_id, None, "; ".join(
+            f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    if payload.status not in TASK_STATUSES or payload.priority not in TASK_PRIORITIES:
+        return kind, task_id, None, "invalid status or priority"
+    if payload.end_at <= payload.start_at:
+        return kind, task_id, None, "end_at must be after start_at"
+    return kind, task_id, payload, None
+
+def _insert_tasks(db: Session, rows: List[dict]) -> List[int]:
+    """
+    INSERT multi-row em blocos de TASKS_BATCH_CHUNK, devolvendo os ids na
+    ordem das linhas. Com RETURNING (SQLite/MariaDB) os ids vêm do próprio
+    INSERT; no MySQL vêm de LAST_INSERT_ID() + posição, já que um INSERT
+    multi-row com número de linhas conhecido recebe ids consecutivos.
+    """
+    table = Task.__table__
+    ids: List[int] = []
+    for k in range(0, len(rows), TASKS_BATCH_CHUNK):
+        chunk = rows[k:k + TASKS_BATCH_CHUNK]
+        if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            res = db.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), chunk)
+            ids.extend(res.scalars())
+        else:
+            first = db.execute(insert(table).values(chunk)).lastrowid
+            ids.extend(range(first, first + len(chunk)))
+    return ids
+
+def apply_task_batch(db: Session, owner_id: int, ops: List[dict]):
+    """
+    Aplica um lote misto numa transação só. Se algum item for inválido
+    nada é aplicado (applied=False). Ids inexistentes viram 404 no item e
+    não impedem o resto. Ordem: updates, deletes, creates.
+    Devolve (applied, resultados por item).
+    """
+    results: List[dict] = []
+    creates, updates, deletes = [], [], []
+    for i, op in enumerate(ops):
+        kind, task_id, payload, err = _batch_item(op)
+        if err:
+            results.append({"index": i, "op": kind, "id": task_id, "status": 422, "error": err})
+            continue
+        results.append({"index": i, "op": kind, "id": task_id, "status": None})
+        if kind == "create":
+            creates.append((i, payload))
+        elif kind == "update":
+            updates.append((i, task_id, payload))
+        else:
+            deletes.append((i, task_id))
+    if any(r["status"] == 422 for r in results):
+        return False, results
+
+    table = Task.__table__
+    spans = [task_span(p.start_at, p.end_at) for _, _, p in updates] + \
+            [task_span(p.start_at, p.end_at) for _, p in creates]
+    version = bump_tasks_version(db, owner_id, max(spans, default=0))
+    wanted = {t for _, t, _ in updates} | {t for _, t in deletes}
+    # id -> (status, priority, start_at) atuais, para existência e contadores
+    existing = {}
+    wanted_l = sorted(wanted)
+    for k in range(0, len(wanted_l), TASKS_BATCH_CHUNK):
+        existing.update((r.id, (r.status, r.priority, r.start_at)) for r in db.execute(
+            select(table.c.id, table.c.status, table.c.priority, table.c.start_at)
+            .where(table.c.owner_id == owner_id, table.c.id.in_(wanted_l[k:k + TASKS_BATCH_CHUNK]))))
+    # os que não estão em tasks podem estar arquivados (delete vale, update é 409)
+    archive = TaskArchive.__table__
+    missing = sorted(wanted - set(existing))
+    archived = {}
+    for k in range(0, len(missing), TASKS_BATCH_CHUNK):
+        archived.update((r.id, (r.status, r.priority, r.start_at)) for r in db.execute(
+            select(archive.c.id, archive.c.status, archive.c.priority, archive.c.start_at)
+            .where(archive.c.owner_id == owner_id, archive.c.id.in_(missing[k:k + TASKS_BATCH_CHUNK]))))
+    deltas = CountDeltas()
+
+    # UPDATE em executemany, agrupado pelo conjunto de campos enviados
+    groups = {}
+    for i, task_id, payload in updates:
+        if task_id not in existing:
+            results[i]["status"] = 409 if task_id in archived else 404
+            continue
+        values = payload.model_dump(exclude_unset=True)
+        groups.setdefault(tuple(sorted(values)), []).append(dict(values, _id=task_id))
+        old = existing[task_id]
+        new = (values.get("status", old[0]), values.get("priority", old[1]), values.get("start_at", old[2]))
+        deltas.remove(*old)
+        deltas.add(*new)
+        existing[task_id] = new
+        results[i]["status"] = 200
+    for keys, params in groups.items():
+        stmt = (update(table)
+                .where(table.c.id == bindparam("_id"), table.c.owner_id == owner_id)
+                .values({**{k: bindparam(k) for k in keys}, "version": version}))
+        db.execute(stmt, params)
+
+    to_delete, to_delete_archived = [], []
+    for i, task_id in deletes:
+        if task_id in existing:
+            deltas.remove(*existing.pop(task_id))
+            to_delete.append(task_id)
+        elif task_id in archived:
+            deltas.remove(*archived.pop(task_id))
+            to_delete_archived.append(task_id)
+        else:
+            results[i]["status"] = 404
+            continue
+        results[i]["status"] = 204
+    for t, ids in ((table, to_delete), (archive, to_delete_archived)):
+        for k in range(0, len(ids), TASKS_BATCH_CHUNK):
+            db.execute(delete(t).where(t.c.owner_id == owner_id, t.c.id.in_(ids[k:k + TASKS_BATCH_CHUNK])))
+    to_delete += to_delete_archived
+    if to_delete:
+        db.execute(insert(TaskTombstone.__table__),
+                   [{"owner_id": owner_id, "task_id": t, "version": version,
+                     "deleted_at": datetime.utcnow()} for t in to_delete])
+
+    if creates:
+        rows = [dict(p.model_dump(), owner_id=owner_id, version=version) for _, p in creates]
+        for r in rows:
+            deltas.add(r["status"], r["priority"], r["start_at"])
+        for (i, _), new_id in zip(creates, _insert_tasks(db, rows)):
+            results[i]["id"] = new_id
+            results[i]["status"] = 201
+
+    apply_count_deltas(db, owner_id, deltas)
+    db.commit()
+    return True, results
+
+@app.post("/auth/register")
+def register(payload: RegisterIn, response: Response, db: Session = Depends(db_session),
+             idempotency_key: Optional[str] = Header(default=None)):
+    idem = idempotency("register", idempotency_key, payload)
+    try:
+        ensure_schema(db)
+        u = replay_register(db, idem)
+        if u is not None:
+            _replayed(response)
+            return {"accessToken": mk_token(u)}
+        if find_user_by_email(db, payload.email):
+            raise HTTPException(status_code=409, detail="email already in use")
+        u = create_user(db, payload, hash_pw(payload.password), idem)
+        return {"accessToken": mk_token(u)}
+
+    except IntegrityError:
+        db.rollback()
+        u = replay_register(db, idem)
+        if u is not None:
+            _replayed(response)
+            return {"accessToken": mk_token(u)}
+        raise HTTPException(status_code=409, detail="email already in use")
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    except (HTTPException, PoolTimeoutError):
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"register failed: {type(e).__name__}")
+
+@app.post("/auth/login")
+def login(payload: LoginIn, db: Session = Depends(db_session)):
+    try:
+        ensure_schema(db)
+        u = find_user_by_email(db, payload.email)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if not u:
+        raise HTTPException(status_code=401, detail="invalid credentials")
+    ok, new_hash = verify_pw(payload.password, u.password_hash)
+    if not ok:
+        raise HTTPException(status_code=401, detail="invalid credentials")
+    rehash_user(db, u, new_hash)
+    return {"accessToken": mk_token(u)}
+
+@app.put("/auth/password")
+def change_password(payload: PasswordChangeIn, current: Identity = Depends(get_current_user),
+                    db: Session = Depends(db_session)):
+    """
+    Troca a senha e incrementa token_version: os tokens emitidos antes
+    deixam de valer e a identidade sai do cache (evento after_update).
+    """
+    try:
+        u = load_user(db, current.id)
+        if not check_pw(payload.current_password, u.password_hash):
+            raise HTTPException(status_code=401, detail="invalid credentials")
+        u.password_hash = hash_pw(payload.new_password)
+        u.token_version = (u.token_version or 0) + 1
+        u.token_changed_at = datetime.utcnow()
+        db.commit(); db.refresh(u)
+        return {"accessToken": mk_token(u)}
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+
+def _logout_claims(authorization: Optional[str]) -> dict:
+    claims = token_claims(authorization)
+    if not claims.get("jti"):
+        raise HTTPException(status_code=400, detail="token has no jti; it expires on its own")
+    return claims
+
+def _forget_token(authorization: str, claims: dict) -> Response:
+    REVOKED.add(claims["jti"], float(claims["exp"]))
+    TOKEN_CACHE.pop(token_digest(authorization[7:]))
+    return Response(status_code=204)
+
+@app.post("/auth/logout", status_code=204)
+def logout(authorization: Optional[str] = Header(default=None),
+           current: Identity = Depends(get_current_user), db: Session = Depends(db_session)):
+    """Revoga o token usado no request até ele expirar."""
+    claims = _logout_claims(authorization)
+    try:
+        ensure_schema(db)
+        revoke_token(db, claims)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return _forget_token(authorization, claims)
+
+@app.get("/api/tasks", response_model=List[TaskOut])
+def list_tasks(request: Request,
+               cursor: Optional[str] = None,
+               limit: int = Query(default=TASKS_PAGE_DEFAULT, ge=1, le=TASKS_PAGE_MAX),
+               filters: TaskFilters = Depends(task_filters),
+               desc: bool = Depends(task_order),
+               include_archived: bool = False,
+               if_none_match: Optional[str] = Header(default=None),
+               current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    """
+    Lista paginada por cursor (keyset em start_at, id; ?order=desc inverte).
+    Se houver mais páginas, o cursor da próxima vem no header X-Next-Cursor
+    (válido para a mesma ordem). ?include_archived=true inclui as tarefas
+    arquivadas. Responde com
+    ETag; com If-None-Match igual devolve 304 sem consultar as tarefas.
+    X-Changes-Cursor é o 'since' para /api/tasks/changes.
+    """
+    try:
+        ensure_schema(db)
+        etag, version, page = tasks_page_if_changed(db, current.id, cursor, limit, filters,
+                                                    request, if_none_match, desc, include_archived)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return _listing_response(etag, version, page)
+
+@app.get("/api/tasks/changes")
+def task_changes_feed(since: int = Query(ge=0),
+                      current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    """
+    Mudanças desde a versão 'since': tarefas criadas/alteradas e ids
+    apagados, mais o cursor para a próxima chamada. 410 se forem mais de
+    CHANGES_MAX (o cliente recarrega /api/tasks).
+    """
+    try:
+        ensure_schema(db)
+        result = task_changes(db, current.id, since)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return _changes_body(result)
+
+@app.get("/api/tasks/range", response_model=List[TaskOut])
+def range_tasks(frm: datetime = Query(alias="from"), to: datetime = Query(),
+                cursor: Optional[str] = None,
+                limit: int = Query(default=TASKS_PAGE_MAX, ge=1, le=TASKS_PAGE_MAX),
+                filters: TaskFilters = Depends(task_filters),
+                current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    """
+    Tarefas que cruzam a janela [from, to) (visão de semana/mês), inclusive
+    as que começam antes de 'from'. Paginada como /api/tasks.
+    """
+    check_range(frm, to)
+    try:
+        ensure_schema(db)
+        rows, next_cursor = tasks_in_range(db, current.id, frm, to, cursor, limit, filters)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return render_tasks(rows, next_cursor)
+
+@app.get("/api/tasks/stats")
+def stats_tasks(frm: Optional[date] = Query(default=None, alias="from"), to: Optional[date] = None,
+                current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    """
+    Contagens por status e prioridade, atrasadas (end_at no passado e não
+    'done') e carga por dia de início em [from, to) (padrão: hoje + 7 dias).
+    """
+    frm, to = stats_window(frm, to)
+    try:
+        ensure_schema(db)
+        return task_stats(db, current.id, frm, to, datetime.utcnow())
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+
+@app.get("/api/tasks/search", response_model=List[TaskOut])
+def search_tasks_route(q: str = Query(max_length=200), cursor: Optional[str] = None,
+                       limit: int = Query(default=SEARCH_PAGE_DEFAULT, ge=1, le=TASKS_PAGE_MAX),
+                       current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    """
+    Busca no título e na descrição: todas as palavras (por prefixo, sem
+    acento), ordenadas por relevância. Paginada pelo header X-Next-Cursor.
+    """
+    terms, offset = search_query_terms(q), decode_search_cursor(cursor)
+    try:
+        ensure_schema(db)
+        rows, next_cursor = search_tasks(db, current.id, terms, offset, limit)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return render_tasks(rows, next_cursor)
+
+@app.get("/api/tasks/conflicts")
+def conflicts_tasks(frm: datetime = Query(alias="from"), to: datetime = Query(),
+                    filters: TaskFilters = Depends(task_filters),
+                    current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    """Pares de tarefas sobrepostas e blocos ocupados/livres em [from, to)."""
+    check_range(frm, to)
+    try:
+        ensure_schema(db)
+        result = task_conflicts(db, current.id, frm, to, filters)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return _conflicts_body(result)
+
+@app.get("/api/rules")
+def get_rules(current: Identity = Depends(get_current_user), db: Session = Depends(db_read_session)):
+    try:
+        ensure_schema(db)
+        rules = list_rules(db, current.id)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return FastJSONResponse(rules)
+
+@app.get("/api/rules/occurrences")
+def rule_occurrences_range(frm: datetime = Query(alias="from"), to: datetime = Query(),
+                           current: Identity = Depends(get_current_user),
+                           db: Session = Depends(db_read_session)):
+    """
+    Ocorrências das tarefas recorrentes que cruzam [from, to), geradas na
+    hora a partir das regras, com as exceções aplicadas.
+    """
+    check_range(frm, to)
+    try:
+        ensure_schema(db)
+        result = occurrences_in_range(db, current.id, frm, to)
+    except (OperationalError, ProgrammingError):
+        _dispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return _occurrences_body(result)
+
+@app.post("/api/rules", status_code=201)
+def create_rule(payload: RuleIn, current: Identity = Depends(get_current_user), db: Session = Depends(db_session)):
+    _, last_end = check_rule(payload)
+    try:
+        ensure_schema(db)
+        rule_id = create_rule_row(db, current.id, payload, last_end)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if rule_id is None:
+        raise HTTPException(status_code=422, detail=f"limited to {RULES_MAX} rules per user")
+    return {"id": rule_id}
+
+@app.put("/api/rules/{rule_id}/exceptions")
+def put_exception(rule_id: int, payload: RuleExceptionIn, current: Identity = Depends(get_current_user),
+                  db: Session = Depends(db_session)):
+    """Cancela ou altera uma ocorrência (pelo início original)."""
+    check_rule_exception(payload)
+    try:
+        ensure_schema(db)
+        stored = put_rule_exception(db, current.id, rule_id, payload)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if not stored:
         raise HTTPException(status_code=404, detail="not found")
+    return {"rule_id": rule_id, "occurrence_at": payload.occurrence_at}
+
+@app.delete("/api/rules/{rule_id}", status_code=204)
+def delete_rule(rule_id: int, current: Identity = Depends(get_current_user), db: Session = Depends(db_session)):
     try:
-        db.delete(t); db.commit()
-        return
+        ensure_schema(db)
+        deleted = delete_rule_row(db, current.id, rule_id)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="not found")
+    return
+
+@app.post("/api/tasks", status_code=201)
+def create_task(payload: TaskIn, response: Response, current: Identity = Depends(get_current_user),
+                db: Session = Depends(db_session), idempotency_key: Optional[str] = Header(default=None)):
+    check_task_window(payload)
+    check_task_values(payload)
+    idem = idempotency(f"tasks:{current.id}", idempotency_key, payload)
+    try:
+        ensure_schema(db)
+        body, replayed = create_task_once(db, current.id, payload, idem)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if replayed:
+        _replayed(response)
+    return body
+
+@app.put("/api/tasks/{task_id}")
+def update_task(task_id: int, payload: TaskIn, current: Identity = Depends(get_current_user), db: Session = Depends(db_session)):
+    check_task_window(payload)
+    check_task_values(payload)
+    try:
+        ensure_schema(db)
+        updated = update_task_row(db, current.id, task_id, payload)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if updated is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return {"id": updated}
+
+@app.delete("/api/tasks/{task_id}", status_code=204)
+def delete_task(task_id: int, current: Identity = Depends(get_current_user), db: Session = Depends(db_session)):
+    try:
+        ensure_schema(db)
+        deleted = delete_task_row(db, current.id, task_id)
+    except (OperationalError, ProgrammingError):
+        db.rollback(); _dispose_engine()
+        raise HTTPException(status_code=503, detail="database unavailable")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="not found")
+    return
+
+@app.post("/api/tasks:batch")
+def batch_tasks(payload: TaskBatchIn, response: Response,
+                current: Identity = Depends(get_current_user), db: Session = Depends(db_session)):
+    """
+    Lote de create/update/delete numa transação (INSERT multi-row e UPDATE
+    em executemany). 200 com o resultado de cada item; 422 se algum item
+    for inválido, e nesse caso nada é gravado.
+    """
+    if len(payload.ops) > TASKS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"batch limited to {TASKS_BATCH_MAX} operations")
+    try:
+        ensure_schema(db)
+        applied, results = apply_task_batch(db, current.id, payload.ops)
     except (OperationalError, ProgrammingError):
         db.rollback(); _dispose_engine()
         raise HTTPException(status_code=503, detail="database unavailable")
+    if not applied:
+        response.status_code = 422
+    return {"applied": applied, "results": results}
+
+# ---------------- Exportação em streaming ----------------
+EXPORT_COLUMNS = ("id", "title", "description", "start_at", "end_at", "status", "priority")
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "1000"))
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "tasks.ndjson"),
+    "csv": ("text/csv; charset=utf-8", "tasks.csv"),
+}
+
+def _export_cell(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+def _export_batches(st: HostState, owner_id: int, filters: TaskFilters, include_archived: bool = False):
+    """
+    Lê as tarefas com cursor do lado do servidor (stream_results/yield_per):
+    só um bloco de EXPORT_FETCH_ROWS linhas fica em memória por vez. Com
+    include_archived, as de tasks_archive vêm depois, na mesma ordem.
+    """
+    for T in (Task, TaskArchive) if include_archived else (Task,):
+        table = T.__table__
+        stmt = (select(*[table.c[c] for c in EXPORT_COLUMNS])
+                .where(table.c.owner_id == owner_id)
+                .order_by(table.c.start_at, table.c.id))
+        stmt = apply_task_filters(stmt, filters, T)
+        with st.get_engine().connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=EXPORT_FETCH_ROWS).execute(stmt)
+            for rows in result.partitions():
+                yield rows
+
+def _ndjson_chunks(batches):
+    for rows in batches:
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, map(_export_cell, r))), ensure_ascii=False) + "\n"
+                      for r in rows).encode()
+
+def _csv_chunks(batches):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        w.writerows([_export_cell(v) for v in r] for r in rows)
+        yield buf.getvalue().encode()
+        buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+def _gzip_chunks(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """True se o cliente aceita gzip (ignora 'gzip;q=0')."""
+    for part in (accept_encoding or "").lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+@app.get("/api/tasks/export")
+def export_tasks(format: str = Query(default="ndjson"),
+                 filters: TaskFilters = Depends(task_filters),
+                 include_archived: bool = False,
+                 accept_encoding: Optional[str] = Header(default=None),
+                 current: Identity = Depends(get_current_user)):
+    """
+    Exporta todas as tarefas (com os mesmos filtros de /api/tasks) em
+    NDJSON ou CSV, em streaming: o primeiro byte sai antes de o resultado
+    inteiro ser lido e a memória não cresce com o número de tarefas.
+    Com 'Accept-Encoding: gzip' a resposta vai comprimida.
+    ?include_archived=true inclui as arquivadas (depois das demais).
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    try:
+        st = ROUTER.reader()
+    except NoHealthyHost:
+        raise HTTPException(status_code=503, detail="database unavailable")
+    media_type, filename = EXPORT_FORMATS[format]
+    batches = _export_batches(st, current.id, filters, include_archived)
+    body = _ndjson_chunks(batches) if format == "ndjson" else _csv_chunks(batches)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if accepts_gzip(accept_encoding):
+        body = _gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+# ---------------- Handlers async (DB_ASYNC=1) ----------------
+aio = APIRouter()
+
+async def _arun(db: AsyncSession, fn, *args):
+    """Roda uma regra síncrona na AsyncSession; falha de banco vira 503."""
+    try:
+        return await db.run_sync(fn, *args)
+    except (OperationalError, ProgrammingError):
+        await db.rollback(); await _adispose_engine(db.info.get("db_host"))
+        raise HTTPException(status_code=503, detail="database unavailable")
+
+async def _aensure_schema(db: AsyncSession) -> None:
+    if not _schema_ready:
+        await _arun(db, ensure_schema)
+
+async def aget_current_user(authorization: Optional[str] = Header(default=None),
+                            db: AsyncSession = Depends(adb_read_session)) -> Identity:
+    claims = token_claims(authorization)
+    with stage("user_lookup"):
+        ident = cached_identity(claims)
+        if ident is None:
+            ident = await _arun(db, find_identity, claims)
+            if ident is None:
+                # réplica atrasada para este token: relê no primário
+                async for primary in _asession(ROUTER.primary):
+                    ident = await _arun(primary, find_identity, claims)
+            remember_identity(ident)
+    return check_token_version(ident, claims)
+
+@aio.post("/auth/register")
+async def aregister(payload: RegisterIn, response: Response, db: AsyncSession = Depends(adb_session),
+                    idempotency_key: Optional[str] = Header(default=None)):
+    idem = idempotency("register", idempotency_key, payload)
+    await _aensure_schema(db)
+    u = await _arun(db, replay_register, idem)
+    if u is None:
+        if await _arun(db, find_user_by_email, payload.email):
+            raise HTTPException(status_code=409, detail="email already in use")
+        password_hash = await ahash_pw(payload.password)
+        try:
+            return {"accessToken": mk_token(await _arun(db, create_user, payload, password_hash, idem))}
+        except IntegrityError:
+            await db.rollback()
+            u = await _arun(db, replay_register, idem)
+            if u is None:
+                raise HTTPException(status_code=409, detail="email already in use")
+    _replayed(response)
+    return {"accessToken": mk_token(u)}
+
+@aio.post("/auth/login")
+async def alogin(payload: LoginIn, db: AsyncSession = Depends(adb_session)):
+    await _aensure_schema(db)
+    u = await _arun(db, find_user_by_email, payload.email)
+    if not u:
+        raise HTTPException(status_code=401, detail="invalid credentials")
+    ok, new_hash = await averify_pw(payload.password, u.password_hash)
+    if not ok:
+        raise HTTPException(status_code=401, detail="invalid credentials")
+    await db.run_sync(rehash_user, u, new_hash)
+    return {"accessToken": mk_token(u)}
+
+@aio.post("/auth/logout", status_code=204)
+async def alogout(authorization: Optional[str] = Header(default=None),
+                  current: Identity = Depends(aget_current_user),
+                  db: AsyncSession = Depends(adb_session)):
+    claims = _logout_claims(authorization)
+    await _aensure_schema(db)
+    await _arun(db, revoke_token, claims)
+    return _forget_token(authorization, claims)
+
+@aio.get("/api/tasks", response_model=List[TaskOut])
+async def alist_tasks(request: Request,
+                      cursor: Optional[str] = None,
+                      limit: int = Query(default=TASKS_PAGE_DEFAULT, ge=1, le=TASKS_PAGE_MAX),
+                      filters: TaskFilters = Depends(task_filters),
+                      desc: bool = Depends(task_order),
+                      include_archived: bool = False,
+                      if_none_match: Optional[str] = Header(default=None),
+                      current: Identity = Depends(aget_current_user),
+                      db: AsyncSession = Depends(adb_read_session)):
+    await _aensure_schema(db)
+    etag, version, page = await _arun(db, tasks_page_if_changed, current.id, cursor, limit,
+                                      filters, request, if_none_match, desc, include_archived)
+    return _listing_response(etag, version, page)
+
+@aio.get("/api/tasks/changes")
+async def atask_changes_feed(since: int = Query(ge=0),
+                             current: Identity = Depends(aget_current_user),
+                             db: AsyncSession = Depends(adb_read_session)):
+    await _aensure_schema(db)
+    result = await _arun(db, task_changes, current.id, since)
+    return _changes_body(result)
+
+@aio.get("/api/tasks/range", response_model=List[TaskOut])
+async def arange_tasks(frm: datetime = Query(alias="from"), to: datetime = Query(),
+                       cursor: Optional[str] = None,
+                       limit: int = Query(default=TASKS_PAGE_MAX, ge=1, le=TASKS_PAGE_MAX),
+                       filters: TaskFilters = Depends(task_filters),
+                       current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_read_session)):
+    check_range(frm, to)
+    await _aensure_schema(db)
+    rows, next_cursor = await _arun(db, tasks_in_range, current.id, frm, to, cursor, limit, filters)
+    return render_tasks(rows, next_cursor)
+
+@aio.get("/api/tasks/search", response_model=List[TaskOut])
+async def asearch_tasks(q: str = Query(max_length=200), cursor: Optional[str] = None,
+                        limit: int = Query(default=SEARCH_PAGE_DEFAULT, ge=1, le=TASKS_PAGE_MAX),
+                        current: Identity = Depends(aget_current_user),
+                        db: AsyncSession = Depends(adb_read_session)):
+    terms, offset = search_query_terms(q), decode_search_cursor(cursor)
+    await _aensure_schema(db)
+    rows, next_cursor = await _arun(db, search_tasks, current.id, terms, offset, limit)
+    return render_tasks(rows, next_cursor)
+
+@aio.get("/api/tasks/stats")
+async def astats_tasks(frm: Optional[date] = Query(default=None, alias="from"), to: Optional[date] = None,
+                       current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_read_session)):
+    frm, to = stats_window(frm, to)
+    await _aensure_schema(db)
+    return await _arun(db, task_stats, current.id, frm, to, datetime.utcnow())
+
+@aio.get("/api/tasks/conflicts")
+async def aconflicts_tasks(frm: datetime = Query(alias="from"), to: datetime = Query(),
+                           filters: TaskFilters = Depends(task_filters),
+                           current: Identity = Depends(aget_current_user),
+                           db: AsyncSession = Depends(adb_read_session)):
+    check_range(frm, to)
+    await _aensure_schema(db)
+    result = await _arun(db, task_conflicts, current.id, frm, to, filters)
+    return _conflicts_body(result)
+
+@aio.get("/api/rules")
+async def aget_rules(current: Identity = Depends(aget_current_user),
+                     db: AsyncSession = Depends(adb_read_session)):
+    await _aensure_schema(db)
+    return FastJSONResponse(await _arun(db, list_rules, current.id))
+
+@aio.get("/api/rules/occurrences")
+async def arule_occurrences_range(frm: datetime = Query(alias="from"), to: datetime = Query(),
+                                  current: Identity = Depends(aget_current_user),
+                                  db: AsyncSession = Depends(adb_read_session)):
+    check_range(frm, to)
+    await _aensure_schema(db)
+    result = await _arun(db, occurrences_in_range, current.id, frm, to)
+    return _occurrences_body(result)
+
+@aio.post("/api/rules", status_code=201)
+async def acreate_rule(payload: RuleIn, current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_session)):
+    _, last_end = check_rule(payload)
+    await _aensure_schema(db)
+    rule_id = await _arun(db, create_rule_row, current.id, payload, last_end)
+    if rule_id is None:
+        raise HTTPException(status_code=422, detail=f"limited to {RULES_MAX} rules per user")
+    return {"id": rule_id}
+
+@aio.put("/api/rules/{rule_id}/exceptions")
+async def aput_exception(rule_id: int, payload: RuleExceptionIn, current: Identity = Depends(aget_current_user),
+                         db: AsyncSession = Depends(adb_session)):
+    check_rule_exception(payload)
+    await _aensure_schema(db)
+    if not await _arun(db, put_rule_exception, current.id, rule_id, payload):
+        raise HTTPException(status_code=404, detail="not found")
+    return {"rule_id": rule_id, "occurrence_at": payload.occurrence_at}
+
+@aio.delete("/api/rules/{rule_id}", status_code=204)
+async def adelete_rule(rule_id: int, current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_session)):
+    await _aensure_schema(db)
+    if not await _arun(db, delete_rule_row, current.id, rule_id):
+        raise HTTPException(status_code=404, detail="not found")
+    return
+
+@aio.post("/api/tasks", status_code=201)
+async def acreate_task(payload: TaskIn, response: Response, current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_session),
+                       idempotency_key: Optional[str] = Header(default=None)):
+    check_task_window(payload)
+    check_task_values(payload)
+    idem = idempotency(f"tasks:{current.id}", idempotency_key, payload)
+    await _aensure_schema(db)
+    body, replayed = await _arun(db, create_task_once, current.id, payload, idem)
+    if replayed:
+        _replayed(response)
+    return body
+
+@aio.put("/api/tasks/{task_id}")
+async def aupdate_task(task_id: int, payload: TaskIn, current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_session)):
+    check_task_window(payload)
+    check_task_values(payload)
+    await _aensure_schema(db)
+    updated = await _arun(db, update_task_row, current.id, task_id, payload)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return {"id": updated}
+
+@aio.delete("/api/tasks/{task_id}", status_code=204)
+async def adelete_task(task_id: int, current: Identity = Depends(aget_current_user),
+                       db: AsyncSession = Depends(adb_session)):
+    await _aensure_schema(db)
+    if not await _arun(db, delete_task_row, current.id, task_id):
+        raise HTTPException(status_code=404, detail="not found")
+    return
+
+def use_async_routes() -> None:
+    """Troca as rotas sync pelas equivalentes do router 'aio'."""
+    keys = {(r.path, m) for r in aio.routes for m in r.methods}
+    app.router.routes[:] = [
+        r for r in app.router.routes
+        if not (isinstance(r, APIRoute) and any((r.path, m) in keys for m in r.methods))
+    ]
+    app.include_router(aio)
+
+    @app.on_event("startup")
+    async def _startup_async_engine():
+        # uma tentativa só, como no startup sync: sem banco, o engine async
+        # é criado no primeiro request e /ready segue o aquecimento sync
+        await apick_engine()
+
+    @app.on_event("shutdown")
+    async def _shutdown_async_engine():
+        for st in ROUTER.primaries + ROUTER.replicas:
+            if st.aengine is not None:
+                await st.aengine.dispose()
+
+if DB_ASYNC:
+    use_async_routes()
@@ -0,0 +1,43 @@
+"""
+Custo de autenticação por request (get_current_user com a identidade já no
+cache): decode do JWT a cada request com cada backend (jose, native, pyjwt
+se instalado) contra o cache de tokens já verificados.
+
+    python bench/bench_auth.py [--calls 20000]
+"""
+import argparse
+
+from common import setup_env, percentiles, timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=20_000)
+    args = ap.parse_args()
+
+    setup_env()
+    from app import main as api
+
+    user = api.User(id=1, email="bench@example.com", name="Bench", token_version=0)
+    api.remember_identity(user)
+    auth = f"Bearer {api.mk_token(user)}"
+    cached = api.TOKEN_CACHE
+
+    variants = [("jose", api._jose_decode, False), ("native", api._native_decode, False)]
+    try:
+        variants.append(("pyjwt", api._jwt_backend("pyjwt")[1], False))
+    except RuntimeError:
+        print("pyjwt não instalado: pulando")
+    variants.append(("cache (hit)", api._jose_decode, True))
+
+    for label, decode, use_cache in variants:
+        api.jwt_decode = decode
+        api.TOKEN_CACHE = cached if use_cache else api.TTLCache(0, 0)
+        api.get_current_user(auth, None)  # aquece
+        r = percentiles(timed(lambda: api.get_current_user(auth, None), args.calls))
+        print(f"{label:12} p50 {r['p50_ms'] * 1000:7.1f} us  p99 {r['p99_ms'] * 1000:7.1f} us  "
+              f"média {r['mean_ms'] * 1000:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Importação de N tarefas: uma chamada POST /api/tasks por tarefa versus
+POST /api/tasks:batch em lotes (INSERT multi-row numa transação).
+
+    python bench/bench_batch.py [--tasks 5000] [--batch-size 5000] [--mysql]
+"""
+import argparse
+import time
+
+from common import setup_env, register
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=5000)
+    ap.add_argument("--batch-size", type=int, default=5000)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+
+    setup_env(args.mysql)
+    from fastapi.testclient import TestClient
+    from app import main as api
+
+    def task(i):
+        return {"title": f"Plano {i}", "start_at": "2025-03-01T09:00:00", "end_at": "2025-03-01T10:00:00"}
+
+    with TestClient(api.app) as client:
+        h1 = register(client, "bench-per-item@example.com")
+        t0 = time.perf_counter()
+        for i in range(args.tasks):
+            client.post("/api/tasks", headers=h1, json=task(i)).raise_for_status()
+        per_item = time.perf_counter() - t0
+
+        h2 = register(client, "bench-batch@example.com")
+        t0 = time.perf_counter()
+        for k in range(0, args.tasks, args.batch_size):
+            ops = [{"op": "create", "task": task(i)} for i in range(k, min(args.tasks, k + args.batch_size))]
+            client.post("/api/tasks:batch", headers=h2, json={"ops": ops}).raise_for_status()
+        batch = time.perf_counter() - t0
+
+    print(f"per-item : {args.tasks} tarefas em {per_item:.2f}s ({args.tasks / per_item:,.0f} tarefas/s)")
+    print(f"batch    : {args.tasks} tarefas em {batch:.2f}s ({args.tasks / batch:,.0f} tarefas/s)"
+          f"  -> {per_item / batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
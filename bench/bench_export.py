@@ -0,0 +1,71 @@
+"""
+Memória de pico e tempo até o primeiro bloco da exportação em streaming
+(/api/tasks/export) comparados com carregar a lista inteira via ORM +
+TaskOut, para N tarefas de um usuário.
+
+    python bench/bench_export.py [--tasks 100000] [--mysql]
+"""
+import argparse
+import time
+import tracemalloc
+
+from common import setup_env, register
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    first = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, elapsed, peak / 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=100_000)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+
+    setup_env(args.mysql)
+    from fastapi.testclient import TestClient
+    from app import main as api
+
+    with TestClient(api.app) as client:
+        headers = register(client, "bench-export@example.com")
+        for k in range(0, args.tasks, 5000):
+            ops = [{"op": "create", "task": {"title": f"Exp {i}", "description": "x" * 80,
+                                             "start_at": "2025-01-01T09:00:00", "end_at": "2025-01-01T10:00:00"}}
+                   for i in range(k, min(args.tasks, k + 5000))]
+            client.post("/api/tasks:batch", headers=headers, json={"ops": ops}).raise_for_status()
+        owner = api.token_claims(headers["Authorization"])["sub"]
+
+    st = api.ROUTER.reader()
+    filters = api.TaskFilters()
+
+    def stream():
+        first_at = None
+        t0 = time.perf_counter()
+        for chunk in api._ndjson_chunks(api._export_batches(st, int(owner), filters)):
+            if first_at is None:
+                first_at = time.perf_counter() - t0
+        return first_at
+
+    def full_list():
+        db = api._session_for(st)
+        try:
+            rows, _ = api.tasks_page(db, int(owner), None, args.tasks, filters)
+            body = [api.TaskOut.model_validate(r).model_dump_json() for r in rows]
+            return len(body)
+        finally:
+            db.close()
+
+    ttfb, total, peak = measure(stream)
+    print(f"export stream : total {total:.2f}s, 1º bloco em {ttfb * 1000:.1f}ms, pico {peak:.1f} MB")
+    _, total, peak = measure(full_list)
+    print(f"lista inteira : total {total:.2f}s, pico {peak:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Latência de uma interação do frontend (carregar a página de tarefas: GET
+/api/tasks + GET /api/tasks/stats) contra a API num uvicorn local, como o
+app.py fazia (requests.request: conexão TCP nova por chamada, em sequência)
+e com o ApiClient (sessão keep-alive compartilhada, em sequência e em
+paralelo com gather).
+
+    python bench/bench_frontend_client.py [--tasks 200] [--runs 200]
+"""
+import argparse
+import sys
+
+import requests
+
+from common import ROOT_DIR, setup_env, percentiles, timed, start_server
+
+sys.path.insert(0, str(ROOT_DIR / "frontend"))
+from api_client import ApiClient  # noqa: E402
+
+PORT = 8766
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=200)
+    ap.add_argument("--runs", type=int, default=200)
+    args = ap.parse_args()
+
+    setup_env()
+    proc = start_server(PORT)
+    base = f"http://127.0.0.1:{PORT}"
+    try:
+        r = requests.post(f"{base}/auth/register", json={"name": "Bench", "email": "bench-front@example.com",
+                                                         "password": "bench-pass"})
+        headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+        ops = [{"op": "create", "task": {"title": f"Front {i}", "start_at": "2025-01-01T09:00:00",
+                                         "end_at": "2025-01-01T10:00:00"}} for i in range(args.tasks)]
+        requests.post(f"{base}/api/tasks:batch", headers=headers, json={"ops": ops}).raise_for_status()
+        paths = ("/api/tasks", "/api/tasks/stats")
+        client = ApiClient(base)
+
+        def before():
+            for p in paths:
+                requests.request("GET", f"{base}{p}", headers=headers, timeout=6).raise_for_status()
+
+        def session_seq():
+            for p in paths:
+                client.request("GET", p, headers=headers).raise_for_status()
+
+        def session_par():
+            for resp in client.gather(*(lambda p=p: client.request("GET", p, headers=headers) for p in paths)):
+                resp.raise_for_status()
+
+        for label, fn in (("antes (conexão nova, sequencial)", before),
+                          ("sessão keep-alive, sequencial", session_seq),
+                          ("sessão keep-alive, paralelo", session_par)):
+            fn()  # aquece
+            r = percentiles(timed(fn, args.runs))
+            print(f"{label:34} p50 {r['p50_ms']:7.2f} ms  p95 {r['p95_ms']:7.2f} ms")
+        client.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    main()
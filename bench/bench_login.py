@@ -0,0 +1,75 @@
+"""
+Vazão de /auth/login sob concorrência, com o hash de senha no próprio
+processo (PWD_WORKERS=0) e no pool de processos limitado. Em paralelo aos
+logins, um cliente mede a latência de /health para mostrar se o resto da
+API continua respondendo durante a rajada.
+
+    python bench/bench_login.py [--clients 64] [--duration 10] [--workers 4] [--mysql]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import setup_env, percentiles, start_server
+
+
+async def run(base: str, clients: int, duration: float) -> dict:
+    creds = {"email": "login-bench@example.com", "password": "login-bench-pass"}
+    limits = httpx.Limits(max_connections=clients + 1)
+    async with httpx.AsyncClient(base_url=base, timeout=30, limits=limits) as c:
+        await c.post("/auth/register", json={"name": "Bench", **creds})
+        lat, health_lat, status = [], [], {}
+        deadline = time.perf_counter() + duration
+
+        async def login_worker():
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                r = await c.post("/auth/login", json=creds)
+                status[r.status_code] = status.get(r.status_code, 0) + 1
+                if r.status_code == 200:
+                    lat.append(time.perf_counter() - t0)
+
+        async def health_probe():
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                await c.get("/health")
+                health_lat.append(time.perf_counter() - t0)
+                await asyncio.sleep(0.05)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(health_probe(), *(login_worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - t0
+    return {
+        "logins_per_s": round(len(lat) / elapsed, 1),
+        "status": status,
+        "login": percentiles(lat),
+        "health_during_burst": percentiles(health_lat),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=64)
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=18821)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+    setup_env(args.mysql)
+
+    results = {}
+    for label, workers in (("inline", 0), (f"pool_{args.workers}", args.workers)):
+        proc = start_server(args.port, PWD_WORKERS=str(workers))
+        try:
+            results[label] = asyncio.run(run(f"http://127.0.0.1:{args.port}", args.clients, args.duration))
+        finally:
+            proc.terminate()
+            proc.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Latência de /api/tasks/range e /api/tasks/conflicts para um usuário com N
+tarefas espalhadas em ~3 anos: consulta limitada por max_task_span x a
+condição de sobreposição "ingênua" (start_at < to AND end_at > from), que
+lê todas as tarefas que começam antes de 'to'.
+
+    python bench/bench_range.py [--tasks 100000] [--mysql]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from common import setup_env, register, percentiles, timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=100_000)
+    ap.add_argument("--runs", type=int, default=50)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+
+    setup_env(args.mysql)
+    from fastapi.testclient import TestClient
+    from sqlalchemy import select
+    from app import main as api
+
+    rnd = random.Random(42)
+    base = datetime(2023, 1, 1)
+    with TestClient(api.app) as client:
+        headers = register(client, "bench-range@example.com")
+        for k in range(0, args.tasks, 5000):
+            ops = []
+            for i in range(k, min(args.tasks, k + 5000)):
+                start = base + timedelta(minutes=rnd.randrange(3 * 365 * 24 * 60))
+                # maioria curta; uma em mil dura alguns dias (férias, viagens)
+                hours = rnd.randrange(72, 240) if rnd.random() < 0.001 else rnd.choice([0.5, 1, 2, 4])
+                ops.append({"op": "create", "task": {
+                    "title": f"T{i}", "start_at": start.isoformat(),
+                    "end_at": (start + timedelta(hours=hours)).isoformat()}})
+            client.post("/api/tasks:batch", headers=headers, json={"ops": ops}).raise_for_status()
+        owner = int(api.token_claims(headers["Authorization"])["sub"])
+
+    st = api.ROUTER.reader()
+    filters = api.TaskFilters()
+    db = api._session_for(st)
+    print(f"{args.tasks} tarefas, max_task_span = {api.max_task_span(db, owner)}s")
+
+    def naive(frm, to):
+        T = api.Task
+        return db.execute(select(T.id, T.start_at, T.end_at)
+                          .where(T.owner_id == owner, T.start_at < to, T.end_at > frm)
+                          .order_by(T.start_at, T.id)).all()
+
+    try:
+        for label, days in (("semana", 7), ("mês", 31)):
+            windows = []
+            for _ in range(args.runs):
+                frm = base + timedelta(days=rnd.randrange(2 * 365))
+                windows.append((frm, frm + timedelta(days=days)))
+            it = iter(windows * 3)
+
+            def ranged():
+                frm, to = next(it)
+                api.tasks_in_range(db, owner, frm, to, None, api.TASKS_PAGE_MAX, filters)
+
+            def conflicts():
+                frm, to = next(it)
+                api.task_conflicts(db, owner, frm, to, filters)
+
+            def naive_q():
+                naive(*next(it))
+
+            print(f"{label:6} range     : {percentiles(timed(ranged, args.runs))}")
+            print(f"{label:6} conflicts : {percentiles(timed(conflicts, args.runs))}")
+            print(f"{label:6} ingênua   : {percentiles(timed(naive_q, args.runs))}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
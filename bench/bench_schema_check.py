@@ -0,0 +1,54 @@
+"""
+Latência de GET /api/tasks com a inspeção de schema por request (comportamento
+antigo de ensure_schema) versus a flag de schema pronto definida no startup.
+
+    python bench/bench_schema_check.py [--requests 2000] [--tasks 50] [--mysql]
+"""
+import argparse
+
+from common import setup_env, percentiles, timed, register
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--tasks", type=int, default=50)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+
+    setup_env(args.mysql)
+    from fastapi.testclient import TestClient
+    from sqlalchemy import inspect
+    from app import main as api
+
+    def legacy_ensure_schema(db):
+        # o que cada request fazia antes: duas idas ao information_schema
+        bind = db.get_bind()
+        insp = inspect(bind)
+        if (not insp.has_table("users")) or (not insp.has_table("tasks")):
+            api.Base.metadata.create_all(bind=bind)
+
+    with TestClient(api.app) as client:
+        headers = register(client, "bench-schema@example.com")
+        for i in range(args.tasks):
+            client.post("/api/tasks", headers=headers, json={
+                "title": f"t{i}", "start_at": "2025-01-01T10:00:00", "end_at": "2025-01-01T11:00:00",
+            })
+
+        def call():
+            client.get("/api/tasks", headers=headers)
+
+        results = {}
+        current = api.ensure_schema
+        for label, fn in (("inspect_per_request", legacy_ensure_schema), ("schema_ready_flag", current)):
+            api.ensure_schema = fn
+            timed(call, 100)  # aquecimento
+            results[label] = percentiles(timed(call, args.requests))
+        api.ensure_schema = current
+
+    for label, stats in results.items():
+        print(f"{label:22s} p50={stats['p50_ms']:.3f}ms  p99={stats['p99_ms']:.3f}ms  (n={stats['n']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Latência de /api/tasks/search para um usuário com N tarefas: busca indexada
+(FULLTEXT no MySQL, índice invertido em memória no SQLite) contra o LIKE
+'%termo%' em título e descrição, que lê todas as tarefas do usuário. No
+SQLite a primeira busca depois de uma escrita reconstrói o índice do dono
+(medida à parte como 'rebuild'); depois disso cada escrita só aplica o feed
+de mudanças ('escrita+busca').
+
+    python bench/bench_search.py [--tasks 100000] [--runs 50] [--mysql]
+"""
+import argparse
+import random
+import time
+
+from common import setup_env, register, percentiles, timed
+
+COMMON = ("reunião orçamento planilha cliente relatório entrega revisão projeto sprint deploy "
+          "banco contrato fornecedor mercado academia consulta viagem aluguel imposto backup "
+          "apresentação treinamento entrevista auditoria campanha").split()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=100_000)
+    ap.add_argument("--runs", type=int, default=50)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+
+    setup_env(args.mysql)
+    from fastapi.testclient import TestClient
+    from sqlalchemy import select, or_
+    from app import main as api
+
+    rnd = random.Random(42)
+    # vocabulário com cauda longa (nomes, projetos, códigos) além das palavras comuns
+    rare = ["".join(rnd.choices("bcdfglmnprstv", k=3)) + rnd.choice(["ado", "ente", "ção", "ismo", "ura"])
+            for _ in range(5000)]
+
+    def words(k):
+        return [rnd.choice(COMMON) if rnd.random() < 0.3 else rnd.choice(rare) for _ in range(k)]
+
+    with TestClient(api.app) as client:
+        headers = register(client, "bench-search@example.com")
+        for k in range(0, args.tasks, 5000):
+            ops = [{"op": "create", "task": {
+                "title": " ".join(words(3)) + f" {i}",
+                "description": " ".join(words(12)),
+                "start_at": "2025-01-01T09:00:00", "end_at": "2025-01-01T10:00:00"}}
+                for i in range(k, min(args.tasks, k + 5000))]
+            client.post("/api/tasks:batch", headers=headers, json={"ops": ops}).raise_for_status()
+        owner = int(api.token_claims(headers["Authorization"])["sub"])
+
+    db = api._session_for(api.ROUTER.reader())
+    T = api.Task
+    # um termo comum por prefixo + um da cauda: o caso típico de quem procura algo específico
+    queries = [[rnd.choice(COMMON)[:5], rnd.choice(rare)] for _ in range(args.runs)]
+    it = iter(queries * 3)
+
+    def indexed():
+        api.search_tasks(db, owner, api.search_query_terms(" ".join(next(it))), 0, 50)
+
+    def like():
+        terms = next(it)
+        cond = [or_(T.title.like(f"%{t}%"), T.description.like(f"%{t}%")) for t in terms]
+        # sem índice, ranquear exige ler todas as que casam: o LIMIT não corta a varredura
+        db.execute(select(*api.TASK_OUT_SELECT).where(T.owner_id == owner, *cond)).all()
+
+    try:
+        print(f"{args.tasks} tarefas; backend: {db.get_bind().dialect.name}")
+        if db.get_bind().dialect.name != "mysql":
+            api.SEARCH_INDEX.clear()
+            t0 = time.perf_counter()
+            api.SEARCH_INDEX.search(db, owner, ["rebuild"], 1)
+            print(f"rebuild   : {(time.perf_counter() - t0) * 1000:.1f} ms")
+        print(f"indexada  : {percentiles(timed(indexed, args.runs))}")
+        if db.get_bind().dialect.name != "mysql":
+            def after_write():
+                api.create_task_row(db, owner, api.TaskIn(title=" ".join(words(3)), start_at="2025-01-02T09:00:00",
+                                                          end_at="2025-01-02T10:00:00"))
+                indexed()
+            print(f"escrita+busca: {percentiles(timed(after_write, args.runs))}")
+        print(f"LIKE      : {percentiles(timed(like, args.runs))}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Custo de montar o JSON de 10k tarefas: o caminho antigo (entidades ORM +
+TaskOut do Pydantic por linha + encode) contra o atalho das listagens
+(select Core só com as colunas de TaskOut + orjson). Mede a consulta e a
+serialização separadas, em ms por 10k tarefas.
+
+    python bench/bench_serialize.py [--tasks 10000] [--runs 20] [--mysql]
+"""
+import argparse
+import json
+import time
+
+from common import setup_env, register, percentiles
+
+
+def measure(fn, runs: int):
+    out = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return percentiles(out)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=10_000)
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+
+    setup_env(args.mysql)
+    from fastapi.testclient import TestClient
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    from app import main as api
+
+    with TestClient(api.app) as client:
+        headers = register(client, "bench-serialize@example.com")
+        for k in range(0, args.tasks, 5000):
+            ops = [{"op": "create", "task": {"title": f"Ser {i}", "description": "descrição " * 5,
+                                             "start_at": "2025-01-01T09:00:00", "end_at": "2025-01-01T10:00:00"}}
+                   for i in range(k, min(args.tasks, k + 5000))]
+            client.post("/api/tasks:batch", headers=headers, json={"ops": ops}).raise_for_status()
+        owner = int(api.token_claims(headers["Authorization"])["sub"])
+
+    db = api._session_for(api.ROUTER.reader())
+    T = api.Task
+    adapter = TypeAdapter(list[api.TaskOut])
+    scale = 10_000 / args.tasks
+
+    def orm_rows():
+        db.expunge_all()
+        return db.query(T).filter_by(owner_id=owner).order_by(T.start_at, T.id).all()
+
+    def core_rows():
+        return db.execute(select(*api.TASK_OUT_SELECT).where(T.owner_id == owner)
+                          .order_by(T.start_at, T.id)).all()
+
+    orm, core = orm_rows(), core_rows()
+    assert json.loads(adapter.dump_json(adapter.validate_python(orm, from_attributes=True))) == \
+        json.loads(api.dumps_json(api.task_dicts(core)))
+
+    results = {
+        "query_orm": measure(orm_rows, args.runs),
+        "query_core": measure(core_rows, args.runs),
+        "encode_pydantic": measure(lambda: adapter.dump_json(adapter.validate_python(orm, from_attributes=True)),
+                                 args.runs),
+        "encode_orjson": measure(lambda: api.dumps_json(api.task_dicts(core)), args.runs),
+    }
+    db.close()
+    print(f"{args.tasks} tarefas (valores em ms, escalados para 10k); orjson={'sim' if api.orjson else 'não'}")
+    for name, r in results.items():
+        print(f"{name:16} p50 {r['p50_ms'] * scale:8.2f}  p95 {r['p95_ms'] * scale:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Custo de uma interação da página de tarefas com N tarefas, contra a API num
+uvicorn local: a lista inteira (todas as páginas de /api/tasks + tabela
+montada linha a linha, como o app.py fazia) contra o TaskPager (só a página
+visível, tabela por colunas) e contra a revalidação da mesma página vencido
+o TTL (If-None-Match, 304). Mostra também quantas tarefas ficam na sessão.
+
+    python bench/bench_task_table.py [--tasks 10000] [--page 50] [--runs 20]
+"""
+import argparse
+import sys
+
+import pandas as pd
+import requests
+
+from common import ROOT_DIR, setup_env, percentiles, timed, start_server
+
+sys.path.insert(0, str(ROOT_DIR / "frontend"))
+from api_client import ApiClient  # noqa: E402
+from task_cache import PRIORITY_LABELS, TaskPager, tasks_frame  # noqa: E402
+
+PORT = 8767
+
+
+def row_loop(tasks):
+    rows = []
+    for t in sorted(tasks, key=lambda x: x.get("start_at", "")):
+        rows.append({
+            "Título": t.get("title", ""),
+            "Início": t.get("start_at", ""),
+            "Fim": t.get("end_at", ""),
+            "Status": t.get("status", "todo"),
+            "Prioridade": PRIORITY_LABELS.get(t.get("priority", "medium"), t.get("priority", "")),
+            "Descrição": t.get("description", "") or "",
+        })
+    return pd.DataFrame(rows)  # o que o st.dataframe faz com a lista
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=10_000)
+    ap.add_argument("--page", type=int, default=50)
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+
+    setup_env()
+    proc = start_server(PORT)
+    base = f"http://127.0.0.1:{PORT}"
+    try:
+        r = requests.post(f"{base}/auth/register", json={"name": "Bench", "email": "bench-table@example.com",
+                                                         "password": "bench-pass"})
+        headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+        for k in range(0, args.tasks, 5000):
+            ops = [{"op": "create", "task": {"title": f"Tabela {i}", "description": "descrição " * 5,
+                                             "start_at": f"2025-01-{i % 28 + 1:02d}T09:00:00",
+                                             "end_at": f"2025-01-{i % 28 + 1:02d}T10:00:00"}}
+                   for i in range(k, min(args.tasks, k + 5000))]
+            requests.post(f"{base}/api/tasks:batch", headers=headers, json={"ops": ops}).raise_for_status()
+        client = ApiClient(base)
+        held = {}
+
+        def full_list():
+            tasks, params = [], {"limit": 1000}
+            while True:
+                resp = client.request("GET", "/api/tasks", headers=headers, params=params)
+                tasks.extend(resp.json())
+                if "X-Next-Cursor" not in resp.headers:
+                    break
+                params["cursor"] = resp.headers["X-Next-Cursor"]
+            held["lista inteira"] = len(tasks)
+            row_loop(tasks)
+
+        pager = TaskPager(0)
+        pager.set_query(args.page, "desc", ["todo"])
+
+        def one_page():
+            resp = client.request("GET", "/api/tasks", headers=headers, params=pager.params())
+            pager.store(resp.json(), resp.headers.get("X-Next-Cursor"), resp.headers.get("ETag"))
+            held["página"] = len(pager.rows)
+            tasks_frame(pager.rows)
+
+        def revalidate():
+            resp = client.request("GET", "/api/tasks", params=pager.params(),
+                                  headers={**headers, **pager.if_none_match()})
+            assert resp.status_code == 304
+            pager.not_modified()
+
+        for label, fn in (("lista inteira", full_list), ("página", one_page), ("página, 304", revalidate)):
+            fn()  # aquece
+            r = percentiles(timed(fn, args.runs))
+            kept = f"  ({held[label]} tarefas na sessão)" if label in held else ""
+            print(f"{label:14} p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms{kept}")
+        client.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    main()
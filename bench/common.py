@@ -0,0 +1,89 @@
+"""
+Utilitários compartilhados pelos scripts de benchmark.
+
+Por padrão os benchmarks usam um SQLite temporário como stand-in do MySQL
+(via DB_URL_TEMPLATE). Para medir contra o MySQL real, exporte DB_HOSTS e
+as demais variáveis DB_* antes de rodar e passe --mysql.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def setup_env(use_mysql: bool = False) -> None:
+    """Configura o ambiente ANTES de importar app.main."""
+    os.environ.setdefault("JWT_SECRET", "bench-secret")
+    # as cargas medem a API, não o limitador (login em rajada daria 429)
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    if not use_mysql and "DB_URL_TEMPLATE" not in os.environ:
+        tmp = tempfile.mkdtemp(prefix="tuesday-bench-")
+        os.environ["DB_URL_TEMPLATE"] = f"sqlite:///{tmp}/{{host}}.db"
+        os.environ.setdefault("DB_HOSTS", "bench")
+
+
+def percentiles(samples) -> dict:
+    """p50/p95/p99/média em milissegundos a partir de amostras em segundos."""
+    xs = sorted(samples)
+    if not xs:
+        return {"n": 0}
+
+    def pct(p):
+        return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))] * 1000
+
+    return {
+        "n": len(xs),
+        "p50_ms": round(pct(50), 3),
+        "p95_ms": round(pct(95), 3),
+        "p99_ms": round(pct(99), 3),
+        "mean_ms": round(sum(xs) / len(xs) * 1000, 3),
+    }
+
+
+def timed(fn, n: int):
+    """Executa fn() n vezes e devolve a lista de durações (s)."""
+    out = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def register(client, email: str, password: str = "bench-pass") -> dict:
+    """Registra (ou loga, se já existir) e devolve o header Authorization."""
+    r = client.post("/auth/register", json={"name": "Bench", "email": email, "password": password})
+    if r.status_code == 409:
+        r = client.post("/auth/login", json={"email": email, "password": password})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['accessToken']}"}
+
+
+def start_server(port: int, **env) -> subprocess.Popen:
+    """
+    Sobe o app num uvicorn separado (variáveis extras em env) e espera o
+    /health responder. A saída do servidor vai para um arquivo temporário.
+    """
+    import httpx
+
+    log = tempfile.NamedTemporaryFile(prefix=f"uvicorn-{port}-", suffix=".log", delete=False)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR / "app", env=dict(os.environ, **env), stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    proc.kill()
+    raise RuntimeError(f"uvicorn não subiu (log em {log.name})")
@@ -0,0 +1,310 @@
+"""
+Suíte de carga reproduzível da API: semeia N usuários x M tarefas, roda
+cargas mistas contra o app real (uvicorn) com concorrência configurável e
+grava vazão e p50/p95/p99 por operação em JSON. O modo 'compare' confronta
+dois relatórios e sai com código 1 se houver regressão.
+
+    python bench/harness.py run [--users 20] [--tasks 200] [--workloads mixed,list,write,bulk,login]
+                                [--concurrency 32] [--duration 15] [--seed 1] [--async] [--mysql]
+                                [--out bench/results/<data>.json]
+    python bench/harness.py compare base.json novo.json [--tolerance 0.10] [--min-samples 200]
+
+Sem --mysql usa um SQLite temporário (DB_URL_TEMPLATE); com --mysql usa as
+variáveis DB_* do ambiente (ex.: um mysqld local, sem container).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from common import ROOT_DIR, setup_env, percentiles, start_server
+
+# peso de cada operação por carga
+WORKLOADS = {
+    "login": {"login": 1},
+    "list": {"list": 80, "range": 10, "changes": 5, "create": 5},
+    "write": {"create": 50, "update": 30, "delete": 20},
+    "bulk": {"batch": 1},
+    "mixed": {"login": 3, "list": 55, "range": 10, "changes": 5, "create": 15, "update": 7,
+              "delete": 3, "batch": 2},
+}
+BATCH_SIZE = 100
+PASSWORD = "harness-pass"
+
+
+def task_body(rnd: random.Random, i: int) -> dict:
+    start = datetime(2025, 1, 1) + timedelta(minutes=15 * rnd.randrange(365 * 96))
+    return {"title": f"H{i}", "description": "carga",
+            "start_at": start.isoformat(), "end_at": (start + timedelta(hours=1)).isoformat()}
+
+
+class User:
+    def __init__(self, email: str):
+        self.email = email
+        self.headers = {}
+        self.task_ids = []
+        self.cursor = 0
+
+
+async def post_retry(c: httpx.AsyncClient, url: str, attempts: int = 20, **kw) -> httpx.Response:
+    """POST que respeita 503 + Retry-After (pool de hash cheio) durante a semeadura."""
+    for _ in range(attempts - 1):
+        r = await c.post(url, **kw)
+        if r.status_code != 503:
+            return r
+        await asyncio.sleep(float(r.headers.get("Retry-After", "0.5")))
+    return await c.post(url, **kw)
+
+
+async def seed(c: httpx.AsyncClient, n_users: int, n_tasks: int, rnd: random.Random):
+    users = [User(f"harness-{k}@example.com") for k in range(n_users)]
+
+    async def one(u: User):
+        r = await post_retry(c, "/auth/register", json={"name": "Harness", "email": u.email, "password": PASSWORD})
+        if r.status_code == 409:
+            r = await post_retry(c, "/auth/login", json={"email": u.email, "password": PASSWORD})
+        r.raise_for_status()
+        u.headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+        for k in range(0, n_tasks, 5000):
+            ops = [{"op": "create", "task": task_body(rnd, i)} for i in range(k, min(n_tasks, k + 5000))]
+            r = await post_retry(c, "/api/tasks:batch", headers=u.headers, json={"ops": ops})
+            r.raise_for_status()
+            u.task_ids.extend(item["id"] for item in r.json()["results"])
+
+    sem = asyncio.Semaphore(8)
+
+    async def limited(u):
+        async with sem:
+            await one(u)
+    await asyncio.gather(*(limited(u) for u in users))
+    return users
+
+
+async def do_op(c: httpx.AsyncClient, op: str, u: User, rnd: random.Random) -> int:
+    """Executa uma operação e devolve o status HTTP."""
+    if op == "login":
+        r = await c.post("/auth/login", json={"email": u.email, "password": PASSWORD})
+    elif op == "list":
+        r = await c.get("/api/tasks", headers=u.headers, params={"limit": 50})
+    elif op == "range":
+        frm = datetime(2025, 1, 1) + timedelta(days=rnd.randrange(358))
+        r = await c.get("/api/tasks/range", headers=u.headers,
+                        params={"from": frm.isoformat(), "to": (frm + timedelta(days=7)).isoformat()})
+    elif op == "changes":
+        r = await c.get("/api/tasks/changes", headers=u.headers, params={"since": u.cursor})
+        if r.status_code == 200:
+            u.cursor = r.json()["cursor"]
+    elif op == "create":
+        r = await c.post("/api/tasks", headers=u.headers, json=task_body(rnd, len(u.task_ids)))
+        if r.status_code == 201:
+            u.task_ids.append(r.json()["id"])
+    elif op == "update":
+        if not u.task_ids:
+            return await do_op(c, "create", u, rnd)
+        r = await c.put(f"/api/tasks/{rnd.choice(u.task_ids)}", headers=u.headers,
+                        json=dict(task_body(rnd, 0), status="doing"))
+    elif op == "delete":
+        if not u.task_ids:
+            return await do_op(c, "create", u, rnd)
+        task_id = u.task_ids.pop(rnd.randrange(len(u.task_ids)))
+        r = await c.delete(f"/api/tasks/{task_id}", headers=u.headers)
+    elif op == "batch":
+        ops = [{"op": "create", "task": task_body(rnd, i)} for i in range(BATCH_SIZE)]
+        r = await c.post("/api/tasks:batch", headers=u.headers, json={"ops": ops})
+        if r.status_code == 200:
+            u.task_ids.extend(item["id"] for item in r.json()["results"])
+    else:
+        raise ValueError(op)
+    return r.status_code
+
+
+def stage_means(metrics_text: str) -> dict:
+    """{etapa: (soma, contagem)} a partir do /metrics."""
+    out = {}
+    for kind, name, value in re.findall(
+            r'^app_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', metrics_text, re.M):
+        s, n = out.get(name, (0.0, 0.0))
+        out[name] = (s + float(value), n) if kind == "sum" else (s, n + float(value))
+    return out
+
+
+async def run_workload(c: httpx.AsyncClient, name: str, users, concurrency: int,
+                       duration: float, seed_value: int) -> dict:
+    mix = WORKLOADS[name]
+    ops, weights = list(mix), list(mix.values())
+    lat = {op: [] for op in ops}
+    status = {op: {} for op in ops}
+    before = stage_means((await c.get("/metrics")).text)
+    deadline = time.perf_counter() + duration
+
+    async def worker(k: int):
+        rnd = random.Random(seed_value * 1000 + k)
+        while time.perf_counter() < deadline:
+            op = rnd.choices(ops, weights)[0]
+            u = rnd.choice(users)
+            t0 = time.perf_counter()
+            try:
+                code = await do_op(c, op, u, rnd)
+            except httpx.HTTPError:
+                code = 0
+            status[op][code] = status[op].get(code, 0) + 1
+            if 200 <= code < 400:
+                lat[op].append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(k) for k in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    after = stage_means((await c.get("/metrics")).text)
+
+    per_op = {}
+    for op in ops:
+        total = sum(status[op].values())
+        per_op[op] = {"rps": round(len(lat[op]) / elapsed, 1),
+                      "errors": total - len(lat[op]),
+                      "status": {str(k): v for k, v in sorted(status[op].items())},
+                      **percentiles(lat[op])}
+    all_lat = [x for xs in lat.values() for x in xs]
+    stages = {}
+    for name_, (s, n) in after.items():
+        s0, n0 = before.get(name_, (0.0, 0.0))
+        if n > n0:
+            stages[name_] = round((s - s0) / (n - n0) * 1000, 3)
+    return {"elapsed_s": round(elapsed, 2),
+            "total": {"rps": round(len(all_lat) / elapsed, 1),
+                      "errors": sum(v["errors"] for v in per_op.values()), **percentiles(all_lat)},
+            "ops": per_op,
+            "stage_mean_ms": stages}
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def cmd_run(args) -> None:
+    setup_env(args.mysql)
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    for w in workloads:
+        if w not in WORKLOADS:
+            sys.exit(f"carga desconhecida: {w} (opções: {', '.join(WORKLOADS)})")
+    proc = start_server(args.port, DB_ASYNC="1" if args.use_async else "0")
+    base = f"http://127.0.0.1:{args.port}"
+
+    async def main():
+        limits = httpx.Limits(max_connections=args.concurrency + 2)
+        async with httpx.AsyncClient(base_url=base, timeout=60, limits=limits) as c:
+            rnd = random.Random(args.seed)
+            t0 = time.perf_counter()
+            users = await seed(c, args.users, args.tasks, rnd)
+            seed_s = time.perf_counter() - t0
+            results = {}
+            for w in workloads:
+                results[w] = await run_workload(c, w, users, args.concurrency, args.duration, args.seed)
+                print(f"{w:6} {results[w]['total']}", flush=True)
+            return seed_s, results
+
+    try:
+        seed_s, results = asyncio.run(main())
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    report = {
+        "meta": {"git": git_rev(), "at": datetime.now().isoformat(timespec="seconds"),
+                 "db": "mysql" if args.mysql else "sqlite", "async": args.use_async,
+                 "users": args.users, "tasks": args.tasks, "concurrency": args.concurrency,
+                 "duration_s": args.duration, "seed": args.seed, "seed_s": round(seed_s, 2),
+                 "python": platform.python_version(), "cpus": os.cpu_count()},
+        "workloads": results,
+    }
+    out = args.out or str(ROOT_DIR / "bench" / "results" / f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"relatório em {out}")
+
+
+def compare(base: dict, new: dict, tolerance: float, min_samples: int = 200):
+    """
+    Lista de (carga, operação, métrica, antes, depois) que pioraram mais que
+    'tolerance': p95/p99 maiores, rps menor ou erros aparecendo. Operações
+    com menos de 'min_samples' amostras em algum dos lados só contam erros
+    (percentis de poucas amostras são ruído).
+    """
+    regressions = []
+    for w, b in base["workloads"].items():
+        n = new["workloads"].get(w)
+        if n is None:
+            continue
+        rows = [("total", b["total"], n["total"])]
+        rows += [(op, b["ops"][op], n["ops"][op]) for op in b["ops"] if op in n["ops"]]
+        for op, bo, no in rows:
+            if no["errors"] > bo["errors"]:
+                regressions.append((w, op, "errors", bo["errors"], no["errors"]))
+            if min(bo.get("n", 0), no.get("n", 0)) < min_samples:
+                continue
+            for key in ("p95_ms", "p99_ms"):
+                if key in bo and key in no and no[key] > bo[key] * (1 + tolerance):
+                    regressions.append((w, op, key, bo[key], no[key]))
+            if bo.get("rps") and no["rps"] < bo["rps"] * (1 - tolerance):
+                regressions.append((w, op, "rps", bo["rps"], no["rps"]))
+    return regressions
+
+
+def cmd_compare(args) -> None:
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base {base['meta']['git']} ({base['meta']['at']}) x novo {new['meta']['git']} ({new['meta']['at']})")
+    for w in base["workloads"]:
+        if w in new["workloads"]:
+            b, n = base["workloads"][w]["total"], new["workloads"][w]["total"]
+            print(f"{w:6} rps {b['rps']:>8} -> {n['rps']:<8} p95 {b.get('p95_ms')} -> {n.get('p95_ms')} ms")
+    regressions = compare(base, new, args.tolerance, args.min_samples)
+    for w, op, key, before, after in regressions:
+        print(f"REGRESSÃO {w}/{op} {key}: {before} -> {after}")
+    if regressions:
+        sys.exit(1)
+    print(f"sem regressões (tolerância {args.tolerance:.0%})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--users", type=int, default=20)
+    r.add_argument("--tasks", type=int, default=200)
+    r.add_argument("--workloads", default="mixed,list,write,bulk,login")
+    r.add_argument("--concurrency", type=int, default=32)
+    r.add_argument("--duration", type=float, default=15)
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--port", type=int, default=18811)
+    r.add_argument("--async", dest="use_async", action="store_true")
+    r.add_argument("--mysql", action="store_true")
+    r.add_argument("--out")
+    r.set_defaults(fn=cmd_run)
+    c = sub.add_parser("compare")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--tolerance", type=float, default=0.10)
+    c.add_argument("--min-samples", type=int, default=200)
+    c.set_defaults(fn=cmd_compare)
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Teste de carga de GET /api/tasks comparando os dois modos do app:
+DB_ASYNC=0 (handlers sync no threadpool) e DB_ASYNC=1 (async def + AsyncSession).
+Cada modo sobe um uvicorn próprio e recebe --clients clientes concorrentes.
+
+    python bench/loadtest_async.py [--clients 500] [--duration 20] [--tasks 50] [--mysql]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import setup_env, percentiles, start_server
+
+
+async def seed(base: str, n_tasks: int) -> dict:
+    async with httpx.AsyncClient(base_url=base, timeout=30) as c:
+        body = {"name": "Load", "email": "load@example.com", "password": "load-pass"}
+        r = await c.post("/auth/register", json=body)
+        if r.status_code == 409:
+            r = await c.post("/auth/login", json={"email": body["email"], "password": body["password"]})
+        headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+        for i in range(n_tasks):
+            await c.post("/api/tasks", headers=headers, json={
+                "title": f"t{i}", "start_at": "2025-01-01T10:00:00", "end_at": "2025-01-01T11:00:00",
+            })
+        return headers
+
+
+async def run_load(base: str, headers: dict, clients: int, duration: float) -> dict:
+    lat, errors = [], 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base, timeout=30, limits=limits) as c:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    r = await c.get("/api/tasks", headers=headers)
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    lat.append(time.perf_counter() - t0)
+                else:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - t0
+    return {"rps": round(len(lat) / elapsed, 1), "errors": errors, **percentiles(lat)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=500)
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--tasks", type=int, default=50)
+    ap.add_argument("--port", type=int, default=18801)
+    ap.add_argument("--mysql", action="store_true")
+    args = ap.parse_args()
+    setup_env(args.mysql)
+
+    results = {}
+    for label, async_mode in (("sync", False), ("async", True)):
+        proc = start_server(args.port, DB_ASYNC="1" if async_mode else "0")
+        try:
+            base = f"http://127.0.0.1:{args.port}"
+            headers = asyncio.run(seed(base, args.tasks))
+            results[label] = asyncio.run(run_load(base, headers, args.clients, args.duration))
+        finally:
+            proc.terminate()
+            proc.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
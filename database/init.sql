@@ -9,7 +9,12 @@ CREATE TABLE IF NOT EXISTS users (
   email         VARCHAR(255) NOT NULL UNIQUE,
   password_hash VARCHAR(255) NOT NULL,
   name          VARCHAR(100) NOT NULL,
-  created_at    TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+  created_at    TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  token_version INT NOT NULL DEFAULT 0,
+  token_changed_at DATETIME NULL,
+  tasks_version INT NOT NULL DEFAULT 0,
+  max_task_span INT NOT NULL DEFAULT 0,
+  INDEX ix_users_token_changed_at (token_changed_at)
 ) ENGINE=InnoDB
   DEFAULT CHARSET = utf8mb4
   COLLATE = utf8mb4_unicode_ci;
@@ -26,15 +31,165 @@ CREATE TABLE IF NOT EXISTS tasks (
   priority   ENUM('low','medium','high') NOT NULL DEFAULT 'medium',
   created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  version    INT NOT NULL DEFAULT 0,
 
   CONSTRAINT fk_tasks_owner
     FOREIGN KEY (owner_id) REFERENCES users(id)
     ON DELETE CASCADE,
 
   INDEX idx_tasks_owner (owner_id),
+  INDEX idx_tasks_owner_start (owner_id, start_at, id),
+  INDEX idx_tasks_owner_version (owner_id, version),
   INDEX idx_tasks_time (start_at, end_at),
-  INDEX idx_tasks_status (status),
-  INDEX idx_tasks_priority (priority)
+  INDEX idx_tasks_owner_status_end (owner_id, status, end_at),
+  INDEX idx_tasks_status_end (status, end_at, id),
+  FULLTEXT INDEX ftx_tasks_title_description (title, description)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ===== TABLE tasks_archive =====
+-- tarefas 'done' antigas movidas de tasks pelo job de arquivamento (mesmo id)
+CREATE TABLE IF NOT EXISTS tasks_archive (
+  id          INT NOT NULL PRIMARY KEY,
+  owner_id    INT NOT NULL,
+  title       VARCHAR(200) NOT NULL,
+  description TEXT NULL,
+  start_at    DATETIME NOT NULL,
+  end_at      DATETIME NOT NULL,
+  status      ENUM('todo','doing','done') DEFAULT 'done',
+  priority    ENUM('low','medium','high') DEFAULT 'medium',
+  created_at  DATETIME NULL,
+  updated_at  DATETIME NULL,
+  version     INT NOT NULL DEFAULT 0,
+  archived_at DATETIME NOT NULL,
+
+  CONSTRAINT fk_tasks_archive_owner
+    FOREIGN KEY (owner_id) REFERENCES users(id)
+    ON DELETE CASCADE,
+
+  INDEX idx_tasks_archive_owner_start (owner_id, start_at, id)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ===== TABLE task_tombstones =====
+-- tarefas apagadas, para o feed de mudanças (/api/tasks/changes)
+CREATE TABLE IF NOT EXISTS task_tombstones (
+  id         INT AUTO_INCREMENT PRIMARY KEY,
+  owner_id   INT NOT NULL,
+  task_id    INT NOT NULL,
+  version    INT NOT NULL,
+  deleted_at DATETIME NULL,
+
+  CONSTRAINT fk_tombstones_owner
+    FOREIGN KEY (owner_id) REFERENCES users(id)
+    ON DELETE CASCADE,
+
+  INDEX idx_tombstones_owner_version (owner_id, version)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ===== TABLE task_rules =====
+-- tarefas recorrentes: 1ª ocorrência + RRULE; as ocorrências são geradas por janela
+CREATE TABLE IF NOT EXISTS task_rules (
+  id          INT AUTO_INCREMENT PRIMARY KEY,
+  owner_id    INT NOT NULL,
+  title       VARCHAR(200) NOT NULL,
+  description TEXT NULL,
+  start_at    DATETIME NOT NULL,
+  end_at      DATETIME NOT NULL,
+  rrule       VARCHAR(255) NOT NULL,
+  last_end    DATETIME NULL,
+  status      ENUM('todo','doing','done') DEFAULT 'todo',
+  priority    ENUM('low','medium','high') DEFAULT 'medium',
+  created_at  DATETIME NULL,
+
+  CONSTRAINT fk_task_rules_owner
+    FOREIGN KEY (owner_id) REFERENCES users(id)
+    ON DELETE CASCADE,
+
+  INDEX idx_task_rules_owner_start (owner_id, start_at)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ocorrências canceladas ou alteradas, pelo início original
+CREATE TABLE IF NOT EXISTS task_rule_exceptions (
+  rule_id       INT NOT NULL,
+  occurrence_at DATETIME NOT NULL,
+  cancelled     BOOLEAN NOT NULL DEFAULT 0,
+  title         VARCHAR(200) NULL,
+  start_at      DATETIME NULL,
+  end_at        DATETIME NULL,
+  status        ENUM('todo','doing','done') NULL,
+  PRIMARY KEY (rule_id, occurrence_at),
+
+  CONSTRAINT fk_task_rule_exceptions_rule
+    FOREIGN KEY (rule_id) REFERENCES task_rules(id)
+    ON DELETE CASCADE
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ===== Contadores de /api/tasks/stats =====
+-- mantidos pela API na mesma transação das escritas em tasks
+CREATE TABLE IF NOT EXISTS task_counts (
+  owner_id INT NOT NULL,
+  status   VARCHAR(16) NOT NULL,
+  priority VARCHAR(16) NOT NULL,
+  n        INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (owner_id, status, priority),
+
+  CONSTRAINT fk_task_counts_owner
+    FOREIGN KEY (owner_id) REFERENCES users(id)
+    ON DELETE CASCADE
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS task_day_counts (
+  owner_id INT NOT NULL,
+  day      DATE NOT NULL,
+  n        INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (owner_id, day),
+
+  CONSTRAINT fk_task_day_counts_owner
+    FOREIGN KEY (owner_id) REFERENCES users(id)
+    ON DELETE CASCADE
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ===== TABLE revoked_tokens =====
+-- tokens revogados por /auth/logout (pela claim jti) até expirarem
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+  jti        VARCHAR(36) NOT NULL PRIMARY KEY,
+  user_id    INT NOT NULL,
+  expires_at DATETIME NOT NULL,
+
+  CONSTRAINT fk_revoked_tokens_user
+    FOREIGN KEY (user_id) REFERENCES users(id)
+    ON DELETE CASCADE,
+
+  INDEX ix_revoked_tokens_expires_at (expires_at)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_ci;
+
+-- ===== TABLE idempotency_keys =====
+-- respostas de POST /api/tasks e /auth/register por Idempotency-Key, até expirarem
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  scope        VARCHAR(32) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  `key`        VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  request_hash VARCHAR(64) NOT NULL,
+  status_code  INT NOT NULL,
+  response     TEXT NOT NULL,
+  expires_at   DATETIME NOT NULL,
+
+  PRIMARY KEY (scope, `key`),
+  INDEX idx_idempotency_scope_expires (scope, expires_at)
 ) ENGINE=InnoDB
   DEFAULT CHARSET = utf8mb4
   COLLATE = utf8mb4_unicode_ci;
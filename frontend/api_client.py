@@ -0,0 +1,88 @@
+"""
+Cliente HTTP do frontend para a API.
+
+Uma requests.Session com pool de conexões keep-alive, compartilhada por
+todas as sessões e páginas do Streamlit (shared_client, via
+st.cache_resource), em vez de uma conexão TCP nova por chamada. Falhas de
+conexão, timeouts de leitura e 502/503/504 são repetidos com backoff
+exponencial (respeitando Retry-After). POST entra no retry porque as
+criações mandam Idempotency-Key. Chamadas independentes rodam em paralelo
+com gather().
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import streamlit as st
+except ImportError:  # fora do Streamlit (benchmarks)
+    st = None
+
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "6"))
+API_RETRIES = int(os.getenv("API_RETRIES", "2"))
+API_BACKOFF = float(os.getenv("API_BACKOFF", "0.3"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "20"))
+API_PARALLEL = int(os.getenv("API_PARALLEL", "8"))
+
+
+class ApiClient:
+    def __init__(self, base_url: str, timeout: float = API_TIMEOUT, retries: int = API_RETRIES,
+                 backoff: float = API_BACKOFF, pool_size: int = API_POOL_SIZE, parallel: int = API_PARALLEL):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "POST"}),
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="api")
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        t0 = time.perf_counter()
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        finally:
+            log = getattr(self._local, "log", None)
+            if log is not None:
+                log.append((method, path, time.perf_counter() - t0))
+
+    def gather(self, *calls):
+        """Roda as funções (sem argumentos) em paralelo e devolve os resultados na ordem."""
+        if len(calls) <= 1:
+            return [c() for c in calls]
+        log = getattr(self._local, "log", None)
+
+        def run(call):
+            self._local.log = log  # as threads do pool registram na interação de quem chamou
+            try:
+                return call()
+            finally:
+                self._local.log = None
+
+        return [f.result() for f in [self._pool.submit(run, c) for c in calls]]
+
+    def start_interaction(self) -> list:
+        """Passa a registrar (método, path, segundos) das chamadas desta thread; devolve a lista."""
+        self._local.log = []
+        return self._local.log
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+
+def _new_client(base_url: str) -> ApiClient:
+    return ApiClient(base_url)
+
+
+# um cliente por processo do Streamlit, o mesmo para app.py e pages/
+shared_client = st.cache_resource(_new_client) if st is not None else _new_client
@@ -1,9 +1,13 @@
 import os
 import json
-import requests
+import time
+import uuid
 import streamlit as st
 from datetime import datetime, timedelta, time as dtime
 
+from api_client import shared_client
+from task_cache import PRIORITY_LABELS, TaskPager, tasks_frame
+
 # --------- .env ----------
 def load_env():
     path = "/srv/frontend/.env"
@@ -17,6 +21,11 @@ def load_env():
 load_env()
 
 API_URL = os.getenv("API_URL", "http://192.168.90.20:8001").rstrip("/")
+# segundos em que a página de tarefas é reaproveitada sem consultar a API
+TASKS_CACHE_TTL = float(os.getenv("TASKS_CACHE_TTL", "30"))
+TASKS_PAGE_SIZES = (25, 50, 100, 200)
+TASKS_ORDERS = {"Início (mais antigas)": "asc", "Início (mais recentes)": "desc"}
+STATUS_LABELS = {"todo": "A fazer", "doing": "Fazendo", "done": "Concluídas"}
 
 st.set_page_config(page_title="Tuesday.com", layout="wide")
 
@@ -29,7 +38,7 @@ if "user_email" not in st.session_state:
 if "show_account_menu" not in st.session_state:
     st.session_state.show_account_menu = False
 if "tasks_cache" not in st.session_state:
-    st.session_state.tasks_cache = []
+    st.session_state.tasks_cache = TaskPager(TASKS_CACHE_TTL)
 
 def safe_rerun():
     try:
@@ -44,13 +53,51 @@ def goto(route: str):
     st.session_state.route = route
     safe_rerun()
 
+def client_ip():
+    # IP de quem está no navegador (Streamlit >= 1.45); a API usa no rate limit
+    # por IP, já que para ela todo request vem desta VM
+    return getattr(getattr(st, "context", None), "ip_address", None)
+
 def auth_headers():
-    return {"Authorization": f"Bearer {st.session_state.token}"} if st.session_state.token else {}
+    headers = {"Authorization": f"Bearer {st.session_state.token}"} if st.session_state.token else {}
+    ip = client_ip()
+    if ip:
+        headers["X-Client-IP"] = ip
+    return headers
 
 def api(method, path, **kwargs):
     headers = kwargs.pop("headers", {})
     headers.update(auth_headers())
-    return requests.request(method, f"{API_URL}{path}", headers=headers, timeout=6, **kwargs)
+    return shared_client(API_URL).request(method, path, headers=headers, **kwargs)
+
+def api_many(*calls):
+    # chamadas independentes (método, path[, kwargs]) em paralelo; o token é lido
+    # aqui porque as threads do pool não enxergam o session_state
+    headers = auth_headers()
+    client = shared_client(API_URL)
+
+    def call(method, path, kwargs=None):
+        kwargs = dict(kwargs or {})
+        kwargs["headers"] = {**kwargs.get("headers", {}), **headers}
+        return lambda: client.request(method, path, **kwargs)
+    return client.gather(*(call(*c) for c in calls))
+
+def response_json(r, default):
+    try:
+        return r.json()
+    except Exception:
+        return json.loads(r.text or default)
+
+def idempotency_key(kind: str, payload: dict) -> dict:
+    # mesma chave enquanto o formulário for reenviado igual (retry depois de timeout)
+    body = json.dumps(payload, sort_keys=True)
+    pending = st.session_state.setdefault("idem_keys", {})
+    if pending.get(kind, (None,))[0] != body:
+        pending[kind] = (body, uuid.uuid4().hex)
+    return {"Idempotency-Key": pending[kind][1]}
+
+def idempotency_done(kind: str):
+    st.session_state.setdefault("idem_keys", {}).pop(kind, None)
 
 def iso(dt: datetime) -> str:
     return dt.replace(microsecond=0).isoformat(timespec="seconds")
@@ -58,7 +105,8 @@ def iso(dt: datetime) -> str:
 def do_logout():
     st.session_state.token = None
     st.session_state.user_email = None
-    st.session_state.tasks_cache = []
+    st.session_state.tasks_cache = TaskPager(TASKS_CACHE_TTL)
+    st.session_state.pop("tasks_df", None)
     st.session_state.show_account_menu = False
     goto("home")
 
@@ -88,6 +136,28 @@ def topbar(show_nav: bool):
                         if st.button("Sair da conta", key="btn_logout"):
                             do_logout()
 
+def sync_tasks(pager: TaskPager):
+    # só a página visível; depois do TTL a mesma página vai com If-None-Match
+    if pager.fresh():
+        return
+    r, rs = api_many(("GET", "/api/tasks", {"params": pager.params(), "headers": pager.if_none_match()}),
+                     ("GET", "/api/tasks/stats"))
+    stats = response_json(rs, "{}") if rs.ok else None
+    if r.status_code == 304:
+        pager.not_modified(stats)
+    elif r.ok:
+        pager.store(response_json(r, "[]"), r.headers.get("X-Next-Cursor"), r.headers.get("ETag"), stats)
+    else:
+        st.error(f"Erro: {r.status_code} {r.text}")
+
+def tasks_table(pager: TaskPager):
+    # DataFrame refeito só quando as linhas da página mudam
+    key = (id(pager), pager.version)
+    memo = st.session_state.get("tasks_df")
+    if memo is None or memo[0] != key:
+        memo = st.session_state.tasks_df = (key, tasks_frame(pager.rows))
+    return memo[1]
+
 def page_home():
     topbar(show_nav=False)
 
@@ -114,9 +184,11 @@ def page_auth():
                 st.error("Preencha nome, e-mail e senha.")
             else:
                 try:
-                    r = api("POST", "/auth/register",
-                            json={"name": r_name, "email": r_email, "password": r_pass})
+                    body = {"name": r_name, "email": r_email, "password": r_pass}
+                    r = api("POST", "/auth/register", json=body,
+                            headers=idempotency_key("register", body))
                     if r.ok:
+                        idempotency_done("register")
                         try:
                             data = r.json()
                         except Exception:
@@ -219,49 +291,68 @@ def page_tasks():
                     "priority": pr_value,
                 }
                 try:
-                    r = api("POST", "/api/tasks", json=payload)
+                    r = api("POST", "/api/tasks", json=payload,
+                            headers=idempotency_key("create_task", payload))
                     if r.status_code in (200, 201):
+                        idempotency_done("create_task")
                         st.success("Tarefa criada!")
-                        st.session_state.tasks_cache = []
+                        # entra na página carregada se couber nela; senão a página fica como está
+                        st.session_state.tasks_cache.add({**payload, "id": r.json()["id"]})
                         safe_rerun()
                     else:
                         st.error(f"Erro: {r.status_code} {r.text}")
                 except Exception as e:
                     st.error(f"Falha: {e}")
 
-    if not st.session_state.tasks_cache:
-        r = api("GET", "/api/tasks")
-        if r.ok:
-            try:
-                st.session_state.tasks_cache = r.json()
-            except Exception:
-                st.session_state.tasks_cache = json.loads(r.text or "[]")
-        else:
-            st.error(f"Erro: {r.status_code} {r.text}")
-
-    tasks = st.session_state.tasks_cache or []
-    if not tasks:
+    pager = st.session_state.tasks_cache
+    f = st.columns([2, 2, 2, 1])
+    order = f[0].selectbox("Ordenar por", list(TASKS_ORDERS), key="tasks_order")
+    status = f[1].multiselect("Status", list(STATUS_LABELS), format_func=STATUS_LABELS.get, key="tasks_status")
+    priority = f[2].multiselect("Prioridade", list(PRIORITY_LABELS), format_func=PRIORITY_LABELS.get,
+                                key="tasks_priority")
+    size = f[3].selectbox("Por página", TASKS_PAGE_SIZES, index=1, key="tasks_page_size")
+    archived = st.checkbox("Incluir arquivadas", key="tasks_include_archived",
+                           help="Tarefas concluídas antigas movidas para o arquivo")
+    pager.set_query(size, TASKS_ORDERS[order], status, priority, archived)
+    sync_tasks(pager)
+
+    stats = pager.stats
+    if stats:
+        by_status = stats.get("by_status", {})
+        m = st.columns(5)
+        m[0].metric("Total", stats.get("total", 0))
+        m[1].metric("A fazer", by_status.get("todo", 0))
+        m[2].metric("Fazendo", by_status.get("doing", 0))
+        m[3].metric("Concluídas", by_status.get("done", 0))
+        m[4].metric("Atrasadas", stats.get("overdue", 0))
+
+    if not pager.rows:
         st.write("(Sem tarefas)")
     else:
-        pt_map = {"low": "baixa", "medium": "média", "high": "alta"}
-        rows = []
-        for t in tasks:
-            rows.append({
-                "Título": t.get("title", ""),
-                "Início": t.get("start_at", ""),
-                "Fim": t.get("end_at", ""),
-                "Status": t.get("status", "todo"),
-                "Prioridade": pt_map.get(t.get("priority", "medium"), t.get("priority", "")),
-                "Descrição": t.get("description", "") or "",
-            })
-        st.dataframe(rows, use_container_width=True)
+        st.dataframe(tasks_table(pager), use_container_width=True, hide_index=True)
+
+    c = st.columns([1, 1, 1, 2])
+    if c[0].button("« Primeira", key="btn_first_page", disabled=pager.page == 1):
+        pager.first_page()
+        safe_rerun()
+    if c[1].button("‹ Anterior", key="btn_prev_page", disabled=pager.page == 1):
+        pager.prev_page()
+        safe_rerun()
+    if c[2].button("Próxima ›", key="btn_next_page", disabled=not pager.next_cursor):
+        pager.next_page()
+        safe_rerun()
+    c[3].caption(f"Página {pager.page} · {len(pager.rows)} tarefas")
 
     st.markdown("---")
     c = st.columns(2)
     if c[0].button("Atualizar lista", key="btn_refresh_tasks"):
-        st.session_state.tasks_cache = []
+        pager.stale()  # consulta agora, sem esperar o TTL
         safe_rerun()
 
+# latência por interação: tempo do rerun e das chamadas à API feitas nele
+net_log = shared_client(API_URL).start_interaction()
+t_run = time.perf_counter()
+
 route = st.session_state.route
 if route == "home":
     page_home()
@@ -269,3 +360,7 @@ elif route == "auth":
     page_auth()
 else:
     page_tasks()
+
+if net_log:
+    st.caption(f"{len(net_log)} chamada(s) à API, {sum(d for _, _, d in net_log) * 1000:.0f} ms somados; "
+               f"página em {(time.perf_counter() - t_run) * 1000:.0f} ms")
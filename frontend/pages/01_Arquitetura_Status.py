@@ -1,4 +1,6 @@
-import os, json, requests, streamlit as st
+import os, json, streamlit as st
+
+from api_client import shared_client
 
 # Lê .env do frontend
 def load_env():
@@ -33,7 +35,10 @@ with col1:
 with col2:
     st.subheader("Status ao vivo")
     try:
-        r = requests.get(f"{API_URL}/health", timeout=3)
+        client = shared_client(API_URL)
+        # health e readiness em paralelo, na sessão HTTP compartilhada com app.py
+        r, rr = client.gather(lambda: client.request("GET", "/health", timeout=3),
+                              lambda: client.request("GET", "/ready", timeout=3))
         try:
             h = r.json()
         except Exception:
@@ -44,7 +49,13 @@ with col2:
             st.success("API: OK")
         else:
             st.warning(f"API: {status or 'indefinido'}")
+        if rr.status_code == 200:
+            st.success("Worker pronto (/ready)")
+        else:
+            st.warning(f"Worker não pronto (/ready {rr.status_code})")
         st.info(f"Database conectado: **{db_host}**")
+        st.caption(f"/health em {r.elapsed.total_seconds() * 1000:.0f} ms, /ready em "
+                   f"{rr.elapsed.total_seconds() * 1000:.0f} ms")
     except Exception as e:
         st.error(f"API offline? {e}")
 
@@ -0,0 +1,144 @@
+"""
+Página visível da lista de tarefas no frontend (guardada no session_state).
+
+A tabela não carrega a lista inteira: cada sessão guarda só a página que
+está na tela, buscada em /api/tasks com limite, ordem e filtros de
+status/prioridade aplicados no servidor. Para voltar páginas o pager guarda
+a pilha dos cursores keyset já visitados (strings curtas), não as linhas.
+Dentro do TTL um rerun não chama a API; vencido o TTL, a mesma página é
+pedida com If-None-Match e um 304 só renova o prazo. 'version' muda quando
+as linhas mudam e é a chave da memoização da tabela (tasks_frame). Uma
+tarefa criada nesta sessão entra direto na página (add) quando cai nos
+filtros e entre a primeira e a última linha dela; fora disso a página fica
+como está, sem nova consulta.
+"""
+import time
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+
+COLUMNS = ("id", "title", "start_at", "end_at", "status", "priority", "description")
+PRIORITY_LABELS = {"low": "baixa", "medium": "média", "high": "alta"}
+
+
+class TaskPager:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.query = None      # (limit, order, status, priority, arquivadas) da listagem atual
+        self.cursors = [None]  # cursor de cada página até a atual (None = 1ª)
+        self.rows = []         # tarefas da página atual (dicts como vêm da API)
+        self.next_cursor = None
+        self.etag = None       # (params, ETag) da última resposta 200
+        self.stats = None      # corpo de /api/tasks/stats
+        self.fetched_at = 0.0
+        self.version = 0
+
+    def set_query(self, limit: int, order: str, status=(), priority=(), include_archived: bool = False) -> None:
+        """Troca de tamanho/ordem/filtro volta para a 1ª página."""
+        query = (limit, order, tuple(sorted(status)), tuple(sorted(priority)), include_archived)
+        if query != self.query:
+            self.query, self.cursors, self.next_cursor = query, [None], None
+            self.stale()
+
+    @property
+    def page(self) -> int:
+        return len(self.cursors)
+
+    def params(self) -> dict:
+        limit, order, status, priority, include_archived = self.query
+        params = {"limit": limit, "order": order, "status": list(status), "priority": list(priority)}
+        if include_archived:
+            params["include_archived"] = "true"
+        if self.cursors[-1]:
+            params["cursor"] = self.cursors[-1]
+        return params
+
+    def if_none_match(self) -> dict:
+        """Header condicional se a última resposta foi desta mesma página."""
+        if self.etag and self.etag[0] == self.params():
+            return {"If-None-Match": self.etag[1]}
+        return {}
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) - self.fetched_at < self.ttl
+
+    def store(self, rows, next_cursor: Optional[str], etag: Optional[str], stats=None) -> None:
+        self.rows, self.next_cursor = rows, next_cursor
+        self.etag = (self.params(), etag) if etag else None
+        self.stats = stats if stats is not None else self.stats
+        self.fetched_at = time.monotonic()
+        self.version += 1
+
+    def add(self, task: dict) -> bool:
+        """
+        Encaixa uma tarefa recém-criada na página atual, na posição da ordem
+        (start_at, id). Só entra se passar nos filtros e cair dentro da faixa
+        da página: depois do início (qualquer ponto na 1ª página) e antes da
+        última linha (qualquer ponto na última página). A página não é
+        cortada em 'limit': next_cursor aponta depois da última linha, então
+        descartá-la a tiraria da navegação; o próximo fetch acerta o tamanho.
+        """
+        if self.stats:  # contadores são da conta toda, não só da página
+            by_status = self.stats.get("by_status", {})
+            self.stats = {**self.stats, "total": self.stats.get("total", 0) + 1,
+                          "by_status": {**by_status, task["status"]: by_status.get(task["status"], 0) + 1}}
+        if self.query is None:
+            return False
+        _, order, status, priority, _ = self.query
+        if (status and task.get("status") not in status) or (priority and task.get("priority") not in priority):
+            return False
+        desc = order == "desc"
+
+        def key(t):
+            return datetime.fromisoformat(str(t["start_at"])), t["id"]
+
+        def before(a, b):
+            return a > b if desc else a < b
+
+        k = key(task)
+        keys = [key(t) for t in self.rows]
+        if len(self.cursors) > 1 and (not keys or before(k, keys[0])):
+            return False
+        if self.next_cursor and (not keys or not before(k, keys[-1])):
+            return False
+        pos = next((i for i, other in enumerate(keys) if before(k, other)), len(keys))
+        self.rows = self.rows[:pos] + [task] + self.rows[pos:]
+        self.version += 1
+        return True
+
+    def not_modified(self, stats=None) -> None:
+        self.stats = stats if stats is not None else self.stats
+        self.fetched_at = time.monotonic()
+
+    def next_page(self) -> None:
+        if self.next_cursor:
+            self.cursors.append(self.next_cursor)
+            self.stale()
+
+    def prev_page(self) -> None:
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+            self.stale()
+
+    def first_page(self) -> None:
+        if len(self.cursors) > 1:
+            self.cursors = [None]
+            self.stale()
+
+    def stale(self) -> None:
+        """Próximo rerun consulta a API (condicional se a página for a mesma)."""
+        self.fetched_at = 0.0
+
+
+def tasks_frame(tasks) -> pd.DataFrame:
+    """Tabela de tarefas montada por colunas, na ordem em que vieram da API."""
+    df = pd.DataFrame.from_records(list(tasks), columns=list(COLUMNS))
+    return pd.DataFrame({
+        "Título": df["title"],
+        "Início": pd.to_datetime(df["start_at"]),
+        "Fim": pd.to_datetime(df["end_at"]),
+        "Status": df["status"].fillna("todo"),
+        "Prioridade": df["priority"].map(PRIORITY_LABELS).fillna(df["priority"]),
+        "Descrição": df["description"].fillna(""),
+    })
@@ -36,8 +36,20 @@ def db_engine():
 def client(db_engine):
     # Limpa tabelas antes de cada teste de integração
     with db_engine.begin() as conn:
+        conn.execute(text("DELETE FROM task_tombstones"))
+        conn.execute(text("DELETE FROM tasks_archive"))
+        conn.execute(text("DELETE FROM task_rule_exceptions"))
+        conn.execute(text("DELETE FROM task_rules"))
+        conn.execute(text("DELETE FROM revoked_tokens"))
+        conn.execute(text("DELETE FROM idempotency_keys"))
+        conn.execute(text("DELETE FROM task_counts"))
+        conn.execute(text("DELETE FROM task_day_counts"))
         conn.execute(text("DELETE FROM tasks"))
         conn.execute(text("DELETE FROM users"))
+    app.USER_CACHE.clear()
+    app.TOKEN_CACHE.clear()
+    app.RATE_BUCKETS.clear()
+    app.SEARCH_INDEX.clear()
     return TestClient(app.app)
 
 # faz o teste da health garantindo que consegue se comunicar com o banco
@@ -117,3 +129,580 @@ def test_funcionalidades_app(client):
     assert confere_tarefa_deletada.status_code == 200
     tasks2 = confere_tarefa_deletada.json()
     assert all(t["id"] != task_id for t in tasks2)
+
+# cria algumas tarefas e percorre a lista página a página usando o cursor,
+# nas duas ordens, conferindo o filtro de status feito no servidor
+@pytest.mark.integration
+def test_lista_paginada_e_filtros(client):
+    cria_user = client.post(
+        "/auth/register",
+        json={"name": "User Pag", "email": "pag_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {cria_user.json()['accessToken']}"}
+
+    ids = []
+    for i, status in enumerate(["todo", "doing", "todo"]):
+        r = client.post("/api/tasks", headers=headers, json={
+            "title": f"Tarefa {i}",
+            "start_at": f"2025-01-0{i + 1}T10:00:00",
+            "end_at": f"2025-01-0{i + 1}T11:00:00",
+            "status": status,
+        })
+        ids.append(r.json()["id"])
+
+    p1 = client.get("/api/tasks", params={"limit": 2}, headers=headers)
+    assert p1.status_code == 200
+    assert [t["id"] for t in p1.json()] == ids[:2]
+    cursor = p1.headers["X-Next-Cursor"]
+
+    p2 = client.get("/api/tasks", params={"limit": 2, "cursor": cursor}, headers=headers)
+    assert [t["id"] for t in p2.json()] == ids[2:]
+    assert "X-Next-Cursor" not in p2.headers
+
+    so_todo = client.get("/api/tasks", params={"status": "todo"}, headers=headers)
+    assert [t["id"] for t in so_todo.json()] == [ids[0], ids[2]]
+
+    assert client.get("/api/tasks", params={"status": "xpto"}, headers=headers).status_code == 400
+
+    d1 = client.get("/api/tasks", params={"limit": 2, "order": "desc"}, headers=headers)
+    assert [t["id"] for t in d1.json()] == ids[:0:-1]
+    d2 = client.get("/api/tasks", params={"limit": 2, "order": "desc",
+                                          "cursor": d1.headers["X-Next-Cursor"]}, headers=headers)
+    assert [t["id"] for t in d2.json()] == ids[:1]
+    assert d1.headers["ETag"] != p1.headers["ETag"]
+    assert client.get("/api/tasks", params={"order": "xpto"}, headers=headers).status_code == 400
+
+# trocar a senha precisa invalidar o token antigo (token_version) mesmo com
+# a identidade do usuário já em cache, e o token novo tem que funcionar
+@pytest.mark.integration
+def test_troca_de_senha_revoga_token_antigo(client):
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Senha", "email": "senha_user@example.com", "password": "senha123"},
+    )
+    antigo = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    assert client.get("/api/tasks", headers=antigo).status_code == 200
+    assert client.get("/api/tasks", headers=antigo).status_code == 200
+    assert app.USER_CACHE.hits >= 1
+
+    troca = client.put("/auth/password", headers=antigo,
+                       json={"current_password": "senha123", "new_password": "nova456"})
+    assert troca.status_code == 200
+    novo = {"Authorization": f"Bearer {troca.json()['accessToken']}"}
+
+    assert client.get("/api/tasks", headers=antigo).status_code == 401
+    assert client.get("/api/tasks", headers=novo).status_code == 200
+    assert client.post("/auth/login", json={"email": "senha_user@example.com",
+                                            "password": "nova456"}).status_code == 200
+
+# troca de senha feita por outro worker: o cache local só descobre no refresh
+# da revogação, que tira o usuário do USER_CACHE pelo token_changed_at
+@pytest.mark.integration
+def test_troca_de_senha_em_outro_worker(client, db_engine):
+    from datetime import datetime
+
+    r = client.post("/auth/register", json={"name": "User Worker", "email": "worker_user@example.com",
+                                            "password": "senha123"})
+    antigo = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    assert client.get("/api/tasks", headers=antigo).status_code == 200
+
+    # UPDATE direto no banco: nenhum evento do ORM roda neste processo
+    with db_engine.begin() as conn:
+        conn.execute(text("UPDATE users SET token_version = token_version + 1, token_changed_at = :now "
+                          "WHERE email = 'worker_user@example.com'"), {"now": datetime.utcnow()})
+    assert client.get("/api/tasks", headers=antigo).status_code == 200  # identidade ainda em cache
+
+    with db_engine.connect() as conn:
+        app.REVOKED.refresh(conn)
+    assert client.get("/api/tasks", headers=antigo).status_code == 401
+
+# lote misto numa chamada só: cria, atualiza e apaga; item com id de outra
+# pessoa/inexistente volta 404 sem impedir o resto; item inválido cancela o lote
+@pytest.mark.integration
+def test_lote_de_tarefas(client):
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Lote", "email": "lote_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    base = {"start_at": "2025-02-01T09:00:00", "end_at": "2025-02-01T10:00:00"}
+
+    existente = client.post("/api/tasks", headers=headers, json={"title": "Velha", **base}).json()["id"]
+    apagar = client.post("/api/tasks", headers=headers, json={"title": "Apagar", **base}).json()["id"]
+
+    lote = client.post("/api/tasks:batch", headers=headers, json={"ops": [
+        {"op": "create", "task": {"title": "Nova 1", **base}},
+        {"op": "create", "task": {"title": "Nova 2", **base, "priority": "high"}},
+        {"op": "update", "id": existente, "task": {"title": "Velha editada", **base}},
+        {"op": "delete", "id": apagar},
+        {"op": "delete", "id": 999999},
+    ]})
+    assert lote.status_code == 200
+    body = lote.json()
+    assert body["applied"] is True
+    assert [item["status"] for item in body["results"]] == [201, 201, 200, 204, 404]
+
+    titulos = {t["id"]: t["title"] for t in client.get("/api/tasks", headers=headers).json()}
+    novos = [item["id"] for item in body["results"][:2]]
+    assert titulos == {existente: "Velha editada", novos[0]: "Nova 1", novos[1]: "Nova 2"}
+
+    invalido = client.post("/api/tasks:batch", headers=headers, json={"ops": [
+        {"op": "create", "task": {"title": "Nao entra", **base}},
+        {"op": "create", "task": {"title": "Sem datas"}},
+    ]})
+    assert invalido.status_code == 422
+    assert invalido.json()["applied"] is False
+    assert len(client.get("/api/tasks", headers=headers).json()) == 3
+
+    # janela invertida num update cancela o lote; no PUT dá 400
+    invertida = client.post("/api/tasks:batch", headers=headers, json={"ops": [
+        {"op": "create", "task": {"title": "Nao entra", **base}},
+        {"op": "update", "id": existente, "task": {"title": "Invertida", "start_at": base["end_at"],
+                                                    "end_at": base["start_at"]}},
+    ]})
+    assert invertida.status_code == 422
+    assert invertida.json()["applied"] is False
+    assert invertida.json()["results"][1]["error"] == "end_at must be after start_at"
+    assert titulos == {t["id"]: t["title"] for t in client.get("/api/tasks", headers=headers).json()}
+    put = client.put(f"/api/tasks/{existente}", headers=headers,
+                     json={"title": "Invertida", "start_at": base["end_at"], "end_at": base["start_at"]})
+    assert put.status_code == 400
+    assert put.json()["detail"] == "end_at must be after start_at"
+
+# exportação em streaming nos dois formatos, com e sem gzip
+@pytest.mark.integration
+def test_exporta_tarefas_ndjson_e_csv(client):
+    import csv
+    import io
+    import json
+
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Export", "email": "export_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    for i in range(3):
+        client.post("/api/tasks", headers=headers, json={
+            "title": f"Exportar {i}", "description": "linha, com vírgula",
+            "start_at": f"2025-04-0{i + 1}T08:00:00", "end_at": f"2025-04-0{i + 1}T09:00:00",
+        })
+
+    nd = client.get("/api/tasks/export", params={"format": "ndjson"},
+                    headers={**headers, "Accept-Encoding": "identity"})
+    assert nd.status_code == 200
+    assert "content-encoding" not in nd.headers
+    linhas = [json.loads(l) for l in nd.text.splitlines()]
+    assert [l["title"] for l in linhas] == ["Exportar 0", "Exportar 1", "Exportar 2"]
+    assert linhas[0]["start_at"] == "2025-04-01T08:00:00"
+
+    # o TestClient descomprime sozinho; o header mostra que veio em gzip
+    cs = client.get("/api/tasks/export", params={"format": "csv"},
+                    headers={**headers, "Accept-Encoding": "gzip"})
+    assert cs.headers["content-encoding"] == "gzip"
+    tabela = list(csv.DictReader(io.StringIO(cs.text)))
+    assert len(tabela) == 3
+    assert tabela[2]["description"] == "linha, com vírgula"
+
+    assert client.get("/api/tasks/export", params={"format": "xml"}, headers=headers).status_code == 400
+
+
+# ETag/304 na listagem e feed de mudanças com tarefas apagadas
+@pytest.mark.integration
+def test_etag_e_feed_de_mudancas(client):
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Sync", "email": "sync_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    ids = []
+    for i in range(2):
+        r = client.post("/api/tasks", headers=headers, json={
+            "title": f"Sync {i}", "start_at": f"2025-05-0{i + 1}T08:00:00",
+            "end_at": f"2025-05-0{i + 1}T09:00:00",
+        })
+        ids.append(r.json()["id"])
+
+    r1 = client.get("/api/tasks", headers=headers)
+    etag, cursor = r1.headers["etag"], int(r1.headers["x-changes-cursor"])
+    r2 = client.get("/api/tasks", headers={**headers, "If-None-Match": etag})
+    assert r2.status_code == 304
+    assert r2.headers["etag"] == etag
+
+    # outra query string, outro ETag
+    assert client.get("/api/tasks", headers=headers, params={"limit": 1}).headers["etag"] != etag
+
+    client.put(f"/api/tasks/{ids[0]}", headers=headers, json={
+        "title": "Sync alterada", "start_at": "2025-05-01T08:00:00", "end_at": "2025-05-01T10:00:00",
+    })
+    client.delete(f"/api/tasks/{ids[1]}", headers=headers)
+    assert client.get("/api/tasks", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+    ch = client.get("/api/tasks/changes", headers=headers, params={"since": cursor}).json()
+    assert [t["title"] for t in ch["changes"]] == ["Sync alterada"]
+    assert ch["deleted"] == [ids[1]]
+    assert ch["cursor"] == cursor + 2
+
+    vazio = client.get("/api/tasks/changes", headers=headers, params={"since": ch["cursor"]}).json()
+    assert vazio == {"cursor": ch["cursor"], "changes": [], "deleted": []}
+
+
+# janela de calendário pega tarefas longas que começam antes de 'from'
+@pytest.mark.integration
+def test_janela_e_conflitos(client):
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Agenda", "email": "agenda_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    for title, start, end in [
+        ("Viagem", "2025-05-28T00:00:00", "2025-06-04T00:00:00"),
+        ("Reunião", "2025-06-02T09:00:00", "2025-06-02T10:00:00"),
+        ("Almoço", "2025-06-02T12:00:00", "2025-06-02T13:00:00"),
+        ("Depois", "2025-06-10T09:00:00", "2025-06-10T10:00:00"),
+    ]:
+        client.post("/api/tasks", headers=headers, json={"title": title, "start_at": start, "end_at": end})
+
+    janela = {"from": "2025-06-02T00:00:00", "to": "2025-06-09T00:00:00"}
+    r = client.get("/api/tasks/range", headers=headers, params=janela)
+    assert r.status_code == 200
+    assert [t["title"] for t in r.json()] == ["Viagem", "Reunião", "Almoço"]
+
+    c = client.get("/api/tasks/conflicts", headers=headers, params=janela).json()
+    assert len(c["conflicts"]) == 2
+    assert c["busy"] == [{"start": "2025-06-02T00:00:00", "end": "2025-06-04T00:00:00"}]
+    assert c["free"] == [{"start": "2025-06-04T00:00:00", "end": "2025-06-09T00:00:00"}]
+
+    invertida = {"from": janela["to"], "to": janela["from"]}
+    assert client.get("/api/tasks/range", headers=headers, params=invertida).status_code == 400
+
+    # janela no começo do calendário: o recuo pela maior duração para em datetime.min
+    inicio = {"from": "0001-01-01T00:00:00", "to": "0001-06-01T00:00:00"}
+    for rota in ("/api/tasks/range", "/api/tasks/conflicts"):
+        r = client.get(rota, headers=headers, params=inicio)
+        assert r.status_code == 200
+    assert client.get("/api/tasks/range", headers=headers, params=inicio).json() == []
+
+
+# /metrics expõe latência por template de rota e por etapa
+@pytest.mark.integration
+def test_metrics_por_rota_e_etapa(client):
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Metrics", "email": "metrics_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    client.get("/api/tasks", headers=headers)
+    client.delete("/api/tasks/999999", headers=headers)
+
+    m = client.get("/metrics")
+    assert m.status_code == 200
+    assert m.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/tasks",status="200"}' in m.text
+    assert 'route="/api/tasks/{task_id}",status="404"' in m.text
+    for etapa in ("jwt", "user_lookup", "ensure_schema", "query", "serialize", "password_hash"):
+        assert f'app_stage_duration_seconds_count{{stage="{etapa}"}}' in m.text
+    assert "db_pool_checked_out{" in m.text
+
+
+# contadores pré-agregados acompanham create/update/delete e lote
+@pytest.mark.integration
+def test_estatisticas_de_tarefas(client):
+    r = client.post(
+        "/auth/register",
+        json={"name": "User Stats", "email": "stats_user@example.com", "password": "senha123"},
+    )
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    ids = []
+    for i, (status, priority) in enumerate([("todo", "high"), ("doing", "low"), ("done", "low")]):
+        r = client.post("/api/tasks", headers=headers, json={
+            "title": f"Stats {i}", "status": status, "priority": priority,
+            "start_at": "2020-01-01T08:00:00", "end_at": "2020-01-01T09:00:00",
+        })
+        ids.append(r.json()["id"])
+
+    client.put(f"/api/tasks/{ids[0]}", headers=headers, json={
+        "title": "Stats 0", "status": "done", "priority": "high",
+        "start_at": "2020-01-02T08:00:00", "end_at": "2020-01-02T09:00:00",
+    })
+    client.delete(f"/api/tasks/{ids[1]}", headers=headers)
+    client.post("/api/tasks:batch", headers=headers, json={"ops": [
+        {"op": "create", "task": {"title": "Lote", "start_at": "2020-01-02T10:00:00",
+                                  "end_at": "2020-01-02T11:00:00"}},
+        {"op": "update", "id": ids[2], "task": {"title": "Stats 2", "status": "todo",
+                                                "start_at": "2020-01-01T08:00:00",
+                                                "end_at": "2020-01-01T09:00:00"}},
+    ]})
+
+    # status/prioridade fora da lista não chegam aos contadores
+    janela = {"start_at": "2020-01-01T08:00:00", "end_at": "2020-01-01T09:00:00"}
+    assert client.post("/api/tasks", headers=headers,
+                       json={"title": "X", "status": "nope", **janela}).status_code == 400
+    assert client.put(f"/api/tasks/{ids[2]}", headers=headers,
+                      json={"title": "X", "status": "bogus", **janela}).status_code == 400
+    assert client.put(f"/api/tasks/{ids[2]}", headers=headers,
+                      json={"title": "X", "priority": "urgent", **janela}).status_code == 400
+
+    st = client.get("/api/tasks/stats", headers=headers,
+                    params={"from": "2020-01-01", "to": "2020-01-04"}).json()
+    assert st["total"] == 3
+    assert st["by_status"] == {"todo": 2, "doing": 0, "done": 1}
+    assert st["by_priority"] == {"low": 1, "medium": 1, "high": 1}
+    assert st["overdue"] == 2
+    assert st["per_day"] == [{"day": "2020-01-01", "count": 1}, {"day": "2020-01-02", "count": 2},
+                             {"day": "2020-01-03", "count": 0}]
+
+
+# retries do mesmo DELETE/PUT em paralelo (o cliente do frontend repete em
+# timeout): só um aplica, e os contadores e o feed continuam consistentes
+@pytest.mark.integration
+def test_delete_repetido_mantem_estatisticas(client, db_engine):
+    from concurrent.futures import ThreadPoolExecutor
+
+    r = client.post("/auth/register", json={"name": "User Retry", "email": "retry_user@example.com",
+                                            "password": "senha123"})
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    ids = [client.post("/api/tasks", headers=headers, json={
+        "title": f"Retry {i}", "status": "todo", "start_at": "2020-01-01T08:00:00",
+        "end_at": "2020-01-01T09:00:00"}).json()["id"] for i in range(2)]
+
+    with ThreadPoolExecutor(4) as pool:
+        apagou = list(pool.map(lambda _: client.delete(f"/api/tasks/{ids[0]}", headers=headers).status_code,
+                                range(4)))
+        mudou = list(pool.map(lambda _: client.put(f"/api/tasks/{ids[1]}", headers=headers, json={
+            "title": "Retry 1", "status": "done", "start_at": "2020-01-02T08:00:00",
+            "end_at": "2020-01-02T09:00:00"}).status_code, range(4)))
+    assert sorted(apagou) == [204, 404, 404, 404]
+    assert mudou == [200] * 4
+
+    st = client.get("/api/tasks/stats", headers=headers,
+                    params={"from": "2020-01-01", "to": "2020-01-03"}).json()
+    assert st["total"] == 1
+    assert st["by_status"] == {"todo": 0, "doing": 0, "done": 1}
+    assert st["per_day"] == [{"day": "2020-01-01", "count": 0}, {"day": "2020-01-02", "count": 1}]
+    with db_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM task_tombstones WHERE task_id = :id"),
+                            {"id": ids[0]}).scalar() == 1
+
+# logout revoga só o token usado; o login seguinte recebe outro jti
+@pytest.mark.integration
+def test_logout_revoga_token(client):
+    body = {"name": "User Logout", "email": "logout_user@example.com", "password": "senha123"}
+    r = client.post("/auth/register", json=body)
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    assert client.get("/api/tasks", headers=headers).status_code == 200
+
+    assert client.post("/auth/logout", headers=headers).status_code == 204
+    r = client.get("/api/tasks", headers=headers)
+    assert r.status_code == 401
+    assert r.json()["detail"] == "token revoked"
+
+    r = client.post("/auth/login", json={"email": body["email"], "password": body["password"]})
+    novo = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    assert client.get("/api/tasks", headers=novo).status_code == 200
+
+# retry com o mesmo Idempotency-Key devolve a resposta original sem novo INSERT
+@pytest.mark.integration
+def test_idempotency_key_em_criacao_e_registro(client):
+    body = {"name": "User Idem", "email": "idem_user@example.com", "password": "senha123"}
+    r1 = client.post("/auth/register", json=body, headers={"Idempotency-Key": "reg-1"})
+    r2 = client.post("/auth/register", json=body, headers={"Idempotency-Key": "reg-1"})
+    assert r1.status_code == r2.status_code == 200
+    assert r2.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in r1.headers
+    # sem a chave o mesmo corpo é um novo register
+    assert client.post("/auth/register", json=body).status_code == 409
+
+    headers = {"Authorization": f"Bearer {r2.json()['accessToken']}"}
+    tarefa = {"title": "Uma vez", "start_at": "2025-03-01T09:00:00", "end_at": "2025-03-01T10:00:00"}
+    a = client.post("/api/tasks", json=tarefa, headers={**headers, "Idempotency-Key": "t-1"})
+    b = client.post("/api/tasks", json=tarefa, headers={**headers, "Idempotency-Key": "t-1"})
+    assert a.status_code == b.status_code == 201
+    assert a.json() == b.json()
+    assert b.headers["Idempotent-Replayed"] == "true"
+    # a chave diferencia maiúsculas
+    c = client.post("/api/tasks", json=tarefa, headers={**headers, "Idempotency-Key": "T-1"})
+    assert c.json()["id"] != a.json()["id"]
+    assert len(client.get("/api/tasks", headers=headers).json()) == 2
+
+    outra = {**tarefa, "title": "Outra"}
+    r = client.post("/api/tasks", json=outra, headers={**headers, "Idempotency-Key": "t-1"})
+    assert r.status_code == 422
+    r = client.post("/api/tasks", json=tarefa, headers={**headers, "Idempotency-Key": "x" * 65})
+    assert r.status_code == 400
+
+# login limitado por IP e /api limitado por usuário: 429 com Retry-After
+@pytest.mark.integration
+def test_rate_limit_por_ip_e_por_usuario(client, monkeypatch):
+    monkeypatch.setattr(app, "RATE_RULES", app.parse_rate_limits(
+        "POST /auth/login=2/60:ip;/api/=3/60:user"))
+    login = {"email": "ninguem@example.com", "password": "errada"}
+    assert [client.post("/auth/login", json=login).status_code for _ in range(3)] == [401, 401, 429]
+    r = client.post("/auth/login", json=login)
+    assert r.json()["detail"] == "rate limit exceeded"
+    assert 1 <= int(r.headers["Retry-After"]) <= 30
+
+    tokens = []
+    for i in range(2):
+        body = {"name": f"Rate {i}", "email": f"rate{i}@example.com", "password": "senha123"}
+        tokens.append(client.post("/auth/register", json=body).json()["accessToken"])
+    a, b = ({"Authorization": f"Bearer {t}"} for t in tokens)
+    assert [client.get("/api/tasks", headers=a).status_code for _ in range(4)] == [200, 200, 200, 429]
+    # outro usuário do mesmo IP tem o próprio bucket
+    assert client.get("/api/tasks", headers=b).status_code == 200
+
+# topologia do deploy: todo request vem do frontend (aqui o 'testclient'), que
+# manda o IP do usuário em X-Client-IP; só um cliente confiável pode fazer isso
+@pytest.mark.integration
+def test_rate_limit_com_frontend_como_cliente(client, monkeypatch):
+    monkeypatch.setattr(app, "RATE_RULES", app.parse_rate_limits("POST /auth/login=2/60:ip"))
+    login = {"email": "ninguem@example.com", "password": "errada"}
+
+    def tentativas(ip, n=3):
+        return [client.post("/auth/login", json=login, headers={"X-Client-IP": ip}).status_code
+                for _ in range(n)]
+
+    # sem confiar no frontend o header é ignorado: um bucket só para todo mundo
+    assert tentativas("10.0.0.1") == [401, 401, 429]
+    assert tentativas("10.0.0.2", 1) == [429]
+
+    app.RATE_BUCKETS.clear()
+    monkeypatch.setattr(app, "TRUSTED_CLIENTS", app.parse_trusted_clients("192.168.90.0/24,testclient"))
+    assert tentativas("10.0.0.1") == [401, 401, 429]
+    assert tentativas("10.0.0.2") == [401, 401, 429]  # cada usuário final tem o próprio bucket
+    assert app.trusted_client("192.168.90.10") and not app.trusted_client("192.168.40.7")
+
+# busca por palavras (prefixo, sem acento) ordenada por relevância e paginada
+@pytest.mark.integration
+def test_busca_de_tarefas(client):
+    r = client.post("/auth/register", json={"name": "User Busca", "email": "busca_user@example.com",
+                                            "password": "senha123"})
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    ids = {}
+    for title, desc in (("Reunião de orçamento", "planilha do trimestre"),
+                        ("Revisar planilha", None),
+                        ("Orçamento anual", "reunião com a diretoria sobre o orçamento"),
+                        ("Academia", "treino")):
+        r = client.post("/api/tasks", headers=headers, json={
+            "title": title, "description": desc,
+            "start_at": "2025-05-01T09:00:00", "end_at": "2025-05-01T10:00:00"})
+        ids[title] = r.json()["id"]
+
+    r = client.get("/api/tasks/search", headers=headers, params={"q": "orcament reuniao"})
+    assert r.status_code == 200
+    assert {t["id"] for t in r.json()} == {ids["Orçamento anual"], ids["Reunião de orçamento"]}
+    # "Orçamento anual" tem orçamento no título e na descrição
+    r = client.get("/api/tasks/search", headers=headers, params={"q": "orçamento"})
+    assert [t["id"] for t in r.json()] == [ids["Orçamento anual"], ids["Reunião de orçamento"]]
+
+    r = client.get("/api/tasks/search", headers=headers, params={"q": "planilha", "limit": 1})
+    assert len(r.json()) == 1
+    r2 = client.get("/api/tasks/search", headers=headers,
+                    params={"q": "planilha", "limit": 1, "cursor": r.headers["X-Next-Cursor"]})
+    assert "X-Next-Cursor" not in r2.headers
+    assert {r.json()[0]["id"], r2.json()[0]["id"]} == {ids["Reunião de orçamento"], ids["Revisar planilha"]}
+
+    # índice acompanha as escritas
+    client.delete(f"/api/tasks/{ids['Academia']}", headers=headers)
+    assert client.get("/api/tasks/search", headers=headers, params={"q": "treino"}).json() == []
+    assert client.get("/api/tasks/search", headers=headers, params={"q": "de a"}).status_code == 400
+    assert client.get("/api/tasks/search", headers=headers,
+                      params={"q": "treino", "cursor": "lixo"}).status_code == 400
+
+# tarefa recorrente: uma regra, ocorrências geradas por janela, exceções por ocorrência
+@pytest.mark.integration
+def test_tarefas_recorrentes(client):
+    r = client.post("/auth/register", json={"name": "User Rec", "email": "rec_user@example.com",
+                                            "password": "senha123"})
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+
+    regra = {"title": "Academia", "start_at": "2025-01-06T07:00:00", "end_at": "2025-01-06T08:00:00",
+             "rrule": "FREQ=WEEKLY;BYDAY=MO,WE,FR"}
+    assert client.post("/api/rules", headers=headers, json={**regra, "rrule": "FREQ=HOURLY"}).status_code == 400
+    criada = client.post("/api/rules", headers=headers, json=regra)
+    assert criada.status_code == 201
+    rule_id = criada.json()["id"]
+    assert [x["rrule"] for x in client.get("/api/rules", headers=headers).json()] == ["FREQ=WEEKLY;BYDAY=MO,WE,FR"]
+
+    janela = {"from": "2025-03-03T00:00:00", "to": "2025-03-10T00:00:00"}
+    occ = client.get("/api/rules/occurrences", params=janela, headers=headers).json()
+    assert [o["start_at"] for o in occ] == ["2025-03-03T07:00:00", "2025-03-05T07:00:00", "2025-03-07T07:00:00"]
+    assert client.get("/api/tasks", headers=headers).json() == []
+
+    url = f"/api/rules/{rule_id}/exceptions"
+    assert client.put(url, headers=headers, json={"occurrence_at": "2025-03-04T07:00:00",
+                                                  "cancelled": True}).status_code == 404
+    assert client.put(url, headers=headers, json={"occurrence_at": "2025-03-03T07:00:00",
+                                                  "cancelled": True}).status_code == 200
+    assert client.put(url, headers=headers, json={"occurrence_at": "2025-03-05T07:00:00", "status": "done",
+                                                  "start_at": "2025-03-10T18:00:00",
+                                                  "end_at": "2025-03-10T19:00:00"}).status_code == 200
+    occ = client.get("/api/rules/occurrences", params=janela, headers=headers).json()
+    assert [o["start_at"] for o in occ] == ["2025-03-07T07:00:00"]
+    depois = client.get("/api/rules/occurrences", headers=headers,
+                        params={"from": "2025-03-10T00:00:00", "to": "2025-03-11T00:00:00"}).json()
+    assert [(o["start_at"], o["status"], o["occurrence_at"]) for o in depois] == [
+        ("2025-03-10T07:00:00", "todo", "2025-03-10T07:00:00"),
+        ("2025-03-10T18:00:00", "done", "2025-03-05T07:00:00")]
+
+    com_fim = client.post("/api/rules", headers=headers, json={**regra, "rrule": "FREQ=DAILY;COUNT=3"}).json()["id"]
+    occ = client.get("/api/rules/occurrences", headers=headers,
+                     params={"from": "2025-01-01T00:00:00", "to": "2025-02-01T00:00:00"}).json()
+    assert sum(o["rule_id"] == com_fim for o in occ) == 3
+
+    assert client.delete(f"/api/rules/{rule_id}", headers=headers).status_code == 204
+    assert client.delete(f"/api/rules/{rule_id}", headers=headers).status_code == 404
+    assert client.get("/api/rules/occurrences", params=janela, headers=headers).json() == []
+
+# arquivamento: 'done' antigas saem da tabela quente em lotes e continuam
+# visíveis com include_archived; update nelas dá 409 e delete funciona
+@pytest.mark.integration
+def test_arquivamento_de_tarefas_concluidas(client, db_engine, monkeypatch):
+    import json
+
+    r = client.post("/auth/register", json={"name": "User Arq", "email": "arq_user@example.com",
+                                            "password": "senha123"})
+    headers = {"Authorization": f"Bearer {r.json()['accessToken']}"}
+    ids = []
+    for i, status in enumerate(["done", "todo", "done", "done"]):
+        ids.append(client.post("/api/tasks", headers=headers, json={
+            "title": f"Arq {i}", "start_at": f"2020-01-0{i + 1}T10:00:00",
+            "end_at": f"2020-01-0{i + 1}T11:00:00", "status": status}).json()["id"])
+    recente = client.post("/api/tasks", headers=headers, json={
+        "title": "Recente", "start_at": "2099-01-01T10:00:00", "end_at": "2099-01-01T11:00:00",
+        "status": "done"}).json()["id"]
+    antes = client.get("/api/tasks", headers=headers)
+
+    assert app.ARCHIVER.run_once(db_engine) == 0   # desligado por padrão
+    monkeypatch.setattr(app, "ARCHIVE_AFTER_DAYS", 90)
+    monkeypatch.setattr(app, "ARCHIVE_BATCH", 2)
+    monkeypatch.setattr(app, "ARCHIVE_PAUSE", 0)
+    assert app.ARCHIVER.run_once(db_engine) == 3
+    assert app.ARCHIVER.run_once(db_engine) == 0   # nada sobrando: a próxima rodada não faz nada
+
+    quente = client.get("/api/tasks", headers={**headers, "If-None-Match": antes.headers["ETag"]})
+    assert quente.status_code == 200
+    assert [t["id"] for t in quente.json()] == [ids[1], recente]
+    p1 = client.get("/api/tasks", params={"include_archived": "true", "limit": 3}, headers=headers)
+    assert [t["id"] for t in p1.json()] == ids[:3]
+    p2 = client.get("/api/tasks", params={"include_archived": "true", "limit": 3,
+                                          "cursor": p1.headers["X-Next-Cursor"]}, headers=headers)
+    assert [t["id"] for t in p2.json()] == [ids[3], recente]
+    desc = client.get("/api/tasks", params={"include_archived": "true", "order": "desc", "status": "done"},
+                      headers=headers)
+    assert [t["id"] for t in desc.json()] == [recente, ids[3], ids[2], ids[0]]
+    assert client.get("/api/tasks/stats", headers=headers).json()["total"] == 5
+
+    exportadas = client.get("/api/tasks/export", params={"include_archived": "true"}, headers=headers)
+    assert [json.loads(linha)["id"] for linha in exportadas.text.splitlines()] == \
+        [ids[1], recente, ids[0], ids[2], ids[3]]
+    assert len(client.get("/api/tasks/export", headers=headers).text.splitlines()) == 2
+
+    tarefa = {"title": "x", "start_at": "2020-01-01T10:00:00", "end_at": "2020-01-01T11:00:00"}
+    assert client.put(f"/api/tasks/{ids[0]}", headers=headers, json=tarefa).status_code == 409
+    assert client.delete(f"/api/tasks/{ids[0]}", headers=headers).status_code == 204
+    assert client.put(f"/api/tasks/{ids[0]}", headers=headers, json=tarefa).status_code == 404
+    lote = client.post("/api/tasks:batch", headers=headers, json={"ops": [
+        {"op": "update", "id": ids[2], "task": tarefa}, {"op": "delete", "id": ids[3]},
+        {"op": "delete", "id": ids[0]}]}).json()
+    assert [x["status"] for x in lote["results"]] == [409, 204, 404]
+    assert client.get("/api/tasks/stats", headers=headers).json()["total"] == 3
@@ -92,3 +92,413 @@ def test_taskin_defaults_todo_medium():
 
     assert ti.status == "todo"
     assert ti.priority == "medium"
+
+# o cursor da paginação precisa ir e voltar sem perder (start_at, id)
+@pytest.mark.unit
+def test_cursor_ida_e_volta():
+    start = datetime(2025, 1, 1, 10, 30)
+    cur = app.encode_cursor(start, 123)
+
+    assert app.decode_cursor(cur) == (start, 123)
+    with pytest.raises(ValueError):
+        app.decode_cursor("isso-nao-e-cursor")
+
+# com o schema já confirmado, ensure_schema não pode tocar no banco
+@pytest.mark.unit
+def test_ensure_schema_nao_consulta_banco_quando_pronto(monkeypatch):
+    class SemBanco:
+        def get_bind(self):
+            raise AssertionError("não deveria consultar o banco")
+
+    monkeypatch.setattr(app, "_schema_ready", True)
+    app.ensure_schema(SemBanco())
+
+# o modo async usa a mesma URL do modo sync, só trocando o driver
+@pytest.mark.unit
+def test_make_async_db_url_troca_driver(monkeypatch):
+    monkeypatch.setattr(app, "DB_URL_TEMPLATE", None)
+    monkeypatch.setattr(app, "DB_ASYNC_DRIVER", "asyncmy")
+    assert app.make_async_db_url("database").startswith("mysql+asyncmy://")
+
+    monkeypatch.setattr(app, "DB_URL_TEMPLATE", "sqlite:////tmp/{host}.db")
+    assert app.make_async_db_url("a") == "sqlite+aiosqlite:////tmp/a.db"
+
+# o cache de identidade é limitado (LRU) e expira pelo TTL
+@pytest.mark.unit
+def test_ttlcache_lru_e_expiracao():
+    cache = app.TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"  # 1 vira o mais recente
+    cache.set(3, "c")           # estoura o limite: sai o 2
+    assert cache.get(2) is None
+    assert cache.get(3) == "c"
+
+    cache.set(4, "d", ttl=0)
+    assert cache.get(4) is None
+    assert cache.stats()["hits"] == 2
+
+# hash feito com custo menor que o configurado é refeito no login
+@pytest.mark.unit
+def test_verify_pw_refaz_hash_com_custo_antigo():
+    from passlib.context import CryptContext
+    antigo = CryptContext(schemes=["pbkdf2_sha256"], pbkdf2_sha256__default_rounds=1000).hash("senha")
+
+    ok, novo = app.verify_pw("senha", antigo)
+    assert ok is True
+    assert novo and f"${app.PWD_ROUNDS}$" in novo
+    assert app.verify_pw("senha", novo) == (True, None)
+
+# com o pool de hash saturado a resposta é 503 imediato (sem enfileirar)
+@pytest.mark.unit
+def test_hash_pw_saturado_devolve_503(monkeypatch):
+    import threading
+    from fastapi import HTTPException
+
+    cheio = threading.BoundedSemaphore(1)
+    cheio.acquire()
+    monkeypatch.setattr(app, "PWD_WORKERS", 2)
+    monkeypatch.setattr(app, "_pwd_slots", cheio)
+
+    with pytest.raises(HTTPException) as exc:
+        app.hash_pw("qualquer")
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "1"
+
+# roteamento entre hosts com SQLite no lugar do MySQL: o primeiro primário
+# está fora, então escrita vai para o segundo sem esperar o loop de retry;
+# leitura vai para a réplica e volta para o primário quando ela cai
+@pytest.mark.unit
+def test_router_failover_e_leitura_em_replica(tmp_path, monkeypatch):
+    def url(host):
+        if host == "fora":
+            return "sqlite:////caminho/que/nao/existe/fora.db"
+        return f"sqlite:///{tmp_path}/{host}.db"
+
+    monkeypatch.setattr(app, "make_db_url", url)
+    router = app.HostRouter(["fora", "p2"], ["r1"])
+    router.probe_due()
+
+    assert router.primary().host == "p2"
+    assert router.reader().host == "r1"
+
+    router.mark_down(router.state("r1"))
+    assert router.reader().host == "p2"
+    assert [s["up"] for s in router.status()] == [False, True, False]
+
+# réplica atrasada: usuário recém-registrado ou troca de senha que ela ainda
+# não viu não podem virar 401; a identidade é relida no primário
+@pytest.mark.unit
+def test_identidade_volta_ao_primario_com_replica_atrasada(tmp_path, monkeypatch):
+    from fastapi import HTTPException
+
+    monkeypatch.setattr(app, "make_db_url", lambda host: f"sqlite:///{tmp_path}/{host}.db")
+    monkeypatch.setattr(app, "ROUTER", app.HostRouter(["p1"], ["r1"]))
+    monkeypatch.setattr(app, "AUTH_TRUST_CLAIMS", False)
+    for st in app.ROUTER.primaries + app.ROUTER.replicas:
+        app.Base.metadata.create_all(st.get_engine())
+    app.USER_CACHE.clear()
+    app.TOKEN_CACHE.clear()
+
+    with app._session_for(app.ROUTER.state("p1")) as db:
+        u = app.User(email="lag@example.com", password_hash="x", name="Lag", token_version=2)
+        db.add(u); db.commit(); db.refresh(u)
+        token = app.mk_token(u)
+    replica = app._session_for(app.ROUTER.state("r1"))
+    ident = app.get_current_user(f"Bearer {token}", replica)
+    assert (ident.email, ident.token_version) == ("lag@example.com", 2)
+
+    # réplica com a versão antiga do usuário: idem
+    app.USER_CACHE.clear()
+    replica.add(app.User(id=u.id, email="lag@example.com", password_hash="x", name="Lag", token_version=1))
+    replica.commit()
+    assert app.get_current_user(f"Bearer {token}", replica).token_version == 2
+
+    # ausente também no primário: aí sim 401
+    fantasma = app.mk_token(app.User(id=999, email="x@example.com", name="X", token_version=0))
+    with pytest.raises(HTTPException) as exc:
+        app.get_current_user(f"Bearer {fantasma}", replica)
+    assert (exc.value.status_code, exc.value.detail) == (401, "user not found")
+    replica.close()
+
+# negociação de gzip pelo Accept-Encoding
+@pytest.mark.unit
+def test_accepts_gzip():
+    assert app.accepts_gzip("gzip, deflate, br") is True
+    assert app.accepts_gzip("br;q=1.0, gzip;q=0.5") is True
+    assert app.accepts_gzip("gzip;q=0") is False
+    assert app.accepts_gzip("identity") is False
+    assert app.accepts_gzip(None) is False
+
+# varredura de conflitos: pares sobrepostos, blocos ocupados e livres
+@pytest.mark.unit
+def test_sweep_conflicts_blocos_ocupados_e_livres():
+    d = datetime(2025, 6, 2)
+    h = lambda n: d + timedelta(hours=n)  # noqa: E731
+    rows = [(1, h(-2), h(1)), (2, h(0), h(2)), (3, h(2), h(3)), (4, h(5), h(6))]
+
+    conflicts, busy, free, truncated = app.sweep_conflicts(rows, h(0), h(8))
+
+    assert [(c["a"], c["b"], c["start"], c["end"]) for c in conflicts] == [(1, 2, h(0), h(1))]
+    assert busy == [{"start": h(0), "end": h(3)}, {"start": h(5), "end": h(6)}]
+    assert free == [{"start": h(3), "end": h(5)}, {"start": h(6), "end": h(8)}]
+    assert truncated is False
+    assert app.sweep_conflicts(rows[:2] * 3, h(0), h(8), max_pairs=2)[3] is True
+
+# histograma acumula por bucket e sai no formato texto do Prometheus
+@pytest.mark.unit
+def test_histograma_formato_prometheus():
+    h = app.Histogram("t_seconds", "teste", ("route",), buckets=(0.1, 1.0))
+    h.observe(0.05, "/a")
+    h.observe(0.5, "/a")
+    h.observe(5.0, "/a")
+    linhas = h.render()
+
+    assert 't_seconds_bucket{route="/a",le="0.1"} 1' in linhas
+    assert 't_seconds_bucket{route="/a",le="1.0"} 2' in linhas
+    assert 't_seconds_bucket{route="/a",le="+Inf"} 3' in linhas
+    assert 't_seconds_count{route="/a"} 3' in linhas
+    assert app._fmt_labels(("x",), ('a"b',)) == '{x="a\\"b"}'
+
+# deltas dos contadores: mudar status/dia tira de uma chave e põe em outra
+@pytest.mark.unit
+def test_count_deltas_move_entre_chaves():
+    d = app.CountDeltas()
+    d.remove("todo", "low", datetime(2025, 1, 1, 9))
+    d.add("done", "low", datetime(2025, 1, 2, 9))
+    d.add("done", "high", datetime(2025, 1, 2, 10))
+
+    assert d.counts == {("todo", "low"): -1, ("done", "low"): 1, ("done", "high"): 1}
+    assert d.days == {datetime(2025, 1, 1).date(): -1, datetime(2025, 1, 2).date(): 2}
+
+# atalho de JSON das listagens produz o mesmo que o TaskOut do Pydantic
+@pytest.mark.unit
+def test_json_rapido_igual_ao_taskout(monkeypatch):
+    import json
+
+    row = (7, "Título", None, datetime(2025, 1, 2, 8, 30), datetime(2025, 1, 2, 9, 0, 0, 500), "todo", "high")
+    esperado = app.TaskOut(**dict(zip(app.TASK_OUT_COLUMNS, row))).model_dump(mode="json")
+
+    assert json.loads(app.dumps_json(app.task_dicts([row]))) == [esperado]
+    # sem orjson instalado cai no json da stdlib, com a mesma saída
+    monkeypatch.setattr(app, "orjson", None)
+    assert json.loads(app.dumps_json(app.task_dicts([row]))) == [esperado]
+
+# backend JWT nativo (stdlib) compatível com o jose, e recusa adulteração/expiração
+@pytest.mark.unit
+def test_jwt_nativo_compativel_com_jose():
+    token = app._native_encode({"sub": "1", "exp": 4102444800}, "k")
+    assert jwt.decode(token, "k", algorithms=["HS256"])["sub"] == "1"
+    assert app._native_decode(jwt.encode({"sub": "2", "exp": 4102444800}, "k", algorithm="HS256"), "k")["sub"] == "2"
+
+    with pytest.raises(app.InvalidToken):
+        app._native_decode(token[:-2] + ("AA" if not token.endswith("AA") else "BB"), "k")
+    with pytest.raises(app.InvalidToken):
+        app._native_decode(app._native_encode({"sub": "1", "exp": 1}, "k"), "k")
+    with pytest.raises(app.InvalidToken):
+        app._native_decode("lixo", "k")
+
+# token verificado vai para o cache; jti revogado é recusado mesmo com cache
+@pytest.mark.unit
+def test_token_cache_e_revogacao(monkeypatch):
+    app.TOKEN_CACHE.clear()
+    token = app.mk_token(app.User(id=7, email="c@example.com", name="C"))
+    chamadas = []
+    real = app.jwt_decode
+    monkeypatch.setattr(app, "jwt_decode", lambda t, k: chamadas.append(t) or real(t, k))
+
+    claims = app.token_claims(f"Bearer {token}")
+    assert app.token_claims(f"Bearer {token}") == claims
+    assert len(chamadas) == 1
+
+    app.REVOKED.add(claims["jti"], claims["exp"])
+    with pytest.raises(app.HTTPException) as e:
+        app.token_claims(f"Bearer {token}")
+    assert e.value.detail == "token revoked"
+
+# pool dimensionado por workers/threads dentro de 90% do max_connections
+@pytest.mark.unit
+def test_pool_sizing():
+    assert app.pool_sizing(1, 40, 151) == (40, 40)   # orçamento 135: cobre leitura + escrita
+    assert app.pool_sizing(4, 40, 151) == (33, 0)    # 135 // 4 = 33 conexões por worker
+    assert app.pool_sizing(2, 40, 151) == (40, 27)
+    assert app.pool_sizing(64, 40, 100) == (2, 0)    # nunca abaixo de 2
+
+# só conexão parada há mais de DB_PING_IDLE é testada; morta vira DisconnectionError
+@pytest.mark.unit
+def test_ping_so_em_conexao_parada(monkeypatch):
+    from sqlalchemy.exc import DisconnectionError
+
+    class Conn:
+        def __init__(self, vivo):
+            self.vivo, self.pings = vivo, 0
+
+        def cursor(self):
+            return self
+
+        def execute(self, sql):
+            self.pings += 1
+            if not self.vivo:
+                raise OSError("gone")
+
+        def close(self):
+            pass
+
+    class Record:
+        def __init__(self):
+            self.info = {}
+
+    monkeypatch.setattr(app, "DB_PING_IDLE", 30)
+    checkout, checkin = app._idle_ping_listeners("h")
+    rec, conn = Record(), Conn(vivo=False)
+
+    checkout(conn, rec, None)             # conexão nova: sem ping
+    checkin(conn, rec)
+    checkout(conn, rec, None)             # usada agora há pouco: sem ping
+    assert conn.pings == 0
+
+    antes = app.POOL_PINGS.value("h", "dead")
+    rec.info["last_used"] -= 31
+    with pytest.raises(DisconnectionError):
+        checkout(conn, rec, None)
+    assert conn.pings == 1
+    assert app.POOL_PINGS.value("h", "dead") == antes + 1
+
+# checkout que estoura DB_POOL_TIMEOUT responde 503 + Retry-After
+@pytest.mark.unit
+def test_pool_esgotado_devolve_503():
+    import asyncio
+    import json
+    from sqlalchemy import create_engine
+
+    engine = create_engine("sqlite://", poolclass=app.TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.01)
+    held = engine.connect()
+    try:
+        with pytest.raises(app.PoolTimeoutError) as exc:
+            engine.connect()
+    finally:
+        held.close()
+    resp = asyncio.run(app._pool_busy(None, exc.value))
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == app.DB_BUSY_RETRY_AFTER
+    assert json.loads(resp.body) == {"detail": "database busy"}
+
+# aquecimento do worker com SQLite: migra, abre o pool e só então /ready dá 200
+@pytest.mark.unit
+def test_warm_up_e_readiness(tmp_path, monkeypatch):
+    import json
+
+    monkeypatch.setattr(app, "make_db_url", lambda host: f"sqlite:///{tmp_path}/{host}.db")
+    monkeypatch.setattr(app, "ROUTER", app.HostRouter(["p1"], []))
+    monkeypatch.setattr(app, "_ready", app.threading.Event())
+    monkeypatch.setattr(app, "_schema_ready", False)
+
+    assert app.ready().status_code == 503
+    assert app.live() == {"status": "alive"}
+
+    assert app.warm_up() is True
+    resp = app.ready()
+    assert resp.status_code == 200
+    assert json.loads(resp.body) == {"status": "ready", "warm": True, "schema": True, "primary": True}
+    with app.ROUTER.primary().get_engine().connect() as conn:
+        versions = conn.execute(app.select(app.SchemaMigration.version)).scalars().all()
+    assert sorted(versions) == [v for v, _ in app.MIGRATIONS]
+
+    # erro no primário derruba /ready; o prober traz o host e reconfere o
+    # schema sem depender de request nenhum
+    app._dispose_engine()
+    assert json.loads(app.ready().body)["schema"] is False
+    app.ROUTER.probe_due()
+    assert app.recheck_schema() is True
+    assert app.ready().status_code == 200
+
+# hash do corpo independe da ordem dos campos e muda com o conteúdo
+@pytest.mark.unit
+def test_idempotency_hash_e_validacao():
+    from fastapi import HTTPException
+
+    a = app.TaskIn(title="T", start_at="2025-01-01T09:00:00", end_at="2025-01-01T10:00:00")
+    b = app.TaskIn(end_at="2025-01-01T10:00:00", start_at="2025-01-01T09:00:00", title="T")
+    c = app.TaskIn(title="U", start_at="2025-01-01T09:00:00", end_at="2025-01-01T10:00:00")
+    assert app.idempotency("tasks:1", None, a) is None
+    assert app.idempotency("tasks:1", " k ", a).key == "k"
+    assert app.idempotency("tasks:1", "k", a).request_hash == app.idempotency("tasks:1", "k", b).request_hash
+    assert app.idempotency("tasks:1", "k", a).request_hash != app.idempotency("tasks:1", "k", c).request_hash
+    for ruim in ("", "x" * 65, "chave-ç"):
+        with pytest.raises(HTTPException) as exc:
+            app.idempotency("tasks:1", ruim, a)
+        assert exc.value.status_code == 400
+
+# regras de rate limit e token bucket em memória (recarga proporcional ao tempo)
+@pytest.mark.unit
+def test_rate_limit_regras_e_token_bucket(monkeypatch):
+    import asyncio
+
+    rules = app.parse_rate_limits("POST /auth/login=2/60:ip; POST /api/tasks:batch=1/1; /api/=10/1:user")
+    assert [(r.method, r.prefix, r.by) for r in rules] == [
+        ("POST", "/auth/login", "ip"), ("POST", "/api/tasks:batch", "user"), (None, "/api/", "user")]
+    assert rules[0].rate == pytest.approx(2 / 60) and rules[0].burst == 2
+    monkeypatch.setattr(app, "RATE_RULES", rules)
+    assert app.match_rate_rule("POST", "/api/tasks:batch").prefix == "/api/tasks:batch"
+    assert app.match_rate_rule("GET", "/api/tasks").prefix == "/api/"
+    assert app.match_rate_rule("GET", "/auth/login") is None
+
+    agora = [100.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: agora[0])
+    buckets = app.MemoryBuckets(max_keys=2)
+    take = lambda k: asyncio.run(buckets.take(k, 0.5, 2))  # noqa: E731
+    assert take("a") == 0 and take("a") == 0
+    assert take("a") == pytest.approx(2.0)   # vazio: 1 token a cada 2 s
+    agora[0] += 2
+    assert take("a") == 0
+    take("b"); take("c")                     # "a" sai do LRU e volta cheio
+    assert take("a") == 0 and take("a") == 0
+
+# índice invertido do fallback: termos sem acento, prefixo, AND e relevância
+@pytest.mark.unit
+def test_indice_de_busca_em_memoria():
+    assert app.search_terms("Reunião às 10h: ORÇAMENTO!") == ["reuniao", "as", "10h", "orcamento"]
+    idx = app._OwnerIndex(1, [(1, "Orçamento", "planilha"), (2, "Planilha de gastos", "orçamento mensal"),
+                              (3, "Mercado", None)])
+    assert idx.search(["orc"], 10) == [1, 2]          # título pesa o dobro
+    assert idx.search(["plan", "orcamento"], 10) == [1, 2]  # empate: id
+    assert idx.search(["plan", "orcamento"], 1) == [1]
+    assert idx.search(["orcamento", "mercado"], 10) == []
+
+    from collections import namedtuple
+    Row = namedtuple("Row", "id title description")
+    idx.apply(2, [Row(1, "Feira", None), Row(4, "Mercado central", None)], [3])
+    assert idx.version == 2
+    assert idx.search(["orc"], 10) == [2]
+    assert idx.search(["merc"], 10) == [4]
+    assert "orcamento" in idx.tokens and "feira" in idx.tokens and "central" in idx.tokens
+
+# RRULE: partes aceitas, erros e expansão só da janela pedida
+@pytest.mark.unit
+def test_regra_de_recorrencia():
+    r = app.parse_rrule("RRULE:freq=weekly;byday=WE,MO;count=5")
+    assert (r.freq, r.interval, r.count, r.byday) == ("WEEKLY", 1, 5, (0, 2))
+    assert app.parse_rrule("FREQ=DAILY;UNTIL=20250110").until == datetime(2025, 1, 10, 23, 59, 59, 999999)
+    for bad in ("FREQ=HOURLY", "FREQ=DAILY;BYDAY=MO", "FREQ=DAILY;COUNT=2;UNTIL=20250101",
+                "FREQ=DAILY;INTERVAL=0", "FREQ=DAILY;BYSETPOS=1", "FREQ=WEEKLY;BYDAY=XX"):
+        with pytest.raises(ValueError):
+            app.parse_rrule(bad)
+
+    hora = timedelta(hours=1)
+    inicio = datetime(2025, 1, 6, 9)  # segunda
+    ultima = app.rule_last_start(r, inicio, hora)
+    assert ultima == datetime(2025, 1, 20, 9)
+    occ = list(app.rule_occurrences(r, inicio, hora, datetime(2025, 1, 8, 9, 30), datetime(2026, 1, 1), ultima))
+    assert occ == [datetime(2025, 1, 8, 9), datetime(2025, 1, 13, 9), datetime(2025, 1, 15, 9),
+                   datetime(2025, 1, 20, 9)]
+
+    # diária sem fim desde 2000: a janela de 2090 não percorre as ocorrências anteriores
+    diaria = app.parse_rrule("FREQ=DAILY;INTERVAL=2")
+    assert list(app.rule_occurrences(diaria, datetime(2000, 1, 1, 9), hora,
+                                     datetime(2090, 3, 1), datetime(2090, 3, 6))) == \
+        [datetime(2090, 3, 1, 9), datetime(2090, 3, 3, 9), datetime(2090, 3, 5, 9)]
+    # dia 31 só nos meses que têm 31 dias
+    mensal = app.parse_rrule("FREQ=MONTHLY")
+    assert [d.month for d in app.rule_occurrences(mensal, datetime(2025, 1, 31), hora,
+                                                  datetime(2025, 1, 1), datetime(2025, 6, 1))] == [1, 3, 5]